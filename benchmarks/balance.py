@@ -0,0 +1,42 @@
+"""
+Compare the vectorised training stress balance with the per-day loop it
+replaced.
+
+Run from the repository root with ``python -m benchmarks.balance``.
+"""
+import math
+import timeit
+
+import numpy
+
+from fitness.balance import training_stress_balance
+
+
+def loop_balance(trimp):
+    fitness = fatigue = 0.0
+    history = []
+    for index, value in enumerate(trimp):
+        if index:
+            fitness = fitness + (value - fitness) * (1.0 - math.exp(-1.0 / 42.0))
+            fatigue = fatigue + (value - fatigue) * (1.0 - math.exp(-1.0 / 7.0))
+        history.append((fitness, fatigue, fitness - fatigue))
+    return history
+
+
+def main():
+    print('{:>8} {:>12} {:>12} {:>8}'.format('days', 'loop (ms)', 'numpy (ms)', 'speedup'))
+    for years in (1, 10, 50):
+        days = years * 365
+        state = numpy.random.RandomState(days)
+        trimp = state.gamma(2, 40, days) * (state.uniform(size=days) < 0.6)
+        values = trimp.tolist()
+        repeat = max(1, 20000 // days)
+        loop = min(timeit.repeat(lambda: loop_balance(values), number=repeat, repeat=3)) / repeat
+        vector = min(timeit.repeat(lambda: training_stress_balance(trimp), number=repeat, repeat=3)) / repeat
+        fitness = training_stress_balance(trimp)[0]
+        assert numpy.allclose(fitness, [a[0] for a in loop_balance(values)], rtol=1e-10, atol=1e-9)
+        print('{:>8} {:>12.3f} {:>12.3f} {:>7.1f}x'.format(days, loop * 1000, vector * 1000, loop / vector))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Time building the map GeoJSON from a simplified track, which the tests
+only check for allocations since wall clock time varies between machines.
+
+Run from the repository root with ``python -m benchmarks.geo_json``.
+"""
+import datetime
+import timeit
+
+import django
+import numpy
+from django.conf import settings
+
+settings.configure(
+    INSTALLED_APPS=(
+        'django.contrib.auth',
+        'django.contrib.contenttypes',
+        'rest_framework',
+        'fitness.apps.FitnessConfig',
+    ),
+    USE_TZ=True,
+)
+django.setup()
+
+from fitness.models import Activity  # NOQA: E402
+from fitness.streams import PointStream  # NOQA: E402
+
+
+def make_activity(count):
+    """
+    An activity with a wandering track, so simplifying it keeps the most
+    points the GeoJSON allows.
+    """
+    state = numpy.random.RandomState(count)
+    start = datetime.datetime(2017, 1, 1, tzinfo=datetime.timezone.utc)
+    latitude = 51 + numpy.cumsum(state.normal(0, 1e-4, count)).round(6)
+    longitude = numpy.cumsum(state.normal(0, 1e-4, count)).round(6)
+    return Activity(stream_data=PointStream.from_points([
+        {
+            'time': start + datetime.timedelta(seconds=i), 'latitude': a, 'longitude': b,
+            'heart_rate': 90 + i % 90, 'distance': i * 3.0, 'speed': 3.0, 'altitude': i % 40, 'cadence': None,
+        }
+        for i, (a, b) in enumerate(zip(latitude.tolist(), longitude.tolist()))
+    ]).to_bytes(), track_detail=None)
+
+
+def main():
+    print('{:>8} {:>12} {:>12}'.format('points', 'features', 'build (ms)'))
+    for count in (1000, 10000, 50000):
+        activity = make_activity(count)
+        activity.simplified()
+        features = activity.build_geo_json()
+        seconds = min(timeit.repeat(activity.build_geo_json, number=10, repeat=3)) / 10
+        print('{:>8} {:>12} {:>12.3f}'.format(count, len(features), seconds * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Compare bulk point validation with the per-point PointSerializer path and
+the separate summary passes it replaced.
+
+Run from the repository root with ``python -m benchmarks.serializers``.
+"""
+import datetime
+import timeit
+
+import django
+import numpy
+from django.conf import settings
+
+settings.configure(
+    INSTALLED_APPS=(
+        'django.contrib.auth',
+        'django.contrib.contenttypes',
+        'rest_framework',
+        'fitness.apps.FitnessConfig',
+    ),
+    USE_TZ=True,
+)
+django.setup()
+
+from fitness.serializers import PointListField, PointSerializer, RunSerializer  # NOQA: E402
+from fitness.streams import PointStream  # NOQA: E402
+
+
+def loop_defaults(points):
+    points = PointSerializer(many=True).run_validation(points)
+    gain = 0
+    last_elevation = None
+    points_up = 0
+    for point in points:
+        if last_elevation is not None and point['altitude'] > last_elevation:
+            if points_up < 2:
+                points_up += 1
+            else:
+                gain += (int(point['altitude']) - int(last_elevation))
+        else:
+            points_up = 0
+        last_elevation = point['altitude']
+    return {
+        'distance': max(a['distance'] for a in points),
+        'duration': (max(a['time'] for a in points) - min(a['time'] for a in points)).total_seconds(),
+        'elevation': gain,
+        'data_points': len(points),
+        'stream': PointStream.from_points(points).encode(),
+    }
+
+
+def bulk_defaults(points):
+    return RunSerializer.defaults({'name': 'Run', 'points': PointListField().run_validation(points)})
+
+
+def make_points(count):
+    state = numpy.random.RandomState(count)
+    start = datetime.datetime(2017, 1, 1, tzinfo=datetime.timezone.utc)
+    return [
+        {
+            'time': (start + datetime.timedelta(seconds=a)).isoformat(),
+            'altitude': b,
+            'cadence': 85.0,
+            'distance': a * 3.0,
+            'heart_rate': c,
+            'latitude': 51.0 + a * 1e-5,
+            'longitude': -1.0 - a * 1e-5,
+            'speed': 3.0,
+        }
+        for a, b, c in zip(
+            range(count), state.uniform(10, 30, count).tolist(), state.uniform(100, 180, count).tolist()
+        )
+    ]
+
+
+def main():
+    print('{:>8} {:>12} {:>12} {:>8}'.format('points', 'loop (ms)', 'bulk (ms)', 'speedup'))
+    for count in (1000, 10000, 50000):
+        points = make_points(count)
+        repeat = max(1, 10000 // count)
+        loop = min(timeit.repeat(lambda: loop_defaults(points), number=repeat, repeat=3)) / repeat
+        bulk = min(timeit.repeat(lambda: bulk_defaults(points), number=repeat, repeat=3)) / repeat
+        expected, actual = loop_defaults(points), bulk_defaults(points)
+        assert all(expected[a] == actual[a] for a in expected)
+        print('{:>8} {:>12.3f} {:>12.3f} {:>7.1f}x'.format(count, loop * 1000, bulk * 1000, loop / bulk))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Compare the size and decode time of the JSON stream format with the
+compressed binary one, and the size of the original per-point JSON.
+
+Run from the repository root with ``python -m benchmarks.streams``.
+"""
+import datetime
+import json
+import timeit
+
+import numpy
+
+from fitness.streams import PointStream
+
+
+def make_stream(count):
+    state = numpy.random.RandomState(count)
+    start = datetime.datetime(2017, 1, 1, tzinfo=datetime.timezone.utc)
+    speed = 3 + state.normal(0, 0.1, count)
+    points = [
+        {
+            'time': start + datetime.timedelta(seconds=a),
+            'latitude': round(51.5 + a * 1e-5 + b, 7),
+            'longitude': round(-0.12 + a * 1e-5, 7),
+            'altitude': round(c, 1),
+            'distance': round(d, 2),
+            'speed': round(e, 3),
+            'heart_rate': float(f),
+            'cadence': 85.0,
+        }
+        for a, b, c, d, e, f in zip(
+            range(count), state.normal(0, 1e-6, count).tolist(),
+            (20 + numpy.cumsum(state.normal(0, 0.2, count))).tolist(),
+            numpy.cumsum(speed).tolist(), speed.tolist(), state.randint(120, 170, count).tolist(),
+        )
+    ]
+    return PointStream.from_points(points)
+
+
+def main():
+    print('{:>8} {:>12} {:>12} {:>12} {:>12} {:>12}'.format(
+        'points', 'legacy (B)', 'json (B)', 'binary (B)', 'json (ms)', 'binary (ms)'
+    ))
+    for count in (1000, 10000, 50000):
+        stream = make_stream(count)
+        legacy = json.dumps(stream.legacy(), default=lambda h: h.isoformat())
+        text = json.dumps(stream.encode())
+        data = stream.to_bytes()
+        repeat = max(1, 100000 // count)
+        from_json = min(timeit.repeat(
+            lambda: PointStream.decode(json.loads(text)), number=repeat, repeat=3
+        )) / repeat
+        from_binary = min(timeit.repeat(lambda: PointStream.decode(data), number=repeat, repeat=3)) / repeat
+        decoded = PointStream.decode(data)
+        assert all(
+            numpy.array_equal(a, decoded.columns[b], equal_nan=True)
+            for b, a in PointStream.decode(json.loads(text)).columns.items()
+        )
+        print('{:>8} {:>12} {:>12} {:>12} {:>12.3f} {:>12.3f}'.format(
+            count, len(legacy), len(text), len(data), from_json * 1000, from_binary * 1000
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Compare the vectorised TRIMP engine with the per-point loop it replaced.
+
+Run from the repository root with ``python -m benchmarks.trimp``.
+"""
+import datetime
+import math
+import timeit
+
+import numpy
+
+from fitness.trimp import calculate_trimp
+
+MINIMUM_HEART_RATE = 60
+MAXIMUM_HEART_RATE = 190
+
+
+def loop_trimp(points):
+    trimp = 0
+    last_point = None
+    for point in points:
+        if last_point is not None:
+            minutes = (point['time'] - last_point['time']).total_seconds() / 60.0
+            average_heart_rate = (point['heart_rate'] + last_point['heart_rate']) / 2
+            reserve = max(
+                (average_heart_rate - MINIMUM_HEART_RATE) / (MAXIMUM_HEART_RATE - MINIMUM_HEART_RATE), 0
+            )
+            trimp += minutes * reserve * 0.64 * math.exp(1.92 * reserve)
+        last_point = point
+    return trimp
+
+
+def make_stream(count):
+    state = numpy.random.RandomState(count)
+    times = numpy.arange(count, dtype=numpy.float64)
+    heart_rates = state.uniform(100, 180, count)
+    start = datetime.datetime(2017, 1, 1)
+    points = [
+        {'time': start + datetime.timedelta(seconds=a), 'heart_rate': b}
+        for a, b in zip(times.tolist(), heart_rates.tolist())
+    ]
+    return times, heart_rates, points
+
+
+def main():
+    print('{:>8} {:>12} {:>12} {:>8}'.format('points', 'loop (ms)', 'numpy (ms)', 'speedup'))
+    for count in (1000, 10000, 100000):
+        times, heart_rates, points = make_stream(count)
+        repeat = max(1, 100000 // count)
+        loop = min(timeit.repeat(lambda: loop_trimp(points), number=repeat, repeat=3)) / repeat
+        vector = min(timeit.repeat(
+            lambda: calculate_trimp(times, heart_rates, MINIMUM_HEART_RATE, MAXIMUM_HEART_RATE, 'M'),
+            number=repeat, repeat=3
+        )) / repeat
+        assert abs(loop_trimp(points) - calculate_trimp(
+            times, heart_rates, MINIMUM_HEART_RATE, MAXIMUM_HEART_RATE, 'M'
+        )) < 1e-6
+        print('{:>8} {:>12.3f} {:>12.3f} {:>7.1f}x'.format(count, loop * 1000, vector * 1000, loop / vector))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+import math
+
+import numpy
+
+FITNESS_DAYS = 42
+FATIGUE_DAYS = 7
+# Decay powers within a block reach exp(BLOCK_SPAN), far inside float range.
+BLOCK_SPAN = 300
+
+
+def exponential_average(values, days, initial=0.0):
+    """
+    Exponentially weighted moving average of daily ``values``.
+
+    Evaluates ``y[i] = y[i - 1] + (values[i] - y[i - 1]) * (1 - exp(-1 / days))``
+    with ``y[-1] = initial`` in closed form, a cumulative sum scaled by powers
+    of the decay factor.  Long series are split into blocks so those powers
+    cannot overflow.  Results agree with the day by day recurrence to
+    rounding, not bit for bit, and so does a series continued from
+    ``initial`` with the same series computed whole.
+    """
+    values = numpy.asarray(values, dtype=numpy.float64)
+    decay = math.exp(-1.0 / days)
+    gain = 1.0 - decay
+    block = int(max(1, min(len(values), days * BLOCK_SPAN)))
+    powers = decay ** numpy.arange(1, block + 1)
+    output = numpy.empty(len(values))
+    last = initial
+    for first in range(0, len(values), block):
+        chunk = values[first:first + block]
+        scale = powers[:len(chunk)]
+        output[first:first + len(chunk)] = scale * (last + gain * numpy.cumsum(chunk / scale))
+        last = output[first + len(chunk) - 1]
+    return output
+
+
+def training_stress_balance(trimp, fitness_days=FITNESS_DAYS, fatigue_days=FATIGUE_DAYS, seed=None):
+    """
+    Fitness, fatigue and form arrays for a dense daily ``trimp`` array.
+
+    ``seed`` is the ``(fitness, fatigue)`` of the day before the first one.
+    Without it the first day starts the history and stays at zero.
+    """
+    trimp = numpy.asarray(trimp, dtype=numpy.float64)
+    if seed is None:
+        fitness = numpy.zeros(len(trimp))
+        fatigue = numpy.zeros(len(trimp))
+        fitness[1:] = exponential_average(trimp[1:], fitness_days)
+        fatigue[1:] = exponential_average(trimp[1:], fatigue_days)
+    else:
+        fitness = exponential_average(trimp, fitness_days, seed[0])
+        fatigue = exponential_average(trimp, fatigue_days, seed[1])
+    return fitness, fatigue, fitness - fatigue
@@ -13,7 +13,7 @@ class ProfileForm(ModelForm):
 class HeartRateForm(ModelForm):
     class Meta:
         model = Profile
-        fields = ['minimum_heart_rate', 'maximum_heart_rate']
+        fields = ['minimum_heart_rate', 'maximum_heart_rate', 'fitness_days', 'fatigue_days']
 
 
 class UserForm(ModelForm):
@@ -0,0 +1,310 @@
+import collections
+import datetime
+import multiprocessing
+
+from django.contrib.auth.models import User
+from django.db import connections, transaction
+from django.db.models import Case, IntegerField, Value, When
+from django.utils import timezone
+
+from . import models, parsers, pyramid
+from .serializers import RunSerializer
+from .streams import PointStream
+from .tasks import TASKS
+from .trimp import calculate_trimp
+
+CHUNK_SIZE = 200
+# A recalculation still pending after this long was lost from the in-memory
+# queue of a process that has since stopped.
+PENDING_GRACE = datetime.timedelta(minutes=2)
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def trimp_task(task):
+    pk, stream, minimum_heart_rate, maximum_heart_rate, gender = task
+    points = PointStream.decode(stream)
+    trimp = calculate_trimp(
+        points.column('time'), points.column('heart_rate'), minimum_heart_rate, maximum_heart_rate, gender
+    )
+    return pk, int(trimp) if trimp else None
+
+
+def update_trimp(values):
+    if not values:
+        return
+    models.Activity.objects.filter(pk__in=list(values)).update(trimp_dirty=False, trimp=Case(
+        *[When(pk=pk, then=Value(trimp)) for pk, trimp in values.items()],
+        output_field=IntegerField()
+    ))
+
+
+def create_pool(processes=None):
+    if processes == 1:
+        return None
+    # Forked workers must not inherit open database connections.
+    connections.close_all()
+    return multiprocessing.Pool(processes)
+
+
+def recalculate_trimp(user, pool=None, chunk_size=CHUNK_SIZE, progress=None, only_dirty=False):
+    profile = user.profile
+    trimp_settings = profile.trimp_settings()
+    activities = models.Activity.objects.filter(owner=user)
+    if only_dirty:
+        activities = activities.filter(trimp_dirty=True)
+    total = activities.count()
+    mapper = pool.map if pool is not None else map
+    done = 0
+    if progress is not None:
+        progress(done, total)
+    for chunk in chunks(activities.values_list('id', 'stream', 'stream_data').iterator(), chunk_size):
+        tasks = [(pk, models.stored_stream(stream, data)) + trimp_settings for pk, stream, data in chunk]
+        values = dict(mapper(trimp_task, tasks))
+        if models.Profile.objects.get(pk=profile.pk).trimp_settings() != trimp_settings:
+            # The settings changed underneath us, which queued a fresh run.
+            break
+        update_trimp(values)
+        done += len(chunk)
+        if progress is not None:
+            progress(done, total)
+    if done:
+        models.TrainingStressBalance.refresh(user)
+    return done
+
+
+def run_recalculation(job, processes=None):
+    def progress(done, total):
+        models.TrimpRecalculation.objects.filter(pk=job.pk).update(
+            status=models.TrimpRecalculation.RUNNING, done=done, total=total
+        )
+
+    pool = create_pool(processes)
+    try:
+        recalculate_trimp(job.owner, pool=pool, progress=progress)
+    except Exception:
+        models.TrimpRecalculation.objects.filter(pk=job.pk).update(
+            status=models.TrimpRecalculation.FAILED, finished=timezone.now()
+        )
+        raise
+    else:
+        models.TrimpRecalculation.objects.filter(pk=job.pk).update(
+            status=models.TrimpRecalculation.DONE, finished=timezone.now()
+        )
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        connections.close_all()
+
+
+def start_recalculation(user):
+    job = models.TrimpRecalculation.objects.filter(owner=user).first()
+    if job is not None and job.active():
+        if (
+            job.status != models.TrimpRecalculation.PENDING or job.created > timezone.now() - PENDING_GRACE or
+            TASKS.queued(('recalculation', job.pk))
+        ):
+            return job
+        # The queue is in memory, so a restart can drop a job before it
+        # starts.  Fail it rather than block a new run for an hour, unless
+        # another process has just started it.
+        if not models.TrimpRecalculation.objects.filter(
+            pk=job.pk, status=models.TrimpRecalculation.PENDING
+        ).update(status=models.TrimpRecalculation.FAILED, finished=timezone.now()):
+            return job
+    job = models.TrimpRecalculation.objects.create(owner=user)
+    transaction.on_commit(lambda: TASKS.enqueue(('recalculation', job.pk), run_recalculation, job))
+    return job
+
+
+def recalculate_dirty_trimp(user_id):
+    recalculate_trimp(User.objects.get(pk=user_id), only_dirty=True)
+
+
+def refresh_balance(user_id):
+    models.TrainingStressBalance.refresh(User.objects.get(pk=user_id))
+
+
+def backfill_timezones(chunk_size=CHUNK_SIZE, progress=None):
+    activities = models.Activity.objects.filter(timezone_name='')
+    total = activities.count()
+    done = 0
+    for chunk in chunks(activities.values_list('id', 'stream', 'stream_data').iterator(), chunk_size):
+        zones = collections.defaultdict(list)
+        for pk, stream, data in chunk:
+            zones[models.stream_timezone_name(PointStream.decode(models.stored_stream(stream, data)))].append(pk)
+        for timezone_name, pks in zones.items():
+            if timezone_name:
+                models.Activity.objects.filter(pk__in=pks).update(timezone_name=timezone_name)
+        done += len(chunk)
+        if progress is not None:
+            progress(done, total)
+    return done
+
+
+def activity_row(data, trimp_settings):
+    """
+    Every stored field of a parsed activity, worked out the way saving it
+    through Activity.objects.store() would.
+    """
+    row = dict(RunSerializer.defaults(data), time=data['time'])
+    row['name'] = row['name'][:models.Activity._meta.get_field('name').max_length]
+    activity = models.Activity(**row)
+    stream = activity.points()
+    trimp = calculate_trimp(stream.column('time'), stream.column('heart_rate'), *trimp_settings)
+    row['trimp'] = int(trimp) if trimp else None
+    row['track_detail'] = activity.track_detail = activity.build_track_detail()
+    row['stream_pyramid'] = pyramid.build(stream)
+    row['thumbnail'] = activity.build_thumbnail()
+    row['timezone_name'] = models.stream_timezone_name(stream)
+    row['fingerprint'] = models.stream_fingerprint(models.stored_stream(row['stream'], row['stream_data']))
+    return row
+
+
+def import_task(task):
+    filename, trimp_settings = task
+    try:
+        return filename, [activity_row(a, trimp_settings) for a in parsers.read(filename)], None
+    except ValueError as error:
+        return filename, [], str(error)
+
+
+def import_files(user, filenames, pool=None, batch_size=CHUNK_SIZE, progress=None):
+    """
+    Parse activity files, in parallel when given a pool, and save their
+    activities for ``user`` in batches.  Returns counts of the files,
+    failures, activities and points read.
+    """
+    tasks = ((a, user.profile.trimp_settings()) for a in filenames)
+    results = pool.imap_unordered(import_task, tasks) if pool is not None else map(import_task, tasks)
+    counts = collections.Counter(files=0, failed=0, activities=0, points=0)
+    earliest = []
+    rows = []
+
+    def save(rows):
+        models.Activity.objects.upsert(user, rows)
+        earliest.append(min(a['time'] for a in rows))
+
+    for filename, activities, error in results:
+        counts['files'] += 1
+        counts['failed'] += bool(error)
+        counts['activities'] += len(activities)
+        counts['points'] += sum(a['data_points'] for a in activities)
+        rows.extend(activities)
+        if len(rows) >= batch_size:
+            save(rows)
+            rows = []
+        if progress is not None:
+            progress(filename, len(activities), error)
+    if rows:
+        save(rows)
+    if earliest:
+        # Bulk saves skip the signals that keep the balance current.
+        models.TrainingStressBalance.refresh(user, since=min(earliest).date())
+    return counts
+
+
+def import_uploads(user, uploads):
+    """
+    Save the activities in uploaded files for ``user``.  Files are
+    recognised by extension and may be gzipped.  Returns the name,
+    activity ids and error of each file.
+    """
+    trimp_settings = user.profile.trimp_settings()
+    results = []
+    rows = []
+    for upload in uploads:
+        name = upload.name
+        if upload.read(2) == GZIP_MAGIC and not name.lower().endswith('.gz'):
+            name += '.gz'
+        upload.seek(0)
+        try:
+            activities = [activity_row(a, trimp_settings) for a in parsers.read(upload, name)]
+        except ValueError as error:
+            results.append({'name': upload.name, 'activities': [], 'error': str(error)})
+            continue
+        rows.extend(activities)
+        results.append({'name': upload.name, 'activities': [a['time'] for a in activities], 'error': None})
+    if rows:
+        ids = models.Activity.objects.upsert(user, rows)
+        models.TrainingStressBalance.refresh(user, since=min(a['time'] for a in rows).date())
+        for result in results:
+            result['activities'] = [ids[a] for a in result['activities']]
+    return results
+
+
+def create_activities(user, items):
+    """
+    Validate and save a batch of RunSerializer payloads for ``user``,
+    skipping any whose start time is already stored.  Returns the status,
+    id and validation errors of each item in order.
+
+    Stored start times are looked up first, so re-sending a batch does
+    not work out the rows of activities it would not insert.
+    """
+    trimp_settings = user.profile.trimp_settings()
+    results = []
+    validated = collections.OrderedDict()
+    for item in items:
+        serializer = RunSerializer(data=item)
+        if not serializer.is_valid():
+            results.append({'status': 'invalid', 'id': None, 'errors': serializer.errors})
+            continue
+        time = serializer.validated_data['time']
+        if time in validated:
+            results.append({'status': 'duplicate', 'id': None, 'errors': None, 'time': time})
+            continue
+        validated[time] = serializer.validated_data
+        results.append({'status': 'created', 'id': None, 'errors': None, 'time': time})
+    existing = models.Activity.objects.stored_times(user, list(validated)) if validated else {}
+    created, raced = models.Activity.objects.insert_new(user, [
+        activity_row(data, trimp_settings) for time, data in validated.items() if time not in existing
+    ])
+    existing.update(raced)
+    if created:
+        models.TrainingStressBalance.refresh(user, since=min(created).date())
+    for result in results:
+        time = result.pop('time', None)
+        if time in created:
+            result['id'] = created[time]
+        elif time in existing:
+            result['id'] = existing[time]
+            if result['status'] == 'created':
+                result['status'] = 'exists'
+    return results
+
+
+def convert_streams(binary=None, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Rewrite every stream stored in the other format in the binary format,
+    or in JSON, defaulting to the FITNESS_STREAM_FORMAT setting.
+    """
+    if binary is None:
+        binary = models.binary_streams()
+    activities = models.Activity.objects.filter(**{'stream_data__isnull' if binary else 'stream__isnull': True})
+    activities = activities.exclude(**{'stream__isnull' if binary else 'stream_data__isnull': True})
+    total = activities.count()
+    done = 0
+    for chunk in chunks(activities.values_list('id', 'stream', 'stream_data').iterator(), chunk_size):
+        with transaction.atomic():
+            for pk, stream, data in chunk:
+                stream, data = models.converted_stream(stream, data, binary)
+                models.Activity.objects.filter(pk=pk).update(
+                    stream=stream, stream_data=data,
+                    fingerprint=models.stream_fingerprint(models.stored_stream(stream, data)),
+                )
+        done += len(chunk)
+        if progress is not None:
+            progress(done, total)
+    return done
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from fitness.jobs import CHUNK_SIZE, backfill_timezones
+
+
+class Command(BaseCommand):
+    help = 'Store the local timezone of activities that do not have one yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        done = backfill_timezones(chunk_size=options['chunk_size'], progress=self.progress)
+        self.stdout.write(self.style.SUCCESS('Checked {} activities'.format(done)))
+
+    def progress(self, done, total):
+        self.stdout.write('{}/{}'.format(done, total))
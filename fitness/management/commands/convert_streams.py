@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from fitness.jobs import CHUNK_SIZE, convert_streams
+
+
+class Command(BaseCommand):
+    help = 'Store activity streams in the JSON or binary format, by default the FITNESS_STREAM_FORMAT setting'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=('json', 'binary'), default=None)
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        binary = None if options['format'] is None else options['format'] == 'binary'
+        done = convert_streams(binary=binary, chunk_size=options['chunk_size'], progress=self.progress)
+        self.stdout.write(self.style.SUCCESS('Converted {} activities'.format(done)))
+
+    def progress(self, done, total):
+        self.stdout.write('{}/{}'.format(done, total))
@@ -1,136 +1,88 @@
 import glob
-import xml.etree.ElementTree as ET
-import dateutil.parser
-from django.core.management.base import BaseCommand
+import os
+import time
 
-from fitness.models import Activity, Lap, Point
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
 
-NAMESPACES = {
-    'default': 'http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2',
-    'extension': 'http://www.garmin.com/xmlschemas/ActivityExtension/v2',
-}
+from fitness.jobs import CHUNK_SIZE, create_pool, import_files
+from fitness.models import Activity
+from fitness import parsers
+from fitness.serializers import RunSerializer
+
+
+def find_files(entries):
+    for entry in entries:
+        for path in sorted(glob.glob(entry)):
+            if os.path.isdir(path):
+                for directory, unused, filenames in sorted(os.walk(path)):
+                    for filename in sorted(filenames):
+                        if parsers.supported(filename):
+                            yield os.path.join(directory, filename)
+            else:
+                yield path
 
 
 class Command(BaseCommand):
-    help = 'Add TCX Files'
+    help = 'Add TCX, GPX and FIT files, optionally gzipped'
 
     def add_arguments(self, parser):
-        parser.add_argument('tcx', nargs='+')
+        parser.add_argument('tcx', nargs='+', help='Activity files, directories or glob patterns')
+        parser.add_argument('--user', required=True, help='Username that will own the activities')
+        parser.add_argument(
+            '--bulk', action='store_true',
+            help='Parse files in parallel and save activities in batches without per-activity signals'
+        )
+        parser.add_argument('--processes', type=int, default=None)
+        parser.add_argument('--batch-size', type=int, default=CHUNK_SIZE)
 
     def handle(self, *args, **options):
-        for entry in options['tcx']:
-            for filename in glob.glob(entry):
-                activities = read_tcx(filename)
-                for activity, created in activities:
-                    note = 'Added' if created else 'Modified'
-                    self.stdout.write(self.style.SUCCESS(
-                        '{} {} {}'.format(note, activity.name, activity.time)
-                    ))
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError('No user named {}'.format(options['user']))
+        filenames = find_files(options['tcx'])
+        if options['bulk']:
+            self.bulk_import(user, filenames, options['processes'], options['batch_size'])
+        else:
+            self.import_each(user, filenames)
 
+    def bulk_import(self, user, filenames, processes, batch_size):
+        started = time.monotonic()
+        pool = create_pool(processes)
+        try:
+            counts = import_files(user, filenames, pool=pool, batch_size=batch_size, progress=self.progress)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        seconds = max(time.monotonic() - started, 1e-6)
+        self.stdout.write(self.style.SUCCESS(
+            'Read {files} files, {failed} failed, {activities} activities, {points} points'.format(**counts)
+        ))
+        self.stdout.write('{:.1f} files/sec, {:.0f} points/sec over {:.1f} seconds'.format(
+            counts['files'] / seconds, counts['points'] / seconds, seconds
+        ))
 
-def elevation_gain(activity):
-    gain = 0
-    last_elevation = None
-    points_up = 0
-    for point in activity.stream():
-        if last_elevation is not None and point['altitude'] > last_elevation:
-            if points_up < 2:
-                points_up += 1
-            else:
-                gain += (int(point['altitude']) - int(last_elevation))
+    def progress(self, filename, activities, error):
+        if error:
+            self.stderr.write('Could not read {}: {}'.format(filename, error))
         else:
-            points_up = 0
-        last_elevation = point['altitude']
-    return gain
-
+            self.stdout.write('{} activities from {}'.format(activities, filename))
 
-def read_tcx(filename):
-    tree = ET.parse(filename)
-    tcx = tree.getroot()
-    activities = []
-    for activity_list in tcx.findall('default:Activities', NAMESPACES):
-        for xml_activity in activity_list.findall('default:Activity', NAMESPACES):
-            name = xml_activity.find('default:Notes', NAMESPACES).text
-            start = dateutil.parser.parse(xml_activity.find('default:Id', NAMESPACES).text)
-            # if Activity.objects.filter(time=start):
-            #    continue
-            activity, created = Activity.objects.update_or_create(name=name, time=start, defaults={
-                'distance': None,
-                'duration': None,
-                'elevation': None,
-                'data_points': None,
-            })
-            activities.append((activity, created))
-            saved_lap = False
-            last_time = None
-            last_distance = 0.0
-            data_points = 0
-            for index, xml_lap in enumerate(xml_activity.findall('default:Lap', NAMESPACES), start=1):
-                lap, unused = Lap.objects.update_or_create(activity=activity, lap=index)
-                saved_point = False
-                for xml_track in xml_lap.findall('default:Track', NAMESPACES):
-                    for xml_point in xml_track.findall('default:Trackpoint', NAMESPACES):
-                        try:
-                            time = dateutil.parser.parse(xml_point.find('default:Time', NAMESPACES).text)
-                            position = xml_point.find('default:Position', NAMESPACES)
-                            latitude = float(position.find('default:LatitudeDegrees', NAMESPACES).text)
-                            longitude = float(position.find('default:LongitudeDegrees', NAMESPACES).text)
-                            altitude = float(xml_point.find('default:AltitudeMeters', NAMESPACES).text)
-                            distance = float(xml_point.find('default:DistanceMeters', NAMESPACES).text)
-                        except AttributeError:
-                            continue
-                        if time == last_time:
-                            continue
-                        try:
-                            heart_rate = xml_point.find('default:HeartRateBpm', NAMESPACES).find('default:Value', NAMESPACES).text
-                        except AttributeError:
-                            heart_rate = None
-                        extensions = xml_point.find('default:Extensions', NAMESPACES)
-                        tpx = extensions.find('extension:TPX', NAMESPACES)
-                        try:
-                            cadence = tpx.find('extension:RunCadence', NAMESPACES).text
-                        except AttributeError:
-                            cadence = None
-                        if last_time is not None:
-                            try:
-                                seconds = (time - last_time).total_seconds()
-                                speed = (distance - last_distance) / seconds
-                            except:
-                                print(filename, time)
-                                raise
-                        else:
-                            speed = 0.0
-                        matching_points = Point.objects.filter(lap=lap, time=time)
-                        if matching_points.count() > 1:
-                            for point in matching_points:
-                                point.delete()
-                        point, unused = Point.objects.update_or_create(
-                            lap=lap,
-                            time=time,
-                            defaults={
-                                'latitude': latitude,
-                                'longitude': longitude,
-                                'altitude': altitude,
-                                'heart_rate': heart_rate,
-                                'cadence': cadence,
-                                'distance': distance,
-                                'speed': speed,
-                            }
-                        )
-                        data_points += 1
-                        saved_point = True
-                        last_time = time
-                        last_distance = distance
-                if not saved_point:
-                    lap.delete()
-                else:
-                    saved_lap = True
-            if not saved_lap:
-                activity.delete()
-            else:
-                activity.distance = last_distance
-                activity.duration = (last_time - start).total_seconds()
-                activity.elevation = elevation_gain(activity)
-                activity.data_points = data_points
-                activity.save()
-    return activities
\ No newline at end of file
+    def import_each(self, user, filenames):
+        files = failed = 0
+        for filename in filenames:
+            files += 1
+            try:
+                for data in parsers.read(filename):
+                    data['name'] = data['name'][:Activity._meta.get_field('name').max_length]
+                    activity, created = RunSerializer.store(user, data)
+                    note = {True: 'Added', False: 'Modified', None: 'Unchanged'}[created]
+                    self.stdout.write(self.style.SUCCESS(
+                        '{} {} {}'.format(note, activity.name, activity.time)
+                    ))
+            except ValueError as error:
+                failed += 1
+                self.stderr.write('Could not read {}: {}'.format(filename, error))
+        self.stdout.write('Read {} files, {} failed'.format(files, failed))
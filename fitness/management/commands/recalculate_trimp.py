@@ -0,0 +1,36 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from fitness.jobs import CHUNK_SIZE, create_pool, recalculate_trimp
+
+
+class Command(BaseCommand):
+    help = 'Recalculate TRIMP for every activity'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', nargs='*')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+        parser.add_argument('--processes', type=int, default=None)
+
+    def handle(self, *args, **options):
+        users = User.objects.all()
+        if options['username']:
+            users = users.filter(username__in=options['username'])
+        pool = create_pool(options['processes'])
+        try:
+            for user in users:
+                done = recalculate_trimp(
+                    user, pool=pool, chunk_size=options['chunk_size'], progress=self.progress(user)
+                )
+                self.stdout.write(self.style.SUCCESS(
+                    'Recalculated {} activities for {}'.format(done, user.username)
+                ))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    def progress(self, user):
+        def report(done, total):
+            self.stdout.write('{}: {}/{}'.format(user.username, done, total))
+        return report
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+from fitness.streams import PointStream
+
+
+def to_columns(apps, unused):
+    Activity = apps.get_model('fitness', 'Activity')
+    for activity in Activity.objects.only('id', 'stream').iterator():
+        activity.stream = PointStream.decode(activity.stream).encode()
+        activity.save(update_fields=['stream'])
+
+
+def to_points(apps, unused):
+    Activity = apps.get_model('fitness', 'Activity')
+    for activity in Activity.objects.only('id', 'stream').iterator():
+        activity.stream = PointStream.decode(activity.stream).legacy()
+        activity.save(update_fields=['stream'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fitness', '0009_populate_trimp'),
+    ]
+    operations = [
+        migrations.RunPython(to_columns, reverse_code=to_points),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:09
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fitness', '0011_trimprecalculation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activity',
+            name='trimp_dirty',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:10
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('fitness', '0012_activity_trimp_dirty'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrainingStressBalanceDay',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('trimp', models.FloatField(default=0)),
+                ('fitness', models.FloatField(default=0)),
+                ('fatigue', models.FloatField(default=0)),
+                ('form', models.FloatField(default=0)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['date'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='trainingstressbalanceday',
+            unique_together=set([('owner', 'date')]),
+        ),
+    ]
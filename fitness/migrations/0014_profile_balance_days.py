@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:13
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fitness', '0013_trainingstressbalanceday'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='fatigue_days',
+            field=models.IntegerField(default=7),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='fitness_days',
+            field=models.IntegerField(default=42),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:16
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fitness', '0014_profile_balance_days'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activity',
+            name='stream_updated',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='activity',
+            name='updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fitness', '0015_activity_updated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activity',
+            name='thumbnail',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:24
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fitness', '0016_activity_thumbnail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activity',
+            name='timezone_name',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 09:00
+from __future__ import unicode_literals
+
+import hashlib
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import migrations, models
+
+
+def stream_fingerprint(stream):
+    # A copy of fitness.models.stream_fingerprint as it was for JSON streams,
+    # so this migration does not change with the model code.
+    if not stream:
+        return ''
+    encoded = json.dumps(stream, sort_keys=True, separators=(',', ':'), cls=DjangoJSONEncoder)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def fingerprint_streams(apps, unused):
+    Activity = apps.get_model('fitness', 'Activity')
+    for activity in Activity.objects.only('id', 'stream').iterator():
+        activity.fingerprint = stream_fingerprint(activity.stream)
+        activity.save(update_fields=['fingerprint'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fitness', '0017_activity_timezone_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activity',
+            name='fingerprint',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['owner', 'time', 'fingerprint'], name='fitness_act_owner_i_c99ba6_idx'),
+        ),
+        migrations.RunPython(fingerprint_streams, reverse_code=migrations.RunPython.noop),
+    ]
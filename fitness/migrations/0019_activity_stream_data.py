@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Existing streams stay in JSON.  The convert_streams command rewrites
+    # them in the configured format, and back to JSON before unapplying this.
+
+    dependencies = [
+        ('fitness', '0018_activity_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activity',
+            name='stream_data',
+            field=models.BinaryField(null=True),
+        ),
+    ]
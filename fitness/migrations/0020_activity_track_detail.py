@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 13:00
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fitness', '0019_activity_stream_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activity',
+            name='track_detail',
+            field=django.contrib.postgres.fields.jsonb.JSONField(null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 15:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fitness', '0020_activity_track_detail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activity',
+            name='stream_pyramid',
+            field=models.BinaryField(null=True),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def unbuild_blank_thumbnails(apps, unused):
+    # Blank used to mean not built as well as no track, so build them again.
+    Activity = apps.get_model('fitness', 'Activity')
+    Activity.objects.filter(thumbnail='').update(thumbnail=None)
+
+
+def blank_unbuilt_thumbnails(apps, unused):
+    Activity = apps.get_model('fitness', 'Activity')
+    Activity.objects.filter(thumbnail__isnull=True).update(thumbnail='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fitness', '0022_activity_managers'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='activity',
+            name='thumbnail',
+            field=models.TextField(blank=True, default=None, null=True),
+        ),
+        migrations.RunPython(unbuild_blank_thumbnails, reverse_code=blank_unbuilt_thumbnails),
+    ]
@@ -1,18 +1,37 @@
+import functools
+import hashlib
+import json
 import math
 import datetime
 
 from django.contrib.auth.models import User
-from django.db import models
-from django.db.models.signals import post_save
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Max, Min
+from django.db.models.signals import post_delete, post_init, post_save
 from django.dispatch import receiver
 from django.contrib.postgres.fields import JSONField
+from django.core.cache import cache
 from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.timezone import now as timezone_now
 
+import numpy
 from timezonefinder import TimezoneFinder
 from pytz import timezone
-import dateutil.parser
+
+from . import balance, pyramid, simplify, trimp
+from .streams import COLUMNS, PointStream
+from .tasks import TASKS
 
 TIMEZONE_FINDER = TimezoneFinder()
+GEO_JSON_VERSION = 2
+GEO_JSON_POINTS = 300
+# Metres a map line may stray from the recorded track.
+GEO_JSON_TOLERANCE = 2.0
+SAMPLE_POINTS = 500
+THUMBNAIL_POINTS = 100
+TRACK_DETAIL_POINTS = 1000
+TIMEZONE_PRECISION = 2
 
 
 def average(*args):
@@ -25,6 +44,97 @@ def date_array(start, end):
     ]
 
 
+RESOLUTIONS = {
+    'day': lambda date: date,
+    'week': lambda date: date - datetime.timedelta(days=date.weekday()),
+    'month': lambda date: date.replace(day=1),
+}
+
+
+@functools.lru_cache(maxsize=4096)
+def cached_timezone_at(latitude, longitude):
+    return TIMEZONE_FINDER.timezone_at(lng=longitude, lat=latitude) or 'UTC'
+
+
+def timezone_at(latitude, longitude):
+    return cached_timezone_at(round(latitude, TIMEZONE_PRECISION), round(longitude, TIMEZONE_PRECISION))
+
+
+def stream_timezone_name(stream):
+    """
+    Name of the timezone at the first located point of ``stream``, UTC when
+    it has no position and empty when it has no points at all.
+    """
+    if not len(stream):
+        return ''
+    located = numpy.flatnonzero(stream.valid('latitude') & stream.valid('longitude'))
+    if not len(located):
+        return 'UTC'
+    return timezone_at(
+        float(stream.column('latitude')[located[0]]), float(stream.column('longitude')[located[0]])
+    )
+
+
+def binary_streams():
+    return getattr(settings, 'FITNESS_STREAM_FORMAT', 'json') == 'binary'
+
+
+def stream_fields(stream):
+    """
+    Values of the two stream columns holding the PointStream ``stream`` in
+    the format named by the FITNESS_STREAM_FORMAT setting, 'json' by
+    default or 'binary'.
+    """
+    if binary_streams():
+        return {'stream': None, 'stream_data': stream.to_bytes()}
+    return {'stream': stream.encode(), 'stream_data': None}
+
+
+def stored_stream(stream, stream_data):
+    """
+    The encoded stream of an activity from its JSON and binary columns,
+    only one of which is set.
+    """
+    return stream if stream_data is None else bytes(stream_data)
+
+
+def converted_stream(stream, stream_data, binary):
+    """
+    The JSON and binary column values of a stored stream rewritten in the
+    binary or JSON format.
+    """
+    decoded = PointStream.decode(stored_stream(stream, stream_data))
+    if binary:
+        return None, decoded.to_bytes()
+    return decoded.encode(), None
+
+
+def stream_fingerprint(stream):
+    """
+    Digest of an encoded stream, equal for equal streams whatever the key
+    order, or '' when there is no stream.
+    """
+    if not stream:
+        return ''
+    if isinstance(stream, (bytes, memoryview)):
+        return hashlib.sha256(stream).hexdigest()
+    encoded = json.dumps(stream, sort_keys=True, separators=(',', ':'), cls=DjangoJSONEncoder)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def with_fingerprint(row):
+    if 'fingerprint' in row:
+        return row
+    return dict(row, fingerprint=stream_fingerprint(stored_stream(row.get('stream'), row.get('stream_data'))))
+
+
+def start_of_day(date):
+    moment = datetime.datetime.combine(date, datetime.time.min)
+    if settings.USE_TZ:
+        return moment.replace(tzinfo=datetime.timezone.utc)
+    return moment
+
+
 def delta_minutes(new, old):
     return (new - old).total_seconds() / 60.0
 
@@ -37,6 +147,15 @@ def height_coordinate(value, average_value, max_range, height):
     return (height * (1 - (value - average_value) / max_range)) - (height / 2)
 
 
+def optional_readings(values, count):
+    """
+    ``values`` as a list with None for zero or missing readings.
+    """
+    if values is None:
+        return [None] * count
+    return [a or None for a in numpy.nan_to_num(values).tolist()]
+
+
 def range_and_average(iterable):
     max_value = max(iterable)
     min_value = min(iterable)
@@ -56,6 +175,16 @@ class Theme(models.Model):
         return self.name.title()
 
 
+def queue_dirty_trimp(user_id):
+    """
+    Recalculate the TRIMP of the activities of ``user_id`` marked dirty, in
+    the background once the current transaction commits.
+    """
+    transaction.on_commit(lambda: TASKS.enqueue(
+        ('trimp', user_id), 'fitness.jobs.recalculate_dirty_trimp', user_id
+    ))
+
+
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     theme = models.ForeignKey(Theme)
@@ -73,6 +202,8 @@ class Profile(models.Model):
         choices=GENDER_CHOICES,
         default=MALE,
     )
+    fitness_days = models.IntegerField(default=balance.FITNESS_DAYS)
+    fatigue_days = models.IntegerField(default=balance.FATIGUE_DAYS)
 
     def heart_rate_reserve(self):
         return self.maximum_heart_rate - self.minimum_heart_rate
@@ -80,10 +211,43 @@ class Profile(models.Model):
     def percent_of_heart_rate_reserve(self, heart_rate):
         return max((heart_rate - self.minimum_heart_rate) / self.heart_rate_reserve(), 0)
 
+    def trimp_settings(self):
+        return (self.minimum_heart_rate, self.maximum_heart_rate, self.gender)
+
+    def balance_settings(self):
+        return (self.fitness_days, self.fatigue_days)
+
+    def invalidate_trimp(self):
+        Activity.objects.filter(owner_id=self.user_id).update(trimp_dirty=True)
+        queue_dirty_trimp(self.user_id)
+
+    def invalidate_balance(self):
+        user_id = self.user_id
+        transaction.on_commit(lambda: TASKS.enqueue(
+            ('balance', user_id), 'fitness.jobs.refresh_balance', user_id
+        ))
+
     def save(self, *args, **kwargs):
         self.minimum_heart_rate = max(1, self.minimum_heart_rate)
         self.maximum_heart_rate = max(self.maximum_heart_rate, self.minimum_heart_rate + 1)
+        self.fitness_days = max(1, self.fitness_days)
+        self.fatigue_days = max(1, self.fatigue_days)
+        adding = self._state.adding
+        trimp_changed = not adding and self.trimp_settings() != self.saved_trimp_settings
+        balance_changed = not adding and self.balance_settings() != self.saved_balance_settings
         super(Profile, self).save(*args, **kwargs)
+        remember_settings(Profile, self)
+        if trimp_changed:
+            # Recalculating TRIMP refreshes the balance as well.
+            self.invalidate_trimp()
+        elif balance_changed:
+            self.invalidate_balance()
+
+
+@receiver(post_init, sender=Profile)
+def remember_settings(sender, instance, **kwargs):
+    instance.saved_trimp_settings = instance.trimp_settings()
+    instance.saved_balance_settings = instance.balance_settings()
 
 
 @receiver(post_save, sender=User)
@@ -97,6 +261,109 @@ def save_user_profile(sender, instance, **kwargs):  # pragma: no cover
     instance.profile.save()
 
 
+# Columns only loaded when asked for.
+LARGE_FIELDS = ('stream', 'stream_data', 'track_detail', 'stream_pyramid')
+
+
+class ActivityQuerySet(models.QuerySet):
+    def with_stream(self):
+        """
+        Load the point stream with each activity.  ``Activity.objects``
+        defers it, since it is by far the largest column and lists never
+        need it.  This clears any other deferral on the queryset too.
+        """
+        return self.defer(None)
+
+    def with_pyramid(self):
+        """
+        Load the stored stream pyramid, which answers most sample queries,
+        leaving the stream itself deferred.
+        """
+        return self.defer(None).defer(*(a for a in LARGE_FIELDS if a != 'stream_pyramid'))
+
+
+class ActivityManager(models.Manager.from_queryset(ActivityQuerySet)):
+    def get_queryset(self):
+        return super(ActivityManager, self).get_queryset().defer(*LARGE_FIELDS)
+
+    def store(self, owner, time, defaults, summaries=None):
+        """
+        Create or replace the activity ``owner`` started at ``time`` and
+        calculate its TRIMP.  When the stored activity already has the same
+        stream it is returned as it is, without rewriting anything, and with
+        None in place of ``created``.  Otherwise ``summaries``, if given, is
+        called for the fields that are worked out from the stream.
+        """
+        fingerprint = stream_fingerprint(stored_stream(defaults.get('stream'), defaults.get('stream_data')))
+        if fingerprint:
+            unchanged = self.filter(owner=owner, time=time, fingerprint=fingerprint).first()
+            if unchanged is not None:
+                return unchanged, None
+        if summaries is not None:
+            defaults = dict(defaults, **summaries())
+        # TRIMP goes in with the other fields so the balance is refreshed once.
+        scored = self.model(owner=owner, time=time, **defaults)
+        scored.update_trimp()
+        return self.update_or_create(
+            owner=owner, time=time, defaults=dict(defaults, trimp=scored.trimp, trimp_dirty=False)
+        )
+
+    def upsert(self, owner, rows):
+        """
+        Create or replace many activities of ``owner`` at once from dicts of
+        field values, matched on their start time.  Unlike store() this runs
+        no signals, so the rows must be complete, TRIMP included, and the
+        caller refreshes the training stress balance afterwards.  Stored
+        activities whose stream fingerprint matches are left alone.  Returns
+        the primary key of each start time.
+        """
+        rows = [with_fingerprint(a) for a in {a['time']: a for a in rows}.values()]
+        times = [a['time'] for a in rows]
+        now = timezone_now()
+        with transaction.atomic():
+            existing = {
+                a: (b, c) for a, b, c in
+                self.filter(owner=owner, time__in=times).values_list('time', 'pk', 'fingerprint')
+            }
+            self.bulk_create([
+                self.model(owner=owner, stream_updated=now, **a)
+                for a in rows if a['time'] not in existing
+            ])
+            for row in rows:
+                if row['time'] not in existing:
+                    continue
+                pk, fingerprint = existing[row['time']]
+                if not fingerprint or fingerprint != row['fingerprint']:
+                    self.filter(pk=pk).update(stream_updated=now, updated=now, **row)
+            return dict(self.filter(owner=owner, time__in=times).values_list('time', 'pk'))
+
+    def insert_new(self, owner, rows):
+        """
+        Create the activities of ``owner`` in ``rows`` whose start time is
+        not stored yet, with one query to find those that are and one
+        bulk insert, leaving the stored ones untouched.  Like upsert() no
+        signals run.  Returns the primary keys of the new and of the
+        existing start times.
+        """
+        rows = [with_fingerprint(a) for a in {a['time']: a for a in rows}.values()]
+        if not rows:
+            return {}, {}
+        now = timezone_now()
+        with transaction.atomic():
+            existing = self.stored_times(owner, [a['time'] for a in rows])
+            rows = [a for a in rows if a['time'] not in existing]
+            self.bulk_create([self.model(owner=owner, stream_updated=now, **a) for a in rows])
+            created = self.stored_times(owner, [a['time'] for a in rows])
+        return created, existing
+
+    def stored_times(self, owner, times):
+        """
+        The primary keys of the activities of ``owner`` stored at any of
+        ``times``, by start time.
+        """
+        return dict(self.filter(owner=owner, time__in=times).values_list('time', 'pk'))
+
+
 class Activity(models.Model):
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
     name = models.CharField(max_length=128)
@@ -105,59 +372,112 @@ class Activity(models.Model):
     duration = models.FloatField(null=True)
     elevation = models.FloatField(null=True)
     trimp = models.IntegerField(null=True)
+    trimp_dirty = models.BooleanField(default=False, db_index=True)
     data_points = models.IntegerField(null=True)
     stream = JSONField(encoder=DjangoJSONEncoder, null=True)
+    stream_data = models.BinaryField(null=True)
+    stream_updated = models.DateTimeField(default=timezone_now)
+    updated = models.DateTimeField(auto_now=True)
+    # Null until built, and blank for activities without a located point.
+    thumbnail = models.TextField(null=True, blank=True, default=None)
+    timezone_name = models.CharField(max_length=64, blank=True, default='')
+    fingerprint = models.CharField(max_length=64, blank=True, default='')
+    track_detail = JSONField(null=True)
+    stream_pyramid = models.BinaryField(null=True)
+
+    objects = ActivityManager()
+    # Django loads deferred fields through the default manager, which must
+    # not defer them again.
+    all_objects = models.Manager()
 
     class Meta:
         ordering = ['-time']
+        indexes = [models.Index(fields=['owner', 'time', 'fingerprint'])]
+        default_manager_name = 'all_objects'
+        base_manager_name = 'all_objects'
+
+    def refresh_from_db(self, using=None, fields=None):
+        super(Activity, self).refresh_from_db(using, fields)
+        # A stream just read is the stored one, so saving it again is no change.
+        self.saved_stream = tuple(
+            self.__dict__.get(a) if fields is None or a in fields else b
+            for a, b in zip(('stream', 'stream_data'), self.saved_stream)
+        )
+
+    def save(self, *args, **kwargs):
+        # Read through __dict__ so a deferred stream is not loaded.
+        streams = (self.__dict__.get('stream'), self.__dict__.get('stream_data'))
+        if binary_streams() and streams[1] is None and streams[0] is not None:
+            streams = (None, PointStream.decode(streams[0]).to_bytes())
+            self.stream, self.stream_data = streams
+        # New activities are built with their stream, so post_init has already seen it.
+        if self._state.adding or any(a is not b for a, b in zip(streams, self.saved_stream)):
+            self.stream_updated = timezone_now()
+            self.fingerprint = stream_fingerprint(stored_stream(*streams))
+            self.track_detail = self.build_track_detail()
+            self.stream_pyramid = pyramid.build(self.points())
+            self.thumbnail = self.build_thumbnail()
+            self.timezone_name = stream_timezone_name(self.points())
+        super(Activity, self).save(*args, **kwargs)
+        self.saved_stream = streams
+
+    def points(self):
+        cached = getattr(self, '_points', None)
+        if cached is None or cached[0] is not self.stream or cached[1] is not self.stream_data:
+            cached = self._points = (
+                self.stream, self.stream_data, PointStream.decode(stored_stream(self.stream, self.stream_data))
+            )
+        return cached[2]
+
+    def load_stream(self):
+        """
+        Load the deferred stream and track detail in one query, rather than
+        one each as they are first read.
+        """
+        fields = [a for a in ('stream', 'stream_data', 'track_detail') if a in self.get_deferred_fields()]
+        if fields:
+            self.refresh_from_db(fields=fields)
+
+    def local_timezone_name(self):
+        if not self.timezone_name:
+            self.timezone_name = stream_timezone_name(self.points())
+            if self.timezone_name and self.pk is not None:
+                Activity.objects.filter(pk=self.pk).update(timezone_name=self.timezone_name)
+        return self.timezone_name
 
     def local_time(self):
-        for first_point in self.stream.values():
-            timezone_name = TIMEZONE_FINDER.timezone_at(lng=first_point['longitude'], lat=first_point['latitude'])
-            if timezone_name is None:
-                local_zone = timezone('UTC')
-            else:
-                local_zone = timezone(timezone_name)
+        timezone_name = self.local_timezone_name()
+        if timezone_name:
+            local_zone = timezone(timezone_name)
             return local_zone.normalize(self.time.astimezone(local_zone)).strftime('%d %B %Y at %H:%M')
 
     def points_with_heart_rate(self):
         return [a for a in self.point_stream() if a.get('heart_rate')]
 
-    def delta_trimp(self, current_time, last_time, current_heart_rate, last_heart_rate):
-        exponent = 1.92 if self.owner.profile.gender == 'M' else 1.67
-        minutes = delta_minutes(current_time, last_time)
-        average_heart_rate = average(current_heart_rate, last_heart_rate)
-        reserve = self.owner.profile.percent_of_heart_rate_reserve(average_heart_rate)
-        return (
-            minutes * reserve * 0.64 * math.exp(exponent * reserve)
+    def trimp_intervals(self):
+        profile = self.owner.profile
+        stream = self.points()
+        return trimp.trimp_intervals(
+            stream.column('time'),
+            stream.column('heart_rate'),
+            profile.minimum_heart_rate,
+            profile.maximum_heart_rate,
+            profile.gender,
         )
 
     def calculate_trimp(self):
-        trimp = 0
-        last_point = None
-        for point in self.points_with_heart_rate():
-            if last_point is not None:
-                trimp += self.delta_trimp(
-                    point['time'], last_point['time'], point['heart_rate'], last_point['heart_rate']
-                )
-            last_point = point
-        return trimp or None
+        return float(self.trimp_intervals().sum()) or None
 
-    @staticmethod
-    def decompress(point):
-        if isinstance(point['time'], datetime.datetime):
-            return point
-        expanded = point.copy()
-        expanded['time'] = dateutil.parser.parse(point['time'])
-        return expanded
+    def update_trimp(self):
+        self.trimp = self.calculate_trimp()
+        self.trimp_dirty = False
 
     def point_stream(self):
-        return sorted([self.decompress(x) for x in self.stream.values()], key=lambda h: h['time'])
+        return self.points().points()
 
     def track(self):
-        return [
-            (a['latitude'], a['longitude']) for a in self.point_stream()
-        ]
+        stream = self.points()
+        return list(zip(stream.column('latitude').tolist(), stream.column('longitude').tolist()))
 
     def adjusted_track(self):
         track = self.track()
@@ -165,18 +485,65 @@ class Activity(models.Model):
         longitude_factor = math.cos(math.radians(max_latitude))
         return [(a[0], a[1] * longitude_factor) for a in track]
 
-    def svg_points(self, width=30, height=30):
-        track = self.adjusted_track()
-        latitude_range, average_latitude = range_and_average([a[0] for a in track])
-        longitude_range, average_longitude = range_and_average([a[1] for a in track])
-        max_range = max([longitude_range, latitude_range])
-        return [
-            (
-                width_coordinate(a[1], average_longitude, max_range, width),
-                height_coordinate(a[0], average_latitude, max_range, height),
-            )
-            for a in track
-        ]
+    def build_track_detail(self):
+        return simplify.track_detail(self.points(), TRACK_DETAIL_POINTS)
+
+    def simplified(self, max_points=None, tolerance=None):
+        """
+        Sorted indices of the located points kept when the track is
+        simplified to within ``tolerance`` metres and to at most
+        ``max_points``, from the stored levels of detail.
+        """
+        if self.track_detail is None:
+            self.track_detail = self.build_track_detail()
+            if self.pk is not None:
+                Activity.objects.filter(pk=self.pk).update(track_detail=self.track_detail)
+        return simplify.kept(self.track_detail, max_points, tolerance)
+
+    def samples(self, start=None, end=None, max_points=SAMPLE_POINTS):
+        """
+        Heart rate, speed, altitude and cadence between ``start`` and ``end``
+        seconds into the activity, bucketed into at most ``max_points``.
+        """
+        if self.stream_pyramid is None:
+            self.stream_pyramid = pyramid.build(self.points())
+            if self.pk is not None:
+                Activity.objects.filter(pk=self.pk).update(stream_pyramid=self.stream_pyramid)
+        return pyramid.samples(self.stream_pyramid, self.points, start, end, max_points)
+
+    def svg_points(self, width=30, height=30, max_points=None):
+        """
+        Track positions scaled into a ``width`` by ``height`` box, leaving
+        out those closer than half a unit of the box to the simplified line.
+        """
+        stream = self.points()
+        located = stream.valid('latitude') & stream.valid('longitude')
+        if not located.any():
+            return []
+        latitude = stream.column('latitude')
+        longitude = stream.column('longitude') * math.cos(math.radians(latitude[located].max()))
+        latitude_range, average_latitude = range_and_average(latitude[located])
+        longitude_range, average_longitude = range_and_average(longitude[located])
+        max_range = max([longitude_range, latitude_range]) or 1.0
+        tolerance = max_range * simplify.METRES_PER_DEGREE / max(width, height) / 2
+        kept = self.simplified(max_points, tolerance)
+        return list(zip(
+            width_coordinate(longitude[kept], average_longitude, max_range, width).tolist(),
+            height_coordinate(latitude[kept], average_latitude, max_range, height).tolist(),
+        ))
+
+    def build_thumbnail(self, width=30, height=30):
+        """
+        SVG polyline points for a small picture of the track, keeping at
+        most THUMBNAIL_POINTS of the positions.
+        """
+        return ' '.join('{:.1f},{:.1f}'.format(*a) for a in self.svg_points(width, height, THUMBNAIL_POINTS))
+
+    def svg_thumbnail(self):
+        if self.thumbnail is None and self.pk is not None:
+            self.thumbnail = self.build_thumbnail()
+            Activity.objects.filter(pk=self.pk).update(thumbnail=self.thumbnail)
+        return self.thumbnail
 
     def display_distance(self, unit='km'):
         if unit == 'km':
@@ -211,66 +578,34 @@ class Activity(models.Model):
     def has_heart_rate(self):
         return bool(self.points_with_heart_rate())
 
-    @staticmethod
-    def average(points, key):
-        if isinstance(points[0].get(key), datetime.datetime):
-            return points[0][key]
-        return (sum(p.get(key) or 0 for p in points) / len(points)) or None
-
-    @classmethod
-    def condense_points(cls, points):
-        keys = points[0].keys()
-        return {
-            k: cls.average(points, k) for k in keys
-        }
-
-    @staticmethod
-    def reduction_factor(points):
-        return max(len(points) // 200, 1)
-
     def reduced_points(self):
-        output_points = []
-        current_points = []
-        input_points = self.point_stream()
-        factor = self.reduction_factor(input_points)
-        for index, point in enumerate(input_points):
-            current_points.append(point)
-            if index % factor == 0:
-                output_points.append(self.condense_points(current_points))
-                current_points = []
-        return output_points
+        """
+        Columns of the simplified track for maps: the recorded time and
+        position of each kept point, and the other readings averaged since
+        the previous one.
+        """
+        stream = self.points()
+        kept = numpy.array(self.simplified(GEO_JSON_POINTS, GEO_JSON_TOLERANCE), dtype=numpy.intp)
+        if not len(kept):
+            return {}
+        columns = stream.bucket_means(kept)
+        for name in ('time', 'latitude', 'longitude'):
+            columns[name] = stream.column(name)[kept]
+        return columns
 
     @staticmethod
-    def geo_line(index, new, old):
-        line = {
+    def geo_line(properties, start, end):
+        return {
             'type': 'Feature',
-            'properties': {
-                'id': index,
-                'elevation': new.get('altitude'),
-                'speed': new.get('speed'),
-                'distance': new.get('distance'),
-                'cadence': new.get('cadence'),
-            },
+            'properties': properties,
             'geometry': {
                 'type': 'LineString',
-                'coordinates': [
-                    [
-                        old.get('longitude'),
-                        old.get('latitude'),
-                    ],
-                    [
-                        new.get('longitude'),
-                        new.get('latitude'),
-                    ]
-                ]
+                'coordinates': [start, end],
             }
         }
-        if new.get('heart_rate') is not None:
-            line['properties']['heart_rate'] = new.get('heart_rate')
-        return line
 
     @staticmethod
-    def geo_point(name, point):
+    def geo_point(name, coordinates):
         return {
             "type": "Feature",
             "properties": {
@@ -278,64 +613,222 @@ class Activity(models.Model):
             },
             "geometry": {
                 "type": "Point",
-                "coordinates": [
-                    point.get('longitude'), point.get('latitude')
-                ]
+                "coordinates": coordinates,
             }
         }
 
+    def stream_cache_key(self, name):
+        return 'fitness:{}:{}:{}:{}'.format(name, GEO_JSON_VERSION, self.pk, self.stream_updated.timestamp())
+
+    def geo_json_key(self):
+        return self.stream_cache_key('geo_json')
+
     def geo_json(self):
+        if self.pk is None:
+            return self.build_geo_json()
+        return cache.get_or_set(self.geo_json_key(), self.build_geo_json, None)
+
+    def track_columns(self):
+        """
+        The simplified track in the column types of the stream, for the
+        columnar format, cached until the stream changes as geo_json is.
+        """
+        if self.pk is None:
+            return self.build_track_columns()
+        return cache.get_or_set(self.stream_cache_key('track_columns'), self.build_track_columns, None)
+
+    def build_track_columns(self):
+        self.load_stream()
+        return {a: b.astype(COLUMNS[a]) for a, b in self.reduced_points().items()}
+
+    def build_geo_json(self):
+        columns = self.reduced_points()
+        if not columns:
+            return []
+        coordinates = [list(a) for a in zip(columns['longitude'].tolist(), columns['latitude'].tolist())]
+        elevation, speed, distance, cadence, heart_rate = (
+            optional_readings(columns.get(a), len(coordinates))
+            for a in ('altitude', 'speed', 'distance', 'cadence', 'heart_rate')
+        )
         data = []
-        points = self.reduced_points()
-        for index, point in enumerate(points):
-            if index > 0:
-                data.append(self.geo_line(index - 1, point, last_point))
-            last_point = point
-        first = points[0]
-        last = points[-1]
-        data.append(self.geo_point("progress", first))
-        data.append(self.geo_point("start", first))
-        data.append(self.geo_point("stop", last))
+        for index in range(1, len(coordinates)):
+            properties = {
+                'id': index - 1,
+                'elevation': elevation[index],
+                'speed': speed[index],
+                'distance': distance[index],
+                'cadence': cadence[index],
+            }
+            if heart_rate[index] is not None:
+                properties['heart_rate'] = heart_rate[index]
+            data.append(self.geo_line(properties, coordinates[index - 1], coordinates[index]))
+        data.append(self.geo_point("progress", coordinates[0]))
+        data.append(self.geo_point("start", coordinates[0]))
+        data.append(self.geo_point("stop", coordinates[-1]))
         return data
 
-    @classmethod
-    def trimp_activities(cls, user, start=None, end=None):
-        activities = cls.objects.filter(owner=user).filter(trimp__isnull=False)
-        if start is None:
-            start = activities.order_by('time').first().time.date()
-        else:
-            activities = activities.filter(time__gte=start)
-        if end is None:
-            end = activities.order_by('time').last().time.date()
-        else:
-            activities = activities.filter(time__lte=end)
-        return activities, start, end
+
+class TrimpRecalculation(models.Model):
+    owner = models.ForeignKey(User, on_delete=models.CASCADE)
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True)
+    total = models.IntegerField(default=0)
+    done = models.IntegerField(default=0)
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+    status = models.CharField(
+        max_length=8,
+        choices=STATUS_CHOICES,
+        default=PENDING,
+    )
+
+    class Meta:
+        ordering = ['-created']
+
+    def active(self):
+        if self.created < timezone_now() - datetime.timedelta(hours=1):
+            return False
+        return self.status in (self.PENDING, self.RUNNING)
+
+
+@receiver(post_init, sender=Activity)
+def remember_saved_fields(sender, instance, **kwargs):
+    # Read through __dict__ so deferred fields are not loaded.
+    instance.saved_stream = (instance.__dict__.get('stream'), instance.__dict__.get('stream_data'))
+    instance.saved_balance_fields = (instance.__dict__.get('time'), instance.__dict__.get('trimp'))
+
+
+@receiver(post_save, sender=Activity)
+def update_balance_on_save(sender, instance, created, **kwargs):
+    old_time, old_trimp = instance.saved_balance_fields
+    instance.saved_balance_fields = (instance.time, instance.trimp)
+    if created or (old_time, old_trimp) != instance.saved_balance_fields:
+        changed = [a.date() for a in (old_time, instance.time) if a is not None]
+        TrainingStressBalance.refresh(instance.owner, since=min(changed))
+
+
+@receiver(post_delete, sender=Activity)
+def update_balance_on_delete(sender, instance, **kwargs):
+    TrainingStressBalance.refresh(instance.owner, since=instance.time.date())
+
+
+class TrainingStressBalanceDay(models.Model):
+    owner = models.ForeignKey(User, on_delete=models.CASCADE)
+    date = models.DateField()
+    trimp = models.FloatField(default=0)
+    fitness = models.FloatField(default=0)
+    fatigue = models.FloatField(default=0)
+    form = models.FloatField(default=0)
+
+    class Meta:
+        ordering = ['date']
+        unique_together = ('owner', 'date')
 
 
 class TrainingStressBalance(object):
-    def __init__(self, start, end):
+    def __init__(self, start, end, fitness_days=balance.FITNESS_DAYS, fatigue_days=balance.FATIGUE_DAYS):
         self.data = {k: TrainingStressBalancePoint(k) for k in date_array(start, end)}
+        self.fitness_days = fitness_days
+        self.fatigue_days = fatigue_days
 
     def insert(self, activity):
         self.data[activity.time.date()].trimp += activity.trimp or 0
 
-    def inflate(self):
-        for index, point in enumerate(self.points()):
-            if index != 0:
-                point.increment_fitness(last_point)
-            last_point = point
+    def inflate(self, seed=None):
+        points = self.points()
+        fitness, fatigue, form = balance.training_stress_balance(
+            [a.trimp for a in points],
+            self.fitness_days,
+            self.fatigue_days,
+            None if seed is None else (seed.fitness, seed.fatigue),
+        )
+        for point, values in zip(points, zip(fitness.tolist(), fatigue.tolist(), form.tolist())):
+            point.fitness, point.fatigue, point.form = values
 
     def points(self):
         return sorted(self.data.values(), key=lambda h: h.date)
 
     @classmethod
-    def history_for_user(cls, user, start=None, end=None):
-        activities, start, end = Activity.trimp_activities(user, start, end)
-        balance = cls(start, end)
-        for activity in activities:
-            balance.insert(activity)
-        balance.inflate()
-        return balance.points()
+    def refresh(cls, user, since=None):
+        """
+        Rebuild the stored daily balance for ``user`` from ``since`` onwards,
+        continuing from the last stored day before it.
+        """
+        with transaction.atomic():
+            User.objects.select_for_update().filter(pk=user.pk).first()
+            activities = Activity.objects.filter(owner=user, trimp__isnull=False)
+            days = TrainingStressBalanceDay.objects.filter(owner=user)
+            bounds = activities.aggregate(first=Min('time'), last=Max('time'))
+            if bounds['first'] is None:
+                days.delete()
+                return
+            first, last = bounds['first'].date(), bounds['last'].date()
+            seed = None
+            if since is not None and since > first:
+                # Stored days stop at the last activity, so after a gap the seed is further back.
+                seed = days.filter(date__lt=since).order_by('date').last()
+            if seed is None:
+                since = first
+                days.delete()
+            else:
+                since = seed.date + datetime.timedelta(days=1)
+                days.filter(date__gte=since).delete()
+            history = cls(since, last, *user.profile.balance_settings())
+            for activity in activities.filter(time__gte=start_of_day(since)).only('time', 'trimp'):
+                history.insert(activity)
+            history.inflate(seed)
+            TrainingStressBalanceDay.objects.bulk_create([
+                TrainingStressBalanceDay(
+                    owner=user, date=a.date, trimp=a.trimp, fitness=a.fitness, fatigue=a.fatigue, form=a.form
+                ) for a in history.points()
+            ])
+
+    @classmethod
+    def history_for_user(cls, user, start=None, end=None, resolution='day'):
+        """
+        Stored balance for ``user`` between ``start`` and ``end`` inclusive,
+        summarised per day, week or month.
+        """
+        # The queue is in memory, so a restart can drop the recalculation of
+        # activities left dirty.  Reading the balance queues it again.
+        if Activity.objects.filter(owner=user, trimp_dirty=True).exists():
+            queue_dirty_trimp(user.pk)
+        days = TrainingStressBalanceDay.objects.filter(owner=user)
+        if not days.exists():
+            cls.refresh(user)
+        if start is not None:
+            days = days.filter(date__gte=RESOLUTIONS[resolution](start))
+        if end is not None:
+            days = days.filter(date__lte=end)
+        if resolution == 'day':
+            return list(days)
+        return cls.downsample(days, resolution)
+
+    @staticmethod
+    def downsample(days, resolution):
+        """
+        Group consecutive days into periods labelled by their first date.
+        TRIMP is summed and the other values are taken from the last day.
+        """
+        period = RESOLUTIONS[resolution]
+        points = []
+        for day in days:
+            date = period(day.date)
+            if not points or points[-1].date != date:
+                points.append(TrainingStressBalancePoint(date))
+            point = points[-1]
+            point.trimp += day.trimp
+            point.fitness, point.fatigue, point.form = day.fitness, day.fatigue, day.form
+        return points
 
 
 class TrainingStressBalancePoint(object):
@@ -345,12 +838,3 @@ class TrainingStressBalancePoint(object):
         self.fitness = 0
         self.fatigue = 0
         self.form = 0
-
-    def increment_fitness(self, last_point):
-        self.fitness = (
-            last_point.fitness + (self.trimp - last_point.fitness) * (1.0 - math.exp(-1.0 / 42.0))
-        )
-        self.fatigue = (
-            last_point.fatigue + (self.trimp - last_point.fatigue) * (1.0 - math.exp(-1.0 / 7.0))
-        )
-        self.form = self.fitness - self.fatigue
@@ -0,0 +1,61 @@
+import gzip
+import os
+import struct
+import xml.etree.ElementTree as ET
+import zlib
+from collections import OrderedDict
+
+from .base import ParseError
+from .fit import read_fit
+from .gpx import read_gpx
+from .tcx import read_tcx
+
+PARSERS = OrderedDict()
+
+
+def register(extension, parser):
+    PARSERS[extension.lower()] = parser
+
+
+def extension(name):
+    name = name.lower()
+    if name.endswith('.gz'):
+        name = name[:-3]
+    return os.path.splitext(name)[1]
+
+
+def supported(name):
+    return extension(name) in PARSERS
+
+
+def read(source, name=None):
+    """
+    Yield the activities in ``source``, a path or a binary file object,
+    choosing the parser from the extension of ``name``, which defaults to
+    the path.  Files ending in .gz are decompressed as they are read.
+
+    Every parser yields dicts of ``name``, ``time`` and time ordered
+    ``points``, the shape RunSerializer validates, one activity at a time.
+    Unreadable input raises ParseError.
+    """
+    name = source if name is None else name
+    parser = PARSERS.get(extension(name))
+    if parser is None:
+        raise ParseError('Unsupported file type: {}'.format(os.path.basename(name)))
+    try:
+        if isinstance(source, str):
+            with open(source, 'rb') as opened:
+                yield from read(opened, name)
+            return
+        if name.lower().endswith('.gz'):
+            with gzip.GzipFile(fileobj=source) as unpacked:
+                yield from parser(unpacked)
+        else:
+            yield from parser(source)
+    except (ET.ParseError, struct.error, EOFError, OSError, zlib.error) as error:
+        raise ParseError(str(error))
+
+
+register('.tcx', read_tcx)
+register('.gpx', read_gpx)
+register('.fit', read_fit)
@@ -0,0 +1,51 @@
+import math
+
+REQUIRED = ('time', 'latitude', 'longitude', 'altitude', 'distance')
+EARTH_RADIUS = 6371000.0
+
+
+class ParseError(ValueError):
+    pass
+
+
+def element_value(element, convert=float):
+    """
+    The text of ``element`` passed through ``convert``, or None when the
+    element is empty.
+    """
+    text = (element.text or '').strip()
+    return convert(text) if text else None
+
+
+def new_activity(name='', time=None):
+    return {'name': name, 'time': time, 'points': []}
+
+
+def add_point(points, point):
+    """
+    Append ``point`` with its speed over the previous point, skipping points
+    that lack a required field or do not move forward in time.
+    """
+    if any(point.get(a) is None for a in REQUIRED):
+        return
+    if points:
+        last = points[-1]
+        seconds = (point['time'] - last['time']).total_seconds()
+        if seconds <= 0:
+            return
+        point['speed'] = (point['distance'] - last['distance']) / seconds
+    else:
+        point['speed'] = 0.0
+    points.append(point)
+
+
+def haversine(latitude, longitude, other_latitude, other_longitude):
+    """Great circle distance in metres."""
+    latitude, longitude, other_latitude, other_longitude = map(
+        math.radians, (latitude, longitude, other_latitude, other_longitude)
+    )
+    a = (
+        math.sin((other_latitude - latitude) / 2) ** 2 +
+        math.cos(latitude) * math.cos(other_latitude) * math.sin((other_longitude - longitude) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
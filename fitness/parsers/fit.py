@@ -0,0 +1,168 @@
+import datetime
+import struct
+
+from .base import ParseError, add_point, new_activity
+
+FIT_EPOCH = datetime.datetime(1989, 12, 31, tzinfo=datetime.timezone.utc)
+SEMICIRCLES = 180.0 / 2 ** 31
+
+FILE_ID = 0
+SESSION = 18
+RECORD = 20
+TIMESTAMP = 253
+
+# Base type number: (struct code, invalid value)
+BASE_TYPES = {
+    0x00: ('B', 0xFF),
+    0x01: ('b', 0x7F),
+    0x02: ('B', 0xFF),
+    0x03: ('h', 0x7FFF),
+    0x04: ('H', 0xFFFF),
+    0x05: ('i', 0x7FFFFFFF),
+    0x06: ('I', 0xFFFFFFFF),
+    0x08: ('f', None),
+    0x09: ('d', None),
+    0x0A: ('B', 0x00),
+    0x0B: ('H', 0x0000),
+    0x0C: ('I', 0x00000000),
+    0x0E: ('q', 0x7FFFFFFFFFFFFFFF),
+    0x0F: ('Q', 0xFFFFFFFFFFFFFFFF),
+    0x10: ('Q', 0x0000000000000000),
+}
+
+# Record field number: (name, scale, offset)
+RECORD_FIELDS = {
+    0: ('latitude', SEMICIRCLES, 0),
+    1: ('longitude', SEMICIRCLES, 0),
+    2: ('altitude', 0.2, -500),
+    3: ('heart_rate', 1, 0),
+    4: ('cadence', 1, 0),
+    5: ('distance', 0.01, 0),
+    78: ('enhanced_altitude', 0.2, -500),
+}
+
+SPORTS = {
+    0: 'Generic',
+    1: 'Running',
+    2: 'Cycling',
+    5: 'Swimming',
+    11: 'Walking',
+    17: 'Hiking',
+}
+
+
+class Definition(object):
+    """
+    Layout of the data messages of one local message type, compiled to a
+    single struct so each message is decoded in one call.
+    """
+    def __init__(self, number, big_endian, fields, extra_size):
+        self.number = number
+        codes = ['>' if big_endian else '<']
+        self.fields = []
+        for field, size, base_type in fields:
+            code, invalid = BASE_TYPES.get(base_type & 0x1F, (None, None))
+            if code is not None and struct.calcsize(code) == size:
+                codes.append(code)
+                self.fields.append((field, invalid))
+            else:
+                codes.append('{}x'.format(size))
+        if extra_size:
+            codes.append('{}x'.format(extra_size))
+        self.struct = struct.Struct(''.join(codes))
+
+    def decode(self, data):
+        return {
+            field: value
+            for (field, invalid), value in zip(self.fields, self.struct.unpack(data))
+            if value != invalid
+        }
+
+
+def read_exactly(source, size):
+    data = source.read(size)
+    if len(data) != size:
+        raise ParseError('Truncated FIT file')
+    return data
+
+
+def record_point(values):
+    point = {'time': FIT_EPOCH + datetime.timedelta(seconds=values[TIMESTAMP])}
+    for field, (name, scale, offset) in RECORD_FIELDS.items():
+        if field in values:
+            point[name] = values[field] * scale + offset
+    enhanced_altitude = point.pop('enhanced_altitude', None)
+    if enhanced_altitude is not None:
+        point['altitude'] = enhanced_altitude
+    point.setdefault('heart_rate', None)
+    point.setdefault('cadence', None)
+    return point
+
+
+def read_fit(source):
+    """
+    Yield the activity in each FIT file found in ``source``, which may hold
+    several chained files.
+
+    Only what the stream needs is decoded: record messages become points,
+    and the session's sport names the activity.  Messages are read one at a
+    time, so the whole file is never in memory.
+    """
+    while True:
+        header = source.read(12)
+        if not header:
+            return
+        if len(header) < 12 or header[8:12] != b'.FIT':
+            raise ParseError('Not a FIT file')
+        header_size, data_size = header[0], struct.unpack('<I', header[4:8])[0]
+        read_exactly(source, header_size - 12)
+        activity = read_messages(source, data_size)
+        read_exactly(source, 2)
+        if activity['points']:
+            activity['time'] = activity['points'][0]['time']
+            yield activity
+
+
+def read_messages(source, data_size):
+    activity = new_activity('Activity')
+    definitions = {}
+    timestamp = 0
+    remaining = data_size
+    while remaining > 0:
+        header = read_exactly(source, 1)[0]
+        remaining -= 1
+        if header & 0x80:
+            local_type = (header >> 5) & 0x03
+            offset = header & 0x1F
+            timestamp = (timestamp & ~0x1F) + offset + (0x20 if offset < (timestamp & 0x1F) else 0)
+        elif header & 0x40:
+            fixed = read_exactly(source, 5)
+            big_endian = fixed[1] == 1
+            number = struct.unpack('>H' if big_endian else '<H', fixed[2:4])[0]
+            fields = [tuple(a) for a in zip(*[iter(read_exactly(source, fixed[4] * 3))] * 3)]
+            remaining -= 5 + fixed[4] * 3
+            extra_size = 0
+            if header & 0x20:
+                count = read_exactly(source, 1)[0]
+                developer = read_exactly(source, count * 3)
+                extra_size = sum(developer[1::3])
+                remaining -= 1 + count * 3
+            definitions[header & 0x0F] = Definition(number, big_endian, fields, extra_size)
+            continue
+        else:
+            local_type = header & 0x0F
+            offset = None
+        definition = definitions.get(local_type)
+        if definition is None:
+            raise ParseError('Data message without a definition')
+        values = definition.decode(read_exactly(source, definition.struct.size))
+        remaining -= definition.struct.size
+        if TIMESTAMP in values:
+            timestamp = values[TIMESTAMP]
+        elif offset is not None:
+            values[TIMESTAMP] = timestamp
+        if definition.number == RECORD and TIMESTAMP in values:
+            add_point(activity['points'], record_point(values))
+        elif definition.number == SESSION and 5 in values:
+            activity['name'] = SPORTS.get(values[5], activity['name'])
+    return activity
@@ -0,0 +1,70 @@
+import xml.etree.ElementTree as ET
+
+from ..streams import parse_time
+from .base import add_point, element_value, haversine, new_activity
+
+CONTAINERS = {'trkpt', 'trkseg', 'trk'}
+
+
+def local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def read_point(element):
+    if element.get('lat') is None or element.get('lon') is None:
+        return None
+    point = {
+        'latitude': float(element.get('lat')),
+        'longitude': float(element.get('lon')),
+        'heart_rate': None,
+        'cadence': None,
+    }
+    for child in element.iter():
+        tag = local_name(child.tag)
+        if tag == 'time':
+            point['time'] = element_value(child, parse_time)
+        elif tag == 'ele':
+            point['altitude'] = element_value(child)
+        elif tag == 'hr':
+            point['heart_rate'] = element_value(child)
+        elif tag == 'cad':
+            point['cadence'] = element_value(child)
+    return point
+
+
+def read_gpx(source):
+    """
+    Yield each track in a GPX file, version 1.0 or 1.1, as an activity.
+
+    Distances are accumulated along the track.  Heart rate and cadence come
+    from Garmin's TrackPointExtension.  Like the TCX reader, elements are
+    dropped once handled, and points need a time and elevation.
+    """
+    parents = []
+    activity = None
+    for event, element in ET.iterparse(source, events=('start', 'end')):
+        tag = local_name(element.tag)
+        if event == 'start':
+            parents.append(element)
+            if tag == 'trk':
+                activity = new_activity()
+            continue
+        parents.pop()
+        if tag == 'trkpt' and activity is not None:
+            point = read_point(element)
+            points = activity['points']
+            if point is not None:
+                point['distance'] = points[-1]['distance'] + haversine(
+                    points[-1]['latitude'], points[-1]['longitude'], point['latitude'], point['longitude']
+                ) if points else 0.0
+                add_point(points, point)
+        elif tag == 'name' and parents and local_name(parents[-1].tag) == 'trk' and element.text:
+            activity['name'] = element.text.strip()
+        elif tag == 'trk':
+            if activity['points']:
+                activity['time'] = activity['points'][0]['time']
+                activity['name'] = activity['name'] or activity['time'].isoformat()
+                yield activity
+            activity = None
+        if tag in CONTAINERS and parents:
+            parents[-1].remove(element)
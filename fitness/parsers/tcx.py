@@ -0,0 +1,75 @@
+import xml.etree.ElementTree as ET
+
+from ..streams import parse_time
+from .base import add_point, element_value, new_activity
+
+TCX = '{http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2}'
+EXTENSION = '{http://www.garmin.com/xmlschemas/ActivityExtension/v2}'
+
+ACTIVITY = TCX + 'Activity'
+ID = TCX + 'Id'
+NOTES = TCX + 'Notes'
+TRACKPOINT = TCX + 'Trackpoint'
+CONTAINERS = {TRACKPOINT, TCX + 'Track', TCX + 'Lap', ACTIVITY}
+
+
+def read_point(element):
+    point = {'heart_rate': None, 'cadence': None}
+    for child in element:
+        tag = child.tag[len(TCX):]
+        if tag == 'Time':
+            point['time'] = element_value(child, parse_time)
+        elif tag == 'Position':
+            for value in child:
+                if value.tag == TCX + 'LatitudeDegrees':
+                    point['latitude'] = element_value(value)
+                elif value.tag == TCX + 'LongitudeDegrees':
+                    point['longitude'] = element_value(value)
+        elif tag == 'AltitudeMeters':
+            point['altitude'] = element_value(child)
+        elif tag == 'DistanceMeters':
+            point['distance'] = element_value(child)
+        elif tag == 'HeartRateBpm':
+            value = child.find(TCX + 'Value')
+            if value is not None:
+                point['heart_rate'] = element_value(value)
+        elif tag == 'Extensions':
+            for value in child.iter(EXTENSION + 'RunCadence'):
+                point['cadence'] = element_value(value)
+    return point
+
+
+def read_tcx(source):
+    """
+    Yield each activity in a TCX file as a dict of ``name``, ``time`` and
+    ``points``, the shape RunSerializer validates.
+
+    The file is read incrementally and every trackpoint, lap and activity is
+    dropped from the tree once handled, so memory does not grow with the
+    length of the file.  Points without a time, position, altitude or
+    distance are skipped, as are repeated timestamps.  Activities without
+    any points are not yielded.
+    """
+    parents = []
+    activity = None
+    for event, element in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            parents.append(element)
+            if element.tag == ACTIVITY:
+                activity = new_activity(element.get('Sport', ''))
+            continue
+        parents.pop()
+        if element.tag == TRACKPOINT and activity is not None:
+            add_point(activity['points'], read_point(element))
+        elif element.tag == ID and parents and parents[-1].tag == ACTIVITY:
+            activity['time'] = element_value(element, parse_time)
+        elif element.tag == NOTES and parents and parents[-1].tag == ACTIVITY and element.text:
+            activity['name'] = element.text.strip()
+        elif element.tag == ACTIVITY:
+            if activity['points']:
+                if activity['time'] is None:
+                    activity['time'] = activity['points'][0]['time']
+                yield activity
+            activity = None
+        if element.tag in CONTAINERS and parents:
+            parents[-1].remove(element)
@@ -0,0 +1,185 @@
+import math
+import struct
+import zlib
+
+import numpy
+
+PYRAMID_VERSION = 1
+CHANNELS = ('heart_rate', 'speed', 'altitude', 'cadence')
+STATISTICS = ('min', 'max', 'mean')
+# Points per bucket in the finest stored level, and the growth to the next.
+FIRST_SIZE = 16
+FACTOR = 4
+# Coarser levels stop once one has no more buckets than this.
+SMALLEST_LEVEL = 64
+HEADER = struct.Struct('<BIB')
+LEVEL = struct.Struct('<II')
+
+
+def aggregate(times, columns, size, first=0, last=None):
+    """
+    Buckets of ``size`` points from ``first`` to ``last``, with their first
+    and last times and the min, max and mean of each channel, ignoring
+    missing readings.
+    """
+    last = len(times) if last is None else last
+    starts = numpy.arange(first, last, size)
+    if not len(starts):
+        empty = numpy.zeros(0)
+        return dict(
+            {'size': size, 'time': empty, 'end': empty},
+            **{a: {b: empty for b in STATISTICS} for a in CHANNELS}
+        )
+    level = {
+        'size': size,
+        'time': times[starts],
+        'end': times[numpy.minimum(starts + size, last) - 1],
+    }
+    for name in CHANNELS:
+        values = columns(name)[:last]
+        valid = ~numpy.isnan(values)
+        counts = numpy.add.reduceat(valid.astype(numpy.int64), starts)
+        sums = numpy.add.reduceat(numpy.where(valid, values, 0), starts)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            level[name] = {
+                'min': numpy.fmin.reduceat(values, starts),
+                'max': numpy.fmax.reduceat(values, starts),
+                'mean': sums / counts,
+            }
+    return level
+
+
+def build(stream):
+    """
+    The levels of aggregated buckets of ``stream``, FIRST_SIZE points each
+    and FACTOR times larger at every level, as compressed bytes.  Streams
+    too short to need a level give empty bytes.
+    """
+    length = len(stream)
+    levels = []
+    size = FIRST_SIZE
+    while length > size:
+        levels.append(aggregate(stream.column('time'), stream.column, size))
+        if len(levels[-1]['time']) <= SMALLEST_LEVEL:
+            break
+        size *= FACTOR
+    if not levels:
+        return b''
+    parts = [HEADER.pack(PYRAMID_VERSION, length, len(levels))]
+    for level in levels:
+        parts.append(LEVEL.pack(level['size'], len(level['time'])))
+        parts.append(level['time'].astype('<f8').tobytes())
+        parts.append(level['end'].astype('<f8').tobytes())
+        for name in CHANNELS:
+            for statistic in STATISTICS:
+                parts.append(level[name][statistic].astype('<f4').tobytes())
+    return zlib.compress(b''.join(parts))
+
+
+def decode(data):
+    if not data:
+        return 0, []
+    body = zlib.decompress(bytes(data))
+    version, length, count = HEADER.unpack_from(body)
+    if version != PYRAMID_VERSION:
+        raise ValueError('Unknown pyramid version {}'.format(version))
+    offset = HEADER.size
+    levels = []
+
+    def read(dtype, count):
+        nonlocal offset
+        values = numpy.frombuffer(body, dtype, count, offset).astype(numpy.float64)
+        offset += values.size * numpy.dtype(dtype).itemsize
+        return values
+
+    for unused in range(count):
+        size, buckets = LEVEL.unpack_from(body, offset)
+        offset += LEVEL.size
+        level = {'size': size, 'time': read('<f8', buckets), 'end': read('<f8', buckets)}
+        for name in CHANNELS:
+            level[name] = {a: read('<f4', buckets) for a in STATISTICS}
+        levels.append(level)
+    return length, levels
+
+
+def level_slice(level, start, end):
+    first = int(numpy.searchsorted(level['end'], start, side='left'))
+    last = int(numpy.searchsorted(level['time'], end, side='right'))
+    return first, max(first, last)
+
+
+def samples(data, load_stream, start=None, end=None, max_points=500):
+    """
+    Buckets covering the ``start`` to ``end`` seconds of an activity, as
+    fine as possible without exceeding ``max_points``, ready for JSON.
+
+    Stored levels answer wide ranges without touching the point stream.
+    Narrower ranges are aggregated from the stream given by
+    ``load_stream``, down to the single points themselves.
+    """
+    length, levels = decode(data)
+    start = -math.inf if start is None else start
+    end = math.inf if end is None else end
+    if levels:
+        first, last = level_slice(levels[0], start, end)
+        needed = math.ceil(min((last - first) * levels[0]['size'], length) / max_points)
+    else:
+        needed = 1
+    if needed >= FIRST_SIZE:
+        for level in levels:
+            if level['size'] >= needed or level is levels[-1]:
+                first, last = level_slice(level, start, end)
+                if last - first > max_points:
+                    # Even the coarsest stored level has too many buckets.
+                    level = regroup(level, length, first, last, math.ceil((last - first) / max_points))
+                    first, last = 0, len(level['time'])
+                return as_json(level, first, last)
+    stream = load_stream()
+    times = stream.column('time')
+    first = int(numpy.searchsorted(times, start, side='left'))
+    last = int(numpy.searchsorted(times, end, side='right'))
+    level = aggregate(times, stream.column, max(1, math.ceil((last - first) / max_points)), first, last)
+    return as_json(level, 0, len(level['time']))
+
+
+def regroup(level, length, first, last, group):
+    """
+    The buckets of ``level`` from ``first`` to ``last`` merged ``group`` at a
+    time, for a stream of ``length`` points.  Means are weighted by the
+    points in each bucket, since the level keeps no count of readings.
+    """
+    starts = numpy.arange(0, last - first, group)
+    indices = numpy.arange(first, last)
+    points = numpy.minimum(level['size'], length - indices * level['size']).astype(numpy.float64)
+    merged = {
+        'size': level['size'] * group,
+        'time': level['time'][first + starts],
+        'end': level['end'][numpy.minimum(first + starts + group, last) - 1],
+    }
+    for name in CHANNELS:
+        means = level[name]['mean'][first:last]
+        valid = ~numpy.isnan(means)
+        weights = numpy.add.reduceat(numpy.where(valid, points, 0), starts)
+        sums = numpy.add.reduceat(numpy.where(valid, means * points, 0), starts)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            merged[name] = {
+                'min': numpy.fmin.reduceat(level[name]['min'][first:last], starts),
+                'max': numpy.fmax.reduceat(level[name]['max'][first:last], starts),
+                'mean': sums / weights,
+            }
+    return merged
+
+
+def as_json(level, first, last):
+    """
+    Columns of the buckets from ``first`` to ``last`` for JSON, leaving out
+    channels without readings.
+    """
+    def values(array):
+        return [None if math.isnan(a) else a for a in array[first:last].tolist()]
+
+    output = {'size': level['size'], 'time': values(level['time']), 'end': values(level['end'])}
+    for name in CHANNELS:
+        if not numpy.isnan(level[name]['mean'][first:last]).all():
+            output[name] = {a: values(level[name][a]) for a in STATISTICS}
+    return output
@@ -0,0 +1,87 @@
+import struct
+
+import numpy
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils import encoders
+
+from .streams import as_integers
+
+COLUMNS_MAGIC = b'FC'
+COLUMNS_VERSION = 1
+# Magic, version and the length of the JSON header, padded so that the
+# columns after it start on an 8 byte boundary.
+COLUMNS_HEADER = struct.Struct('<2sBxI')
+ALIGNMENT = 8
+DELTA_TYPES = (numpy.int8, numpy.int16, numpy.int32)
+
+
+def padding(size):
+    return -size % ALIGNMENT
+
+
+class ColumnEncoder(encoders.JSONEncoder):
+    """
+    Encodes arrays as descriptions of columns written after the JSON, each
+    aligned so the browser can view it as a typed array in place.
+    """
+    def __init__(self, *args, **kwargs):
+        super(ColumnEncoder, self).__init__(*args, **kwargs)
+        self.columns = []
+        self.size = 0
+
+    def default(self, obj):
+        if isinstance(obj, numpy.ndarray):
+            return self.add_column(obj)
+        return super(ColumnEncoder, self).default(obj)
+
+    def add_column(self, values):
+        """
+        Values that are whole numbers at some decimal scale, such as times
+        and coordinates, are written as the first of them and then the
+        differences between neighbours, in the narrowest signed integer
+        that holds them.  Others are written as they are, as 32 or 64 bit
+        floats.
+        """
+        description = {}
+        if values.dtype.kind in 'iu':
+            values = values.astype(numpy.float64)
+        scale, integers = as_integers(values)
+        data = None
+        if scale is not None:
+            first = int(integers[0]) if len(integers) else 0
+            deltas = numpy.diff(integers, prepend=first)
+            for dtype in DELTA_TYPES:
+                limits = numpy.iinfo(dtype)
+                if not len(deltas) or limits.min <= deltas.min() and deltas.max() <= limits.max:
+                    data = deltas.astype(dtype)
+                    description.update(scale=scale, first=first)
+                    break
+        if data is None:
+            data = values.astype('<f4' if values.dtype == numpy.float32 else '<f8')
+        description.update(column=data.dtype.name, offset=self.size, length=len(data))
+        data = data.astype(data.dtype.newbyteorder('<')).tobytes()
+        self.columns.append(data + bytes(padding(len(data))))
+        self.size += len(self.columns[-1])
+        return description
+
+
+class ColumnarRenderer(BaseRenderer):
+    """
+    A binary format for point data.  A short fixed header is followed by the
+    JSON of the response with every array replaced by a description of a
+    column, and then the columns.
+    """
+    media_type = 'application/vnd.fitness.columns'
+    format = 'columns'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        encoder = ColumnEncoder(check_circular=False, separators=(',', ':'))
+        header = encoder.encode(data).encode('utf-8')
+        header += b' ' * padding(COLUMNS_HEADER.size + len(header))
+        return b''.join(
+            [COLUMNS_HEADER.pack(COLUMNS_MAGIC, COLUMNS_VERSION, len(header)), header] + encoder.columns
+        )
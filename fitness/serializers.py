@@ -1,6 +1,13 @@
+import math
+from collections import OrderedDict
+
+import numpy
+from django.conf import settings
 from django.contrib.auth.models import User
 from rest_framework import serializers
-from fitness.models import Activity
+from fitness.models import Activity, RESOLUTIONS, SAMPLE_POINTS, TrimpRecalculation, stream_fields
+from fitness.streaming import BATCH_SIZE
+from fitness.streams import COLUMNS, TIMESTAMP, PointStream, matched_time
 
 
 class UserSerializer(serializers.HyperlinkedModelSerializer):
@@ -17,10 +24,42 @@ class TrimpSerializer(serializers.Serializer):
     form = serializers.FloatField()
 
 
+class TrimpQuerySerializer(serializers.Serializer):
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    resolution = serializers.ChoiceField(choices=sorted(RESOLUTIONS), default='day')
+
+
+class SamplesQuerySerializer(serializers.Serializer):
+    start = serializers.FloatField(required=False)
+    to = serializers.FloatField(required=False)
+    max_points = serializers.IntegerField(min_value=2, max_value=5000, default=SAMPLE_POINTS)
+
+    def get_fields(self):
+        # "from" is a keyword, so the field is declared as start.
+        fields = super(SamplesQuerySerializer, self).get_fields()
+        fields['from'] = fields.pop('start')
+        return fields
+
+    def validate(self, data):
+        if data.get('from', -math.inf) > data.get('to', math.inf):
+            raise serializers.ValidationError('from must not be after to.')
+        return data
+
+
+class TrimpRecalculationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = TrimpRecalculation
+        fields = ('id', 'status', 'total', 'done', 'created', 'finished')
+        read_only_fields = fields
+
+
 class ActivityDetailSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Activity
         fields = ('url', 'name', 'time', 'geo_json', 'svg_points')
+        # Written an item at a time by streamed responses.
+        streamed_fields = ('geo_json', 'svg_points')
 
 
 class ActivityListSerializer(serializers.HyperlinkedModelSerializer):
@@ -41,10 +80,79 @@ class PointSerializer(serializers.Serializer):
     time = serializers.DateTimeField()
 
 
+class PointListField(serializers.Field):
+    """
+    A list of points validated a column at a time into a PointStream.
+
+    Payloads where every point is a dict of plain numbers and ISO 8601
+    strings take the bulk path.  Anything else goes through
+    PointSerializer, so errors are reported exactly as before.
+    """
+    NUMBERS = {int, float}
+    default_error_messages = {
+        'empty': 'At least one point is required.',
+    }
+
+    def to_internal_value(self, data):
+        stream = self.bulk_stream(data)
+        if stream is None:
+            stream = PointStream.from_points(PointSerializer(many=True).run_validation(data))
+        if not len(stream):
+            self.fail('empty')
+        return stream
+
+    def to_representation(self, value):
+        return PointSerializer(value.points(), many=True).data
+
+    def iter_representation(self, value):
+        """
+        The points of to_representation one at a time, made from the
+        stream a batch at a time.
+        """
+        fields = PointSerializer().fields
+        for first in range(0, len(value), BATCH_SIZE):
+            for point in value.points(first, first + BATCH_SIZE):
+                point['time'] = fields['time'].to_representation(point['time'])
+                yield {a: point.get(a) for a in fields}
+
+    def bulk_stream(self, data):
+        if type(data) is not list or not data or {type(a) for a in data} != {dict}:
+            return None
+        fields = PointSerializer().fields
+        names = set(fields)
+        if not all(names <= a.keys() for a in data):
+            return None
+        times = [a['time'] for a in data]
+        if {type(a) for a in times} != {str}:
+            return None
+        matches = [TIMESTAMP.match(a) for a in times]
+        if None in matches:
+            return None
+        try:
+            times = [matched_time(a) for a in matches]
+            start = min(times)
+            offsets = numpy.array([(a - start).total_seconds() for a in times])
+        except (ValueError, TypeError, OverflowError):
+            return None
+        if start.tzinfo is None and settings.USE_TZ:
+            return None
+        order = numpy.argsort(offsets, kind='mergesort')
+        columns = OrderedDict([('time', offsets[order])])
+        for name in COLUMNS:
+            if name == 'time':
+                continue
+            values = [a[name] for a in data]
+            allowed = self.NUMBERS | {type(None)} if fields[name].allow_null else self.NUMBERS
+            if not {type(a) for a in values} <= allowed:
+                return None
+            columns[name] = numpy.array(values, dtype=numpy.float64)[order]
+        return PointStream(fields['time'].enforce_timezone(start), columns)
+
+
 class RunSerializer(serializers.Serializer):
     time = serializers.DateTimeField()
     name = serializers.CharField(max_length=64)
-    points = PointSerializer(many=True)
+    points = PointListField()
     owner = UserSerializer(
         read_only=True,
         default=serializers.CreateOnlyDefault('Junk')
@@ -54,56 +162,63 @@ class RunSerializer(serializers.Serializer):
         return self.context['request'].user
 
     def create(self, validated_data):
-        new_activity = Activity.objects.update_or_create(
-            owner=validated_data['owner'],
-            time=validated_data['time'],
-            defaults=self.defaults(validated_data),
-        )[0]
-        new_activity.trimp = new_activity.calculate_trimp()
-        new_activity.save()
-        return new_activity
+        return self.store(validated_data['owner'], validated_data)[0]
 
     def to_representation(self, item):
         return ActivityListSerializer(context=self.context).to_representation(item)
 
+    @classmethod
+    def store(cls, owner, validated_data):
+        """
+        Save an activity through Activity.objects.store(), which compares
+        the encoded stream with the stored one before the summaries are
+        worked out.
+        """
+        stream = cls.point_stream(validated_data)
+        return Activity.objects.store(
+            owner, validated_data['time'], dict(stream_fields(stream), name=validated_data['name']),
+            lambda: cls.summaries(stream)
+        )
+
     @classmethod
     def defaults(cls, validated_data):
-        points = validated_data['points']
-        return {
-            'name': validated_data['name'],
-            'distance': max(
-                a['distance'] for a in points
-            ),
-            'duration': cls.duration(points),
-            'elevation': cls.elevation_gain(points),
-            'data_points': len(points),
-            'stream': cls.stream(points),
-        }
+        """
+        Model fields for an activity, with ``points`` either a PointStream or
+        a list of point dicts.
+        """
+        stream = cls.point_stream(validated_data)
+        return dict(stream_fields(stream), name=validated_data['name'], **cls.summaries(stream))
 
     @staticmethod
-    def duration(points):
-        last = max(a['time'] for a in points)
-        first = min(a['time'] for a in points)
-        return (last - first).total_seconds()
+    def point_stream(validated_data):
+        stream = validated_data['points']
+        if not isinstance(stream, PointStream):
+            stream = PointStream.from_points(stream)
+        return stream
 
-    @staticmethod
-    def elevation_gain(points):
-        gain = 0
-        last_elevation = None
-        points_up = 0
-        for point in points:
-            if last_elevation is not None and point['altitude'] > last_elevation:
-                if points_up < 2:
-                    points_up += 1
-                else:
-                    gain += (int(point['altitude']) - int(last_elevation))
-            else:
-                points_up = 0
-            last_elevation = point['altitude']
-        return gain
+    @classmethod
+    def summaries(cls, stream):
+        """
+        Distance, duration, climb and size, taken from the time ordered
+        stream columns.
+        """
+        distance = numpy.nanmax(stream.column('distance'))
+        return dict(
+            distance=float(distance),
+            duration=float(stream.columns['time'][-1]),
+            elevation=cls.elevation_gain(stream.column('altitude')),
+            data_points=len(stream),
+        )
 
     @staticmethod
-    def stream(points):
-        return {
-            a['time'].isoformat(): a for a in sorted(points, key=lambda h: h['time'])
-        }
+    def elevation_gain(altitude):
+        """
+        Total climb in whole metres, counting a rise only once it is the
+        third or later in a run of consecutive rises.
+        """
+        rises = altitude[1:] > altitude[:-1]
+        index = numpy.arange(len(rises))
+        run = index - numpy.maximum.accumulate(numpy.where(rises, -1, index))
+        climbing = rises & (run >= 3)
+        whole = numpy.trunc(altitude)
+        return int((whole[1:] - whole[:-1])[climbing].sum())
@@ -0,0 +1,97 @@
+import heapq
+import math
+
+import numpy
+
+DETAIL_VERSION = 1
+EARTH_RADIUS = 6371000.0
+METRES_PER_DEGREE = math.radians(1) * EARTH_RADIUS
+
+
+def project(latitude, longitude):
+    """
+    Positions in metres east and north of the first one, on a plane that is
+    accurate enough over the extent of a single activity.
+    """
+    east = (longitude - longitude[0]) * METRES_PER_DEGREE * math.cos(math.radians(latitude.mean()))
+    north = (latitude - latitude[0]) * METRES_PER_DEGREE
+    return east, north
+
+
+def segment_distances(x, y, first, last):
+    """
+    Distances of the points strictly between ``first`` and ``last`` from the
+    segment joining them.
+    """
+    px, py = x[first + 1:last], y[first + 1:last]
+    dx, dy = x[last] - x[first], y[last] - y[first]
+    length = dx * dx + dy * dy
+    if length:
+        along = numpy.clip(((px - x[first]) * dx + (py - y[first]) * dy) / length, 0, 1)
+    else:
+        along = 0
+    return numpy.hypot(px - x[first] - along * dx, py - y[first] - along * dy)
+
+
+def rank(x, y, limit):
+    """
+    Douglas-Peucker split order of the interior points of a line: up to
+    ``limit`` indices, most significant first, and the tolerance below
+    which each one is kept.
+
+    The largest deviation is always split next and a point's tolerance is
+    capped by that of the split which exposed it, so tolerances never
+    increase.  The first n indices with both ends are then the best n + 2
+    point simplification, and those whose tolerance exceeds some epsilon
+    are exactly what classic Douglas-Peucker keeps at that epsilon.
+    """
+    heap = []
+
+    def push(first, last, ceiling):
+        if last - first > 1:
+            distances = segment_distances(x, y, first, last)
+            index = int(distances.argmax())
+            heapq.heappush(heap, (-min(float(distances[index]), ceiling), first + 1 + index, first, last))
+
+    push(0, len(x) - 1, math.inf)
+    indices = []
+    tolerances = []
+    while heap and len(indices) < limit:
+        negative, index, first, last = heapq.heappop(heap)
+        indices.append(index)
+        tolerances.append(-negative)
+        push(first, index, -negative)
+        push(index, last, -negative)
+    return indices, tolerances
+
+
+def track_detail(stream, limit):
+    """
+    Levels of detail for the located points of ``stream``, as stored on an
+    activity: the first and last located indices and the split order of up
+    to ``limit`` others, with tolerances in metres.
+    """
+    located = numpy.flatnonzero(stream.valid('latitude') & stream.valid('longitude'))
+    detail = {'version': DETAIL_VERSION, 'ends': [], 'indices': [], 'tolerances': []}
+    if not len(located):
+        return detail
+    x, y = project(stream.column('latitude')[located], stream.column('longitude')[located])
+    indices, tolerances = rank(x, y, limit)
+    detail['ends'] = sorted({int(located[0]), int(located[-1])})
+    detail['indices'] = located[indices].tolist()
+    detail['tolerances'] = [round(a, 2) for a in tolerances]
+    return detail
+
+
+def kept(detail, max_points=None, tolerance=None):
+    """
+    Sorted stream indices of a simplified track taken from ``detail``:
+    the points that matter more than ``tolerance`` metres, at most
+    ``max_points`` of them.
+    """
+    count = len(detail['indices'])
+    if tolerance is not None:
+        count = int(numpy.searchsorted(-numpy.array(detail['tolerances']), -tolerance, side='left'))
+    if max_points is not None:
+        count = min(count, max(max_points - len(detail['ends']), 0))
+    return sorted(set(detail['ends']) | set(detail['indices'][:count]))
@@ -228,31 +228,73 @@ function clearStatus(){
 function clearStatusEvent(event){
     clearStatus();
 }
+function markActivity(activity, status) {
+    var panel = $("#" + labelFromTime(activity.time));
+    panel.removeClass('panel-default');
+    panel.addClass(status);
+}
 function uploadActivities(){
-    $.each(readStatus.parsedActivities, function(index, activity) {
-        $.ajax({
-            url:"/fitness/api/activities/",
-            type:"POST",
-            data: JSON.stringify(activity),
-            contentType:"application/json; charset=utf-8",
-            dataType:"json",
-            success: function(){
-                var id = JSON.parse(this.data).time;
-                var panel = $("#" + labelFromTime(id));
-                panel.removeClass('panel-default');
-                panel.addClass('panel-success');
-                readStatus.uploaded++;
-                var percentDone = Math.min(100, Math.floor(100 * (readStatus.uploaded / readStatus.count)));
-                $("#progress").css('width', percentDone + '%').attr("aria-valuenow", percentDone);
-                $("#progress").html(percentDone + '%');
-                $("#progress").prop("hidden", false);
+    var activities = Object.values(readStatus.parsedActivities);
+    var batchSize = 50;
+    for (var first = 0; first < activities.length; first += batchSize) {
+        uploadBatch(activities.slice(first, first + batchSize));
+    }
+}
+function uploadBatch(batch){
+    $.ajax({
+        url:"/fitness/api/activities/batch/",
+        type:"POST",
+        data: JSON.stringify(batch),
+        contentType:"application/json; charset=utf-8",
+        dataType:"json",
+        success: function(response){
+            $.each(response.activities, function(index, result) {
+                markActivity(batch[index], result.status == 'invalid' ? 'panel-danger' : 'panel-success');
+            });
+            readStatus.uploaded += batch.length;
+            var percentDone = Math.min(100, Math.floor(100 * (readStatus.uploaded / readStatus.count)));
+            $("#progress").css('width', percentDone + '%').attr("aria-valuenow", percentDone);
+            $("#progress").html(percentDone + '%');
+            $("#progress").prop("hidden", false);
+        }
+    }).fail(function(XMLHttpRequest, textStatus, errorThrown){
+        $.each(batch, function(index, activity) {
+            markActivity(activity, 'panel-danger');
+        });
+    });
+}
 
-            }
-        }).fail(function(XMLHttpRequest, textStatus, errorThrown){
-            var id = JSON.parse(this.data).time;
-            var panel = $("#" + labelFromTime(id));
-            panel.removeClass('panel-default');
-            panel.addClass('panel-danger');
+function uploadFiles(evt){
+    clearStatus();
+    var data = new FormData();
+    $.each(evt.target.files, function(index, file) {
+        data.append('files', file, file.name);
+    });
+    $("#readStatus").html("Uploading " + evt.target.files.length + " files.");
+    $.ajax({
+        url:"/fitness/api/activities/upload/",
+        type:"POST",
+        data: data,
+        processData: false,
+        contentType: false,
+        dataType:"json"
+    }).always(function(response){
+        var files = response.files || (response.responseJSON && response.responseJSON.files) || [];
+        var layers = [];
+        $.each(files, function(index, file) {
+            var status = file.error ? 'panel-danger' : 'panel-success';
+            var detail = file.error ? file.error : file.activities.length + ' activities';
+            layers.push(
+                '<div class="panel ' + status + '">' +
+                '  <div class="panel-heading">' +
+                '    <h3 class="panel-title">' + $('<span>').text(file.name).html() + '</h3>' +
+                '  </div>' +
+                '  <div class="panel-body">' + $('<span>').text(detail).html() +
+                '  </div>' +
+                '</div>'
+            );
         });
+        $("#readStatus").html("Uploaded " + files.length + " files.");
+        $("#located_runs").html(layers.join(' '));
     });
-}
\ No newline at end of file
+}
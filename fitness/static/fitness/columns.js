@@ -0,0 +1,56 @@
+// Reader for the columnar API format, requested with ?format=columns.
+// The response is a short header, JSON in which arrays are replaced by
+// column descriptions, and then the columns themselves, each aligned so it
+// can be viewed as a typed array without copying.
+
+var COLUMN_TYPES = {
+    int8: Int8Array,
+    int16: Int16Array,
+    int32: Int32Array,
+    float32: Float32Array,
+    float64: Float64Array
+};
+
+function readColumn(buffer, base, column) {
+    var values = new COLUMN_TYPES[column.column](buffer, base + column.offset, column.length);
+    if (column.first === undefined) {
+        return values;
+    }
+    // Whole numbers at column.scale, each stored as the change from the last.
+    var output = new Float64Array(column.length);
+    var total = column.first;
+    for (var i = 0; i < values.length; i++) {
+        total += values[i];
+        output[i] = total / column.scale;
+    }
+    return output;
+}
+
+function decodeColumns(buffer) {
+    var view = new DataView(buffer);
+    if (view.getUint8(0) != 70 || view.getUint8(1) != 67 || view.getUint8(2) != 1) {
+        throw new Error('Not a columns response');
+    }
+    var headerLength = view.getUint32(4, true);
+    var base = 8 + headerLength;
+    var header = new TextDecoder().decode(new Uint8Array(buffer, 8, headerLength));
+    return JSON.parse(header, function(key, value) {
+        if (value && typeof value.column == 'string') {
+            return readColumn(buffer, base, value);
+        }
+        return value;
+    });
+}
+
+function getColumns(url, success) {
+    var request = new XMLHttpRequest();
+    request.open('GET', url);
+    request.responseType = 'arraybuffer';
+    request.setRequestHeader('Accept', 'application/vnd.fitness.columns');
+    request.onload = function() {
+        if (request.status == 200) {
+            success(decodeColumns(request.response));
+        }
+    };
+    request.send();
+}
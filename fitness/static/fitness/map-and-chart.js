@@ -263,10 +263,49 @@ function chartDataSets() {
     return chartData
 }
 
+function reading(values, index) {
+    // Averages of missing readings are zero.
+    return values && values[index] ? values[index] : null;
+}
+
+function trackToGeoJson(track) {
+    var features = [];
+    var coordinates = [];
+    for (var i = 0; i < track.latitude.length; i++) {
+        coordinates.push([track.longitude[i], track.latitude[i]]);
+    }
+    for (var i = 1; i < coordinates.length; i++) {
+        var properties = {
+            id: i - 1,
+            elevation: reading(track.altitude, i),
+            speed: reading(track.speed, i),
+            distance: reading(track.distance, i),
+            cadence: reading(track.cadence, i)
+        };
+        if (reading(track.heart_rate, i) != null) {
+            properties.heart_rate = reading(track.heart_rate, i);
+        }
+        features.push({
+            type: "Feature",
+            properties: properties,
+            geometry: {type: "LineString", coordinates: [coordinates[i - 1], coordinates[i]]}
+        });
+    }
+    var ends = [['progress', 0], ['start', 0], ['stop', coordinates.length - 1]];
+    for (var i = 0; coordinates.length && i < ends.length; i++) {
+        features.push({
+            type: "Feature",
+            properties: {id: ends[i][0]},
+            geometry: {type: "Point", coordinates: coordinates[ends[i][1]]}
+        });
+    }
+    return features;
+}
+
 function constructView(activityURL){
-    $.getJSON(activityURL + "?format=json",
+    getColumns(activityURL + "?format=columns",
     function(data) {
-        geoJsonData = data.geo_json;
+        geoJsonData = trackToGeoJson(data.track);
         generateMap();
         var ctx = document.getElementById("myChart");
         chartData = chartDataSets();
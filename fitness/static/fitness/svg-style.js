@@ -1,3 +0,0 @@
-$( document ).ready(function() {
-    var polyline = $(".activity-polyline")[0].style.stroke = getStyleRuleValue('color', '.text-primary');
-});
\ No newline at end of file
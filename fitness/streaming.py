@@ -0,0 +1,63 @@
+import itertools
+from collections.abc import Iterator
+
+from django.http import StreamingHttpResponse
+from rest_framework.settings import api_settings
+from rest_framework.utils import encoders
+
+# Array items encoded and written together.
+BATCH_SIZE = 500
+
+ENCODER = encoders.JSONEncoder(
+    ensure_ascii=not api_settings.UNICODE_JSON, check_circular=False, separators=(',', ':')
+)
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def deferred(function):
+    """
+    The items of what ``function`` returns, calling it only once the first
+    item is wanted.
+    """
+    yield from function()
+
+
+def json_array(items):
+    """
+    JSON text for the array of ``items``, in chunks of BATCH_SIZE items so
+    the whole array is never held as one string.
+    """
+    separator = '['
+    for batch in batches(items, BATCH_SIZE):
+        yield separator + ','.join(map(ENCODER.encode, batch))
+        separator = ','
+    yield '[]' if separator == '[' else ']'
+
+
+def json_object(items):
+    """
+    JSON text for an object of ``items``, pairs of name and value.  Values
+    that are iterators are written a batch of items at a time, others are
+    encoded whole.
+    """
+    separator = '{'
+    for name, value in items:
+        yield '{}{}:'.format(separator, ENCODER.encode(name))
+        if isinstance(value, Iterator):
+            yield from json_array(value)
+        else:
+            yield ENCODER.encode(value)
+        separator = ','
+    yield '{}' if separator == '{' else '}'
+
+
+def json_response(items, **kwargs):
+    return StreamingHttpResponse(json_object(items), content_type='application/json', **kwargs)
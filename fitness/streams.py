@@ -0,0 +1,317 @@
+import base64
+import datetime
+import functools
+import math
+import re
+import struct
+import zlib
+from collections import OrderedDict
+
+import dateutil.parser
+import numpy
+
+FORMAT_VERSION = 1
+BINARY_VERSION = 2
+BINARY_MAGIC = b'PS'
+# Scales tried, in order, to store a column as whole numbers.
+SCALES = (1, 10, 100, 1000, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7)
+# Column index, encoding, integer width, scale, mask size and value size.
+BINARY_COLUMN = struct.Struct('<BBBdII')
+RAW, DELTA = 0, 1
+
+COLUMNS = OrderedDict((
+    ('time', '<f8'),
+    ('latitude', '<f8'),
+    ('longitude', '<f8'),
+    ('altitude', '<f4'),
+    ('distance', '<f8'),
+    ('speed', '<f4'),
+    ('heart_rate', '<f4'),
+    ('cadence', '<f4'),
+))
+
+TIMESTAMP = re.compile(
+    r'(\d{4})-(\d\d)-(\d\d)[T ](\d\d):(\d\d):(\d\d)(?:\.(\d{1,6})\d{0,6})?(Z|[+-]\d\d:?\d\d)?$'
+)
+
+
+@functools.lru_cache(maxsize=64)
+def parse_zone(zone):
+    if zone is None:
+        return None
+    if zone == 'Z':
+        return datetime.timezone.utc
+    digits = zone[1:].replace(':', '')
+    offset = datetime.timedelta(hours=int(digits[:2]), minutes=int(digits[2:]))
+    return datetime.timezone(-offset if zone[0] == '-' else offset)
+
+
+def parse_time(text):
+    match = TIMESTAMP.match(text)
+    if match is None:
+        return dateutil.parser.parse(text)
+    return matched_time(match)
+
+
+def matched_time(match):
+    year, month, day, hour, minute, second, fraction, zone = match.groups()
+    return datetime.datetime(
+        int(year), int(month), int(day), int(hour), int(minute), int(second),
+        int(fraction.ljust(6, '0')) if fraction else 0, parse_zone(zone),
+    )
+
+
+def decompress(point):
+    if isinstance(point['time'], datetime.datetime):
+        return point
+    expanded = point.copy()
+    expanded['time'] = parse_time(point['time'])
+    return expanded
+
+
+def pack(values, dtype):
+    mask = numpy.isnan(values)
+    packed = numpy.where(mask, 0, values).astype(dtype)
+    nulls = numpy.packbits(~mask) if mask.any() else None
+    return packed, nulls
+
+
+def encode_bytes(data):
+    return base64.b64encode(data.tobytes()).decode('ascii')
+
+
+def decode_bytes(text, dtype):
+    return numpy.frombuffer(base64.b64decode(text), dtype=dtype)
+
+
+def as_integers(packed):
+    """
+    The smallest scale at which ``packed`` round trips through whole
+    numbers, and those numbers, or (None, None).
+    """
+    values = packed.astype(numpy.float64)
+    for scale in SCALES:
+        scaled = numpy.round(values * scale)
+        if len(scaled) and numpy.abs(scaled).max() >= 2 ** 53:
+            break
+        if numpy.array_equal((scaled / scale).astype(packed.dtype), packed):
+            return scale, scaled.astype(numpy.int64)
+    return None, None
+
+
+def zigzag_deltas(integers):
+    deltas = numpy.diff(integers, prepend=0)
+    encoded = ((deltas << 1) ^ (deltas >> 63)).view(numpy.uint64)
+    top = int(encoded.max()) if len(encoded) else 0
+    for dtype in (numpy.uint8, numpy.uint16, numpy.uint32):
+        if top <= numpy.iinfo(dtype).max:
+            return encoded.astype(dtype)
+    return encoded
+
+
+def undo_zigzag_deltas(encoded):
+    encoded = encoded.astype(numpy.uint64)
+    deltas = (encoded >> numpy.uint64(1)).view(numpy.int64) ^ -(encoded & numpy.uint64(1)).view(numpy.int64)
+    return numpy.cumsum(deltas)
+
+
+def shuffle(packed):
+    # Grouping the nth byte of every value together helps zlib with floats.
+    return packed.view(numpy.uint8).reshape(-1, packed.itemsize).T.tobytes()
+
+
+def unshuffle(data, dtype):
+    size = numpy.dtype(dtype).itemsize
+    return numpy.frombuffer(data, numpy.uint8).reshape(size, -1).T.copy().view(dtype).ravel()
+
+
+class PointStream(object):
+    """
+    Column oriented view of the points recorded during an activity.
+
+    ``time`` holds offsets in seconds from ``start``, every other column is
+    a float array where missing readings are NaN.
+    """
+    def __init__(self, start, columns):
+        self.start = start
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns['time'])
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    @classmethod
+    def empty(cls):
+        return cls(None, OrderedDict([('time', numpy.zeros(0))]))
+
+    @classmethod
+    def from_points(cls, points):
+        points = sorted((decompress(a) for a in points), key=lambda h: h['time'])
+        if not points:
+            return cls.empty()
+        start = points[0]['time']
+        columns = OrderedDict()
+        columns['time'] = numpy.array(
+            [(a['time'] - start).total_seconds() for a in points], dtype=numpy.float64
+        )
+        for name in COLUMNS:
+            if name == 'time' or not any(name in a for a in points):
+                continue
+            columns[name] = numpy.array(
+                [numpy.nan if a.get(name) is None else a[name] for a in points], dtype=numpy.float64
+            )
+        return cls(start, columns)
+
+    @classmethod
+    def decode(cls, data):
+        if isinstance(data, (bytes, memoryview)):
+            return cls.from_bytes(bytes(data))
+        if not data:
+            return cls.empty()
+        if data.get('version') != FORMAT_VERSION:
+            return cls.from_points(data.values())
+        length = data['length']
+        nulls = data.get('nulls', {})
+        columns = OrderedDict()
+        for name, encoded in data['columns'].items():
+            values = decode_bytes(encoded, COLUMNS[name]).astype(numpy.float64)
+            if name in nulls:
+                present = numpy.unpackbits(decode_bytes(nulls[name], numpy.uint8))[:length]
+                values[present == 0] = numpy.nan
+            columns[name] = values
+        return cls(parse_time(data['start']), columns)
+
+    def encode(self):
+        if not len(self):
+            return None
+        columns = {}
+        nulls = {}
+        for name, values in self.columns.items():
+            packed, mask = pack(values, COLUMNS[name])
+            columns[name] = encode_bytes(packed)
+            if mask is not None:
+                nulls[name] = encode_bytes(mask)
+        encoded = {
+            'version': FORMAT_VERSION,
+            'start': self.start.isoformat(),
+            'length': len(self),
+            'columns': columns,
+        }
+        if nulls:
+            encoded['nulls'] = nulls
+        return encoded
+
+    def to_bytes(self):
+        """
+        Compact binary form of the stream.  Columns holding whole numbers at
+        some decimal scale, such as times, coordinates and heart rates, are
+        stored as zigzag encoded deltas in the narrowest integer type, other
+        columns as byte shuffled floats, and the whole is zlib compressed.
+        Decoding gives the same values as the JSON form.
+        """
+        if not len(self):
+            return None
+        names = list(COLUMNS)
+        start = self.start.isoformat().encode('ascii')
+        body = [struct.pack('<IB', len(self), len(start)), start, struct.pack('<B', len(self.columns))]
+        for name, values in self.columns.items():
+            packed, mask = pack(values, COLUMNS[name])
+            mask = b'' if mask is None else mask.tobytes()
+            scale, integers = as_integers(packed)
+            if scale is None:
+                encoding, width, scale, data = RAW, 0, 0.0, shuffle(packed)
+            else:
+                deltas = zigzag_deltas(integers)
+                encoding, width, data = DELTA, deltas.itemsize, deltas.tobytes()
+            body.append(BINARY_COLUMN.pack(names.index(name), encoding, width, scale, len(mask), len(data)))
+            body.extend((mask, data))
+        return BINARY_MAGIC + bytes([BINARY_VERSION]) + zlib.compress(b''.join(body))
+
+    @classmethod
+    def from_bytes(cls, data):
+        if data[:2] != BINARY_MAGIC or data[2] != BINARY_VERSION:
+            raise ValueError('Not a binary point stream')
+        body = zlib.decompress(data[3:])
+        length, size = struct.unpack_from('<IB', body)
+        offset = 5
+        start = parse_time(body[offset:offset + size].decode('ascii'))
+        count = body[offset + size]
+        offset += size + 1
+        names = list(COLUMNS)
+        columns = OrderedDict()
+        for unused in range(count):
+            index, encoding, width, scale, mask_size, data_size = BINARY_COLUMN.unpack_from(body, offset)
+            offset += BINARY_COLUMN.size
+            mask = body[offset:offset + mask_size]
+            offset += mask_size
+            data = body[offset:offset + data_size]
+            offset += data_size
+            dtype = COLUMNS[names[index]]
+            if encoding == DELTA:
+                integers = undo_zigzag_deltas(numpy.frombuffer(data, '<u{}'.format(width)))
+                values = (integers / scale).astype(dtype).astype(numpy.float64)
+            else:
+                values = unshuffle(data, dtype).astype(numpy.float64)
+            if mask:
+                present = numpy.unpackbits(numpy.frombuffer(mask, numpy.uint8))[:length]
+                values[present == 0] = numpy.nan
+            columns[names[index]] = values
+        return cls(start, columns)
+
+    def column(self, name):
+        if name in self.columns:
+            return self.columns[name]
+        return numpy.full(len(self), numpy.nan)
+
+    def valid(self, name):
+        return ~numpy.isnan(self.column(name))
+
+    def nonzero(self, name):
+        return numpy.nan_to_num(self.column(name)) != 0
+
+    def time(self, index):
+        return self.start + datetime.timedelta(seconds=float(self.columns['time'][index]))
+
+    def times(self):
+        return [
+            self.start + datetime.timedelta(seconds=a) for a in self.columns['time'].tolist()
+        ]
+
+    def bucket_means(self, ends):
+        """
+        Means of every column but time over buckets of points, each ending
+        at one of the increasing indices ``ends`` and starting after the
+        previous one, with missing readings counted as zero.
+        """
+        starts = numpy.empty(len(ends), dtype=numpy.intp)
+        starts[0] = 0
+        starts[1:] = ends[:-1] + 1
+        counts = ends + 1 - starts
+        buffer = numpy.empty(ends[-1] + 1)
+        means = {}
+        for name, values in self.columns.items():
+            if name != 'time':
+                numpy.copyto(buffer, values[:len(buffer)])
+                buffer[numpy.isnan(buffer)] = 0
+                means[name] = numpy.add.reduceat(buffer, starts) / counts
+        return means
+
+    def points(self, first=0, last=None):
+        names = [a for a in self.columns if a != 'time']
+        times = [
+            self.start + datetime.timedelta(seconds=a) for a in self.columns['time'][first:last].tolist()
+        ]
+        rows = zip(*(self.columns[a][first:last].tolist() for a in names)) if names else [()] * len(times)
+        return [
+            dict(
+                [('time', time)] + [(a, None if math.isnan(b) else b) for a, b in zip(names, row)]
+            )
+            for time, row in zip(times, rows)
+        ]
+
+    def legacy(self):
+        return {
+            a['time'].isoformat(): a for a in self.points()
+        }
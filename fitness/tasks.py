@@ -0,0 +1,69 @@
+import logging
+import queue
+import threading
+
+from django.db import connections
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class TaskQueue(object):
+    """
+    In-process background worker.
+
+    Tasks run one at a time on a daemon thread in the order they were
+    queued.  A task whose key is already waiting in the queue is dropped,
+    so bursts of identical requests collapse into a single run.  Functions
+    may be given as dotted paths, which are imported when the task runs.
+    """
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.pending = set()
+        self.running = None
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def enqueue(self, key, function, *args):
+        with self.lock:
+            if key in self.pending:
+                return False
+            self.pending.add(key)
+            self.queue.put((key, function, args))
+            self.start()
+        return True
+
+    def queued(self, key):
+        """
+        Whether a task with ``key`` is waiting or running in this process.
+        """
+        with self.lock:
+            return key in self.pending or key == self.running
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self.work, daemon=True)
+            self.thread.start()
+
+    def work(self):
+        while True:
+            self.run_next()
+
+    def run_next(self):
+        key, function, args = self.queue.get()
+        with self.lock:
+            self.pending.discard(key)
+            self.running = key
+        try:
+            if isinstance(function, str):
+                function = import_string(function)
+            function(*args)
+        except Exception:
+            logger.exception('Background task %s failed', key)
+        finally:
+            self.running = None
+            connections.close_all()
+            self.queue.task_done()
+
+
+TASKS = TaskQueue()
@@ -0,0 +1,37 @@
+import numpy
+
+GENDER_EXPONENTS = {
+    'M': 1.92,
+    'F': 1.67,
+}
+
+
+def trimp_intervals(times, heart_rates, minimum_heart_rate, maximum_heart_rate, gender):
+    """
+    TRIMP accumulated over each interval of a stream.
+
+    ``times`` are seconds and ``heart_rates`` beats per minute, missing or
+    zero readings are skipped.  Element ``i`` of the result holds the
+    impulse between the previous heart rate reading and point ``i``, so the
+    array lines up with the stream and sums to the activity total.
+    """
+    times = numpy.asarray(times, dtype=numpy.float64)
+    heart_rates = numpy.nan_to_num(numpy.asarray(heart_rates, dtype=numpy.float64))
+    beating = numpy.flatnonzero(heart_rates)
+    intervals = numpy.zeros(len(times))
+    if len(beating) < 2:
+        return intervals
+    minutes = numpy.diff(times[beating]) / 60.0
+    average_heart_rate = (heart_rates[beating[1:]] + heart_rates[beating[:-1]]) / 2
+    reserve = numpy.maximum(
+        (average_heart_rate - minimum_heart_rate) / (maximum_heart_rate - minimum_heart_rate), 0
+    )
+    exponent = GENDER_EXPONENTS.get(gender, GENDER_EXPONENTS['F'])
+    intervals[beating[1:]] = minutes * reserve * 0.64 * numpy.exp(exponent * reserve)
+    return intervals
+
+
+def calculate_trimp(times, heart_rates, minimum_heart_rate, maximum_heart_rate, gender):
+    return float(
+        trimp_intervals(times, heart_rates, minimum_heart_rate, maximum_heart_rate, gender).sum()
+    )
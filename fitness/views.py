@@ -5,6 +5,8 @@ from django.shortcuts import render
 from django.views import View
 from django.views.generic import TemplateView
 from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
 
 from . import forms
 from . import models
@@ -28,6 +30,23 @@ class ActivityDetail(UserActivityMixin, DetailView):
 
 class ActivitySVG(UserActivityMixin, DetailView):
     template_name = 'fitness/activity.svg'
+    content_type = 'image/svg+xml'
+    max_age = 7 * 24 * 60 * 60
+
+    def get_queryset(self):
+        return super(ActivitySVG, self).get_queryset().only('id', 'owner', 'stream_updated', 'thumbnail')
+
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        etag = quote_etag('{}-{}'.format(self.object.pk, self.object.stream_updated.timestamp()))
+        last_modified = int(self.object.stream_updated.timestamp())
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = self.render_to_response(self.get_context_data(object=self.object))
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, private=True, max_age=self.max_age)
+        return response
 
 
 class UploadView(LoginRequiredMixin, TemplateView):
@@ -53,7 +72,9 @@ class ControlPanelView(LoginRequiredMixin, View):
         })
         heart_form = forms.HeartRateForm(initial={
             'minimum_heart_rate': self.request.user.profile.minimum_heart_rate,
-            'maximum_heart_rate': self.request.user.profile.maximum_heart_rate
+            'maximum_heart_rate': self.request.user.profile.maximum_heart_rate,
+            'fitness_days': self.request.user.profile.fitness_days,
+            'fatigue_days': self.request.user.profile.fatigue_days,
         })
         return render(request, self.template_name, {
             'user_form': user_form,
@@ -81,9 +102,9 @@ class ControlPanelView(LoginRequiredMixin, View):
 class RecalculateTRIMPView(LoginRequiredMixin, View):
     def get(self, request, *args, **kwargs):
         id = kwargs['pk']
-        activity = models.Activity.objects.filter(owner=request.user, id=id).first()
+        activity = models.Activity.objects.with_stream().filter(owner=request.user, id=id).first()
         if activity:
-            activity.trimp = activity.calculate_trimp()
+            activity.update_trimp()
             activity.save()
         return HttpResponse('Done')
 
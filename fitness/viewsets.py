@@ -1,30 +1,160 @@
-from rest_framework import viewsets
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.mixins import RetrieveModelMixin, ListModelMixin, CreateModelMixin
 
+from . import jobs
 from . import serializers
 from . import models
+from . import renderers
+from . import streaming
 
 
 class ActivityViewSet(
     RetrieveModelMixin, ListModelMixin, CreateModelMixin, viewsets.GenericViewSet
 ):
+    renderer_classes = list(api_settings.DEFAULT_RENDERER_CLASSES) + [renderers.ColumnarRenderer]
+
     def get_queryset(self):
-        return models.Activity.objects.filter(owner=self.request.user)
+        activities = models.Activity.objects.filter(owner=self.request.user)
+        if self.action == 'export':
+            return activities.with_stream()
+        if self.action == 'samples':
+            return activities.with_pyramid()
+        return activities
 
     def get_serializer_class(self):
         return {
             'retrieve': serializers.ActivityDetailSerializer,
-            'create': serializers.RunSerializer
+            'create': serializers.RunSerializer,
+            'recalculate_trimp': serializers.TrimpRecalculationSerializer,
         }.get(self.action) or serializers.ActivityListSerializer
 
+    def retrieve(self, request, *args, **kwargs):
+        # The stream stays deferred until the conditional headers are checked.
+        activity = self.get_object()
+        columnar = request.accepted_renderer.format == renderers.ColumnarRenderer.format
+        streamed = not columnar and request.query_params.get('stream', '').lower() in ('1', 'true')
+        etag = quote_etag('{}-{}-{}-{}'.format(
+            activity.pk, activity.updated.timestamp(), models.GEO_JSON_VERSION,
+            'stream' if streamed else request.accepted_renderer.format
+        ))
+        last_modified = int(activity.updated.timestamp())
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None and not columnar:
+            activity.load_stream()
+        if response is None and columnar:
+            # The track columns are cached, and load the stream only to be built.
+            response = Response(self.columnar_detail(activity))
+        elif response is None and streamed:
+            response = self.streamed_detail(activity)
+        elif response is None:
+            response = Response(self.get_serializer(activity).data)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def detail_fields(self, activity):
+        """
+        The detail serializer's representation without the fields built
+        from the stream, which are returned as names.
+        """
+        serializer = self.get_serializer(activity)
+        names = serializer.Meta.streamed_fields
+        for name in names:
+            serializer.fields.pop(name)
+        return serializer.data, names
+
+    def columnar_detail(self, activity):
+        """
+        The detail fields with the map track as columns in place of the
+        GeoJSON features and SVG points.
+        """
+        data, unused = self.detail_fields(activity)
+        return dict(data, track=activity.track_columns())
+
+    def streamed_detail(self, activity):
+        """
+        The detail JSON as a streamed response.  The small fields are written
+        first and the large ones an item at a time after them.
+        """
+        data, names = self.detail_fields(activity)
+        return streaming.json_response(
+            list(data.items()) + [(a, streaming.deferred(getattr(activity, a))) for a in names]
+        )
+
+    @action(detail=True, methods=['get'])
+    def export(self, request, pk=None):
+        activity = self.get_object()
+        fields = serializers.RunSerializer().fields
+        stream = activity.points()
+        if request.accepted_renderer.format == renderers.ColumnarRenderer.format:
+            return Response({
+                'name': activity.name,
+                'time': fields['time'].to_representation(stream.start),
+                'columns': stream.columns,
+            })
+        return streaming.json_response([
+            ('name', activity.name),
+            ('time', fields['time'].to_representation(activity.time)),
+            ('points', fields['points'].iter_representation(stream)),
+        ])
+
+    @action(detail=True, methods=['get'])
+    def samples(self, request, pk=None):
+        query = serializers.SamplesQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        activity = self.get_object()
+        return Response(activity.samples(
+            query.validated_data.get('from'), query.validated_data.get('to'), query.validated_data['max_points']
+        ))
+
+    @action(detail=False, methods=['get', 'post'])
+    def recalculate_trimp(self, request):
+        if request.method == 'POST':
+            job = jobs.start_recalculation(request.user)
+        else:
+            job = models.TrimpRecalculation.objects.filter(owner=request.user).first()
+            if job is None:
+                return Response(status=status.HTTP_404_NOT_FOUND)
+        return Response(self.get_serializer(job).data)
+
+    @action(detail=False, methods=['post'], parser_classes=[MultiPartParser])
+    def upload(self, request):
+        uploads = [a for name in request.FILES for a in request.FILES.getlist(name)]
+        if not uploads:
+            return Response({'detail': 'No files were uploaded.'}, status=status.HTTP_400_BAD_REQUEST)
+        results = jobs.import_uploads(request.user, uploads)
+        saved = any(a['activities'] for a in results)
+        return Response(
+            {'files': results}, status=status.HTTP_201_CREATED if saved else status.HTTP_400_BAD_REQUEST
+        )
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        if not isinstance(request.data, list):
+            return Response(
+                {'detail': 'Expected a list of activities.'}, status=status.HTTP_400_BAD_REQUEST
+            )
+        results = jobs.create_activities(request.user, request.data)
+        created = any(a['status'] == 'created' for a in results)
+        return Response(
+            {'activities': results}, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
+        )
+
 
 class TrimpViewSet(viewsets.ViewSet):
     queryset = models.Activity.objects.all()
 
     def list(self, request):
+        query = serializers.TrimpQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
         serializer = serializers.TrimpSerializer(
-            models.TrainingStressBalance.history_for_user(self.request.user),
+            models.TrainingStressBalance.history_for_user(self.request.user, **query.validated_data),
             many=True, context={'request': request}
         )
         return Response(serializer.data)
\ No newline at end of file
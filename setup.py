@@ -75,6 +75,7 @@ setup(
         'django',
         'django-bootstrap3',
         'djangorestframework',
+        'numpy',
         'python-dateutil',
         'timezonefinder',
     ],
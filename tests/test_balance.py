@@ -0,0 +1,51 @@
+import math
+
+import numpy
+
+from fitness import balance
+
+
+def reference_balance(trimp, fitness_days, fatigue_days, seed=None):
+    fitness, fatigue = [], []
+    last = seed
+    for value in trimp:
+        if last is None:
+            last = (0.0, 0.0)
+        else:
+            last = (
+                last[0] + (value - last[0]) * (1.0 - math.exp(-1.0 / fitness_days)),
+                last[1] + (value - last[1]) * (1.0 - math.exp(-1.0 / fatigue_days)),
+            )
+        fitness.append(last[0])
+        fatigue.append(last[1])
+    return fitness, fatigue
+
+
+def test_seeded_day():
+    fitness, fatigue, form = balance.training_stress_balance([120], seed=(20, 30))
+    assert round(fitness[0], 4) == 22.3528
+    assert round(fatigue[0], 4) == 41.981
+    assert round(form[0], 4) == -19.6282
+
+
+def test_first_day_starts_at_zero():
+    fitness, fatigue, form = balance.training_stress_balance([100, 0, 50])
+    assert fitness[0] == fatigue[0] == form[0] == 0
+    assert round(fitness[2], 3) == 1.176
+
+
+def test_matches_daily_recurrence():
+    trimp = numpy.random.RandomState(3).gamma(2, 40, size=3653)
+    trimp[::3] = 0
+    for days, seed in (((42, 7), None), ((42, 7), (45.5, 80.25)), ((60, 3), None), ((1, 1), (1, 2))):
+        fitness, fatigue, form = balance.training_stress_balance(trimp, *days, seed=seed)
+        expected_fitness, expected_fatigue = reference_balance(trimp, *days, seed=seed)
+        assert numpy.allclose(fitness, expected_fitness, rtol=1e-10, atol=1e-9)
+        assert numpy.allclose(fatigue, expected_fatigue, rtol=1e-10, atol=1e-9)
+        assert numpy.allclose(form, fitness - fatigue)
+
+
+def test_empty():
+    fitness, fatigue, form = balance.training_stress_balance([])
+    assert len(fitness) == len(fatigue) == len(form) == 0
+    assert len(balance.exponential_average([], 42, 10)) == 0
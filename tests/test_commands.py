@@ -0,0 +1,34 @@
+import io
+
+from django.core.management import call_command
+
+import fitness.models as models
+
+from test_parsers import tcx_activity, tcx_file, tcx_point
+
+
+def test_read_tcx_directory(mocker, tmpdir):
+    tmpdir.mkdir('2017').join('a.TCX').write_binary(tcx_file(
+        tcx_activity([tcx_point(0), tcx_point(1)]),
+        tcx_activity([tcx_point(0)], start='2017-04-04T07:30:00Z', notes='Long ' * 40),
+    ).getvalue())
+    tmpdir.join('b.tcx').write('<TrainingCenterDatabase>')
+    tmpdir.join('notes.txt').write('not an activity')
+    user = mocker.patch.object(models.User.objects, 'get').return_value
+    store = mocker.patch.object(models.Activity.objects, 'store', side_effect=[
+        (mocker.Mock(), True), (mocker.Mock(), None)
+    ])
+    stdout, stderr = io.StringIO(), io.StringIO()
+    call_command('read_tcx', str(tmpdir), '--user=runner', stdout=stdout, stderr=stderr)
+    assert store.call_count == 2
+    owner, time, defaults, summaries = store.call_args_list[0][0]
+    assert owner is user
+    assert time.day == 3
+    assert 'distance' not in defaults
+    assert summaries()['data_points'] == 2
+    assert summaries()['distance'] == 3.0
+    assert len(store.call_args_list[1][0][2]['name']) == models.Activity._meta.get_field('name').max_length
+    assert 'Added' in stdout.getvalue()
+    assert 'Unchanged' in stdout.getvalue()
+    assert 'b.tcx' in stderr.getvalue()
+    assert 'Read 2 files, 1 failed' in stdout.getvalue()
@@ -0,0 +1,285 @@
+import datetime
+import gzip
+import io
+
+from django.utils import timezone
+
+import fitness.jobs as jobs
+import fitness.models as models
+from fitness.streams import PointStream
+
+from factories import UserFactory
+
+
+def heart_rate_stream(*heart_rates):
+    start = datetime.datetime(2017, 4, 3, 7, 30, tzinfo=datetime.timezone.utc)
+    return PointStream.from_points([
+        {'time': start + datetime.timedelta(minutes=i), 'heart_rate': a} for i, a in enumerate(heart_rates)
+    ]).encode()
+
+
+def test_chunks():
+    assert list(jobs.chunks(range(0, 7), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(jobs.chunks([], 3)) == []
+
+
+def test_trimp_task():
+    assert jobs.trimp_task((4, heart_rate_stream(190, 190, 190), 60, 190, 'M')) == (4, 8)
+    assert jobs.trimp_task((5, heart_rate_stream(50, 50), 60, 190, 'M')) == (5, None)
+    assert jobs.trimp_task((6, None, 60, 190, 'M')) == (6, None)
+
+
+def test_update_trimp(mocker):
+    queryset = mocker.patch.object(models.Activity, 'objects')
+    jobs.update_trimp({})
+    assert queryset.filter.call_count == 0
+    jobs.update_trimp({1: 10, 2: None})
+    queryset.filter.assert_called_once_with(pk__in=[1, 2])
+    case = queryset.filter.return_value.update.call_args[1]['trimp']
+    assert len(case.cases) == 2
+
+
+def test_recalculate_trimp(mocker):
+    user = UserFactory.build()
+    objects = mocker.patch.object(models.Activity, 'objects')
+    activities = objects.filter.return_value
+    activities.count.return_value = 3
+    activities.values_list.return_value.iterator.return_value = iter([
+        (1, heart_rate_stream(190, 190), None),
+        (3, None, memoryview(PointStream.decode(heart_rate_stream(190, 190, 190)).to_bytes())),
+        (4, None, None),
+    ])
+    mocker.patch.object(models.Profile.objects, 'get', return_value=user.profile)
+    update = mocker.patch.object(jobs, 'update_trimp')
+    refresh = mocker.patch.object(models.TrainingStressBalance, 'refresh')
+    progress = mocker.Mock()
+    assert jobs.recalculate_trimp(user, chunk_size=2, progress=progress) == 3
+    refresh.assert_called_once_with(user)
+    objects.filter.assert_called_once_with(owner=user)
+    activities.values_list.assert_called_once_with('id', 'stream', 'stream_data')
+    update.assert_any_call({1: 4, 3: 8})
+    update.assert_any_call({4: None})
+    assert [a[0] for a in progress.call_args_list] == [(0, 3), (2, 3), (3, 3)]
+
+
+def test_recalculate_dirty_trimp(mocker):
+    user = UserFactory.build()
+    objects = mocker.patch.object(models.Activity, 'objects')
+    dirty = objects.filter.return_value.filter.return_value
+    dirty.count.return_value = 2
+    dirty.values_list.return_value.iterator.return_value = iter([
+        (1, heart_rate_stream(190, 190), None),
+        (2, heart_rate_stream(190, 190, 190), None),
+    ])
+    changed = UserFactory.build().profile
+    changed.gender = 'F'
+    mocker.patch.object(models.Profile.objects, 'get', side_effect=[user.profile, changed])
+    update = mocker.patch.object(jobs, 'update_trimp')
+    mocker.patch.object(models.TrainingStressBalance, 'refresh')
+    assert jobs.recalculate_trimp(user, chunk_size=1, only_dirty=True) == 1
+    objects.filter.return_value.filter.assert_called_once_with(trimp_dirty=True)
+    update.assert_called_once_with({1: 4})
+
+
+def test_recalculation_active():
+    job = models.TrimpRecalculation(created=timezone.now())
+    assert job.active()
+    job.status = models.TrimpRecalculation.DONE
+    assert not job.active()
+    job = models.TrimpRecalculation(created=timezone.now() - datetime.timedelta(hours=2))
+    assert not job.active()
+
+
+def test_start_recalculation(mocker):
+    user = UserFactory.build()
+    job = models.TrimpRecalculation(pk=3, created=timezone.now())
+    objects = mocker.patch.object(models.TrimpRecalculation, 'objects')
+    objects.filter.return_value.first.return_value = job
+    queued = mocker.patch.object(jobs.TASKS, 'queued', return_value=False)
+    enqueue = mocker.patch.object(jobs.TASKS, 'enqueue')
+    mocker.patch.object(jobs.transaction, 'on_commit', side_effect=lambda h: h())
+    # Recently queued, perhaps by another process.
+    assert jobs.start_recalculation(user) is job
+    job.created -= datetime.timedelta(minutes=5)
+    queued.return_value = True
+    assert jobs.start_recalculation(user) is job
+    queued.assert_called_once_with(('recalculation', 3))
+    # Running, in this process or another, even before any progress.
+    job.status = models.TrimpRecalculation.RUNNING
+    queued.return_value = False
+    assert jobs.start_recalculation(user) is job
+    assert objects.create.call_count == 0
+    # Pending and lost from the queue.
+    job.status = models.TrimpRecalculation.PENDING
+    objects.filter.return_value.update.return_value = 1
+    assert jobs.start_recalculation(user) is objects.create.return_value
+    objects.filter.assert_any_call(pk=3, status=models.TrimpRecalculation.PENDING)
+    assert objects.filter.return_value.update.call_args[1]['status'] == models.TrimpRecalculation.FAILED
+    assert enqueue.call_args[0][0] == ('recalculation', objects.create.return_value.pk)
+    # Started elsewhere just before it could be failed.
+    objects.create.reset_mock()
+    objects.filter.return_value.update.return_value = 0
+    assert jobs.start_recalculation(user) is job
+    assert objects.create.call_count == 0
+
+
+def test_refresh_balance(mocker):
+    objects = mocker.patch.object(jobs.User, 'objects')
+    refresh = mocker.patch.object(models.TrainingStressBalance, 'refresh')
+    jobs.refresh_balance(4)
+    objects.get.assert_called_once_with(pk=4)
+    refresh.assert_called_once_with(objects.get.return_value)
+
+
+def test_backfill_timezones(mocker):
+    objects = mocker.patch.object(models.Activity, 'objects')
+    missing = objects.filter.return_value
+    missing.count.return_value = 3
+    start = datetime.datetime(2017, 4, 3, 7, 30, tzinfo=datetime.timezone.utc)
+    missing.values_list.return_value.iterator.return_value = iter([
+        (1, PointStream.from_points([{'time': start, 'latitude': 51.5, 'longitude': -0.12}]).encode(), None),
+        (2, PointStream.from_points([{'time': start, 'distance': 0}]).encode(), None),
+        (3, None, None),
+        (4, None, PointStream.from_points([{'time': start, 'latitude': 51.6, 'longitude': -0.1}]).to_bytes()),
+    ])
+    progress = mocker.Mock()
+    assert jobs.backfill_timezones(chunk_size=3, progress=progress) == 4
+    objects.filter.assert_any_call(timezone_name='')
+    pks = [a[1]['pk__in'] for a in objects.filter.call_args_list[1:]]
+    names = [a[1]['timezone_name'] for a in missing.update.call_args_list]
+    assert sorted(zip(pks, names)) == [([1], 'Europe/London'), ([2], 'UTC'), ([4], 'Europe/London')]
+    assert progress.call_args_list == [mocker.call(3, 3), mocker.call(4, 3)]
+
+
+def test_activity_row():
+    start = datetime.datetime(2017, 4, 3, 7, 30, tzinfo=datetime.timezone.utc)
+    row = jobs.activity_row({'name': 'Run', 'time': start, 'points': [
+        {
+            'time': start + datetime.timedelta(minutes=i), 'latitude': 35.7 + i / 1000.0, 'longitude': 139.7,
+            'altitude': 10.0, 'distance': 200.0 * i, 'speed': 3.3, 'heart_rate': 190.0, 'cadence': None,
+        } for i in range(0, 3)
+    ]}, (60, 190, 'M'))
+    assert row['time'] == start
+    assert row['name'] == 'Run'
+    assert row['distance'] == 400.0
+    assert row['duration'] == 120.0
+    assert row['data_points'] == 3
+    assert row['trimp'] == 8
+    assert row['timezone_name'] == 'Asia/Tokyo'
+    assert len(row['thumbnail'].split()) == 2
+    assert row['track_detail']['ends'] == [0, 2]
+    assert len(PointStream.decode(row['stream'])) == 3
+
+
+def test_import_files(mocker):
+    user = UserFactory.build()
+    day = datetime.timedelta(days=1)
+    start = datetime.datetime(2017, 4, 3, tzinfo=datetime.timezone.utc)
+    results = {
+        'a.tcx': ('a.tcx', [{'time': start + day, 'data_points': 10}], None),
+        'b.tcx': ('b.tcx', [], 'syntax error'),
+        'c.tcx': ('c.tcx', [{'time': start + 2 * day, 'data_points': 5}, {'time': start, 'data_points': 2}], None),
+        'd.tcx': ('d.tcx', [{'time': start + 3 * day, 'data_points': 1}], None),
+    }
+    import_task = mocker.patch.object(jobs, 'import_task', side_effect=lambda task: results[task[0]])
+    upsert = mocker.patch.object(models.Activity.objects, 'upsert')
+    refresh = mocker.patch.object(models.TrainingStressBalance, 'refresh')
+    progress = mocker.Mock()
+    counts = jobs.import_files(user, sorted(results), batch_size=2, progress=progress)
+    assert counts == {'files': 4, 'failed': 1, 'activities': 4, 'points': 18}
+    assert import_task.call_args_list[0][0][0] == ('a.tcx', (60, 190, 'M'))
+    assert [len(a[0][1]) for a in upsert.call_args_list] == [3, 1]
+    refresh.assert_called_once_with(user, since=start.date())
+    progress.assert_any_call('b.tcx', 0, 'syntax error')
+
+
+def test_import_task(mocker):
+    mocker.patch.object(jobs.parsers, 'read', side_effect=jobs.parsers.ParseError('broken'))
+    assert jobs.import_task(('a.tcx', (60, 190, 'M'))) == ('a.tcx', [], 'broken')
+
+
+def test_import_uploads(mocker):
+    user = UserFactory.build()
+    start = datetime.datetime(2017, 4, 3, tzinfo=datetime.timezone.utc)
+
+    def read(upload, name):
+        if name == 'broken.fit':
+            raise jobs.parsers.ParseError('Not a FIT file')
+        yield {'name': name, 'time': start}
+
+    mocker.patch.object(jobs.parsers, 'read', side_effect=read)
+    mocker.patch.object(jobs, 'activity_row', side_effect=lambda data, settings: dict(data))
+    upsert = mocker.patch.object(models.Activity.objects, 'upsert', return_value={start: 9})
+    refresh = mocker.patch.object(models.TrainingStressBalance, 'refresh')
+    uploads = []
+    for name, content in (('run.tcx', b'<xml'), ('run.gpx', gzip.compress(b'<gpx')), ('broken.fit', b'')):
+        upload = io.BytesIO(content)
+        upload.name = name
+        uploads.append(upload)
+    assert jobs.import_uploads(user, uploads) == [
+        {'name': 'run.tcx', 'activities': [9], 'error': None},
+        {'name': 'run.gpx', 'activities': [9], 'error': None},
+        {'name': 'broken.fit', 'activities': [], 'error': 'Not a FIT file'},
+    ]
+    assert [a['name'] for a in upsert.call_args[0][1]] == ['run.tcx', 'run.gpx.gz']
+    refresh.assert_called_once_with(user, since=start.date())
+
+
+def test_create_activities(mocker):
+    user = UserFactory.build()
+    activity_row = mocker.patch.object(jobs, 'activity_row', side_effect=lambda data, settings: {
+        'time': data['time'], 'name': data['name']
+    })
+    first, second, third = [datetime.datetime(2017, 4, a, 7) for a in (3, 4, 5)]
+    stored_times = mocker.patch.object(models.Activity.objects, 'stored_times', return_value={third: 1})
+    insert_new = mocker.patch.object(
+        models.Activity.objects, 'insert_new', return_value=({first: 5}, {second: 2})
+    )
+    refresh = mocker.patch.object(models.TrainingStressBalance, 'refresh')
+    point = {
+        'altitude': 1, 'cadence': None, 'distance': 0, 'heart_rate': None,
+        'latitude': 51, 'longitude': -1, 'speed': 0,
+    }
+
+    def run(time, name='Run'):
+        return {'time': time, 'name': name, 'points': [dict(point, time=time)]}
+
+    results = jobs.create_activities(user, [
+        run('2017-04-03T07:00:00'),
+        run('2017-04-04T07:00:00'),
+        run('2017-04-03T07:00:00', 'Again'),
+        {'name': 'Broken'},
+        run('2017-04-05T07:00:00', 'Stored'),
+        {'time': '2017-04-06T07:00:00', 'name': 'Empty', 'points': []},
+    ])
+    assert results[:3] == [
+        {'status': 'created', 'id': 5, 'errors': None},
+        {'status': 'exists', 'id': 2, 'errors': None},
+        {'status': 'duplicate', 'id': 5, 'errors': None},
+    ]
+    assert results[3]['status'] == 'invalid'
+    assert set(results[3]['errors']) == {'time', 'points'}
+    assert results[4] == {'status': 'exists', 'id': 1, 'errors': None}
+    assert results[5] == {'status': 'invalid', 'id': None, 'errors': {'points': ['At least one point is required.']}}
+    stored_times.assert_called_once_with(user, [first, second, third])
+    assert [a['name'] for a in insert_new.call_args[0][1]] == ['Run', 'Run']
+    assert activity_row.call_count == 2
+    refresh.assert_called_once_with(user, since=first.date())
+
+
+def test_convert_streams(mocker):
+    objects = mocker.patch.object(models.Activity, 'objects')
+    mocker.patch.object(jobs.transaction, 'atomic')
+    stored = objects.filter.return_value.exclude.return_value
+    stored.count.return_value = 1
+    stream = PointStream.decode(heart_rate_stream(150, 160))
+    stored.values_list.return_value.iterator.return_value = iter([(3, stream.encode(), None)])
+    progress = mocker.Mock()
+    assert jobs.convert_streams(binary=True, progress=progress) == 1
+    objects.filter.assert_any_call(stream_data__isnull=True)
+    objects.filter.return_value.exclude.assert_called_once_with(stream__isnull=True)
+    objects.filter.assert_called_with(pk=3)
+    objects.filter.return_value.update.assert_called_once_with(
+        stream=None, stream_data=stream.to_bytes(), fingerprint=models.stream_fingerprint(stream.to_bytes())
+    )
+    progress.assert_called_once_with(1, 1)
@@ -1,9 +1,15 @@
 import datetime
+import math
+import tracemalloc
+
+import numpy
 
 import pytest
+from django.core.cache.backends.locmem import LocMemCache
 from django_mock_queries.query import MockSet, MockModel
 
 import fitness.models as models
+from fitness.streams import PointStream
 
 from factories import UserFactory, ProfileFactory, ActivityFactory
 
@@ -83,13 +89,45 @@ def test_activity_timezone_finder():
         time=datetime.datetime(2015, 4, 3, 7, 5, tzinfo=datetime.timezone.utc)
     )
     activity.stream = {
-        'data': {'latitude': 39.7, 'longitude': -105},
+        'data': {'time': '2015-04-03T07:05:00+00:00', 'latitude': 39.7, 'longitude': -105},
     }
     assert activity.local_time() == '03 April 2015 at 01:05'
+    assert activity.timezone_name == 'America/Denver'
+    activity.timezone_name = ''
     activity.stream = {
-        'data': {'latitude': 0.0, 'longitude': 0.0},
+        'data': {'time': '2015-04-03T07:05:00+00:00', 'latitude': 0.0, 'longitude': 0.0},
     }
     assert activity.local_time() == '03 April 2015 at 07:05'
+    activity.timezone_name = ''
+    activity.stream = {'data': {'time': '2015-04-03T07:05:00+00:00', 'distance': 0.0}}
+    assert activity.local_time() == '03 April 2015 at 07:05'
+    assert activity.timezone_name == 'UTC'
+    activity.timezone_name = ''
+    activity.stream = None
+    assert activity.local_time() is None
+
+
+def test_activity_stored_timezone(mocker):
+    objects = mocker.patch.object(models.Activity, 'objects')
+    activity = ActivityFactory.build(
+        id=5, time=datetime.datetime(2015, 4, 3, 7, 5, tzinfo=datetime.timezone.utc), timezone_name='Asia/Tokyo'
+    )
+    points = mocker.patch.object(activity, 'points')
+    assert activity.local_time() == '03 April 2015 at 16:05'
+    assert points.call_count == 0
+    activity.timezone_name = ''
+    points.return_value = PointStream.from_points([{'time': activity.time, 'latitude': 35.7, 'longitude': 139.7}])
+    assert activity.local_time() == '03 April 2015 at 16:05'
+    objects.filter.return_value.update.assert_called_once_with(timezone_name='Asia/Tokyo')
+
+
+def test_timezone_lookup_cached(mocker):
+    models.cached_timezone_at.cache_clear()
+    # Newer TimezoneFinder uses __slots__, so wrap the finder rather than spy on its method.
+    finder = mocker.patch.object(models, 'TIMEZONE_FINDER', mocker.Mock(wraps=models.TIMEZONE_FINDER))
+    assert models.timezone_at(51.501, -0.121) == 'Europe/London'
+    assert models.timezone_at(51.502, -0.1209) == 'Europe/London'
+    assert finder.timezone_at.call_count == 1
 
 
 def test_points_with_heart_rate(mocker):
@@ -105,48 +143,24 @@ def test_points_with_heart_rate(mocker):
     ]
 
 
-def test_delta_trimp(mocker):
+def test_calculate_trimp():
     activity = ActivityFactory.build()
-    mocker.patch.object(activity.owner.profile, 'percent_of_heart_rate_reserve', return_value=0.5)
     activity.owner.profile.gender = 'M'
-    assert round(activity.delta_trimp(
-        datetime.datetime(2017, 4, 3, 7, 33, 0),
-        datetime.datetime(2017, 4, 3, 7, 30, 0),
-        120,
-        130,
-    ), 3) == 2.507
-
-
-def test_calculate_trimp(mocker):
-    activity = ActivityFactory.build()
-    points = mocker.patch.object(activity, 'points_with_heart_rate', return_value=[])
-    delta = mocker.patch.object(activity, 'delta_trimp', return_value=2)
     assert activity.calculate_trimp() is None
-    assert delta.call_count == 0
-    now = datetime.datetime.now()
-    hr_points = [
+    now = datetime.datetime(2017, 4, 3, 7, 30, 0)
+    activity.stream = PointStream.from_points([
         {'time': timedelta(now, 0), 'heart_rate': 130},
-        {'time': timedelta(now, 10), 'heart_rate': 130},
-        {'time': timedelta(now, 20), 'heart_rate': 130},
-        {'time': timedelta(now, 30), 'heart_rate': 130},
-    ]
-    points.return_value = hr_points
-    assert activity.calculate_trimp() == 6
-    assert delta.call_count == 3
-    delta.assert_any_call(
-        hr_points[2]['time'], hr_points[1]['time'], hr_points[2]['heart_rate'], hr_points[1]['heart_rate']
-    )
-
-
-def test_decompress():
-    good = {
-        'time': datetime.datetime(2017, 5, 4, 3, 2, 1)
-    }
-    bad = {
-        'time': '2017-05-04T03:02:01'
-    }
-    assert models.Activity.decompress(good) == good
-    assert models.Activity.decompress(bad) == good
+        {'time': timedelta(now, 180), 'heart_rate': 120},
+        {'time': timedelta(now, 190), 'heart_rate': None},
+        {'time': timedelta(now, 200), 'heart_rate': 0},
+    ]).encode()
+    assert round(activity.calculate_trimp(), 3) == 2.507
+    assert [round(a, 3) for a in activity.trimp_intervals()] == [0, 2.507, 0, 0]
+    activity.stream = PointStream.from_points([
+        {'time': timedelta(now, 0), 'heart_rate': 50},
+        {'time': timedelta(now, 180), 'heart_rate': 50},
+    ]).encode()
+    assert activity.calculate_trimp() is None
 
 
 def test_point_stream():
@@ -174,24 +188,24 @@ def test_point_stream():
     ]
 
 
-def test_track(mocker):
+def test_track():
     activity = ActivityFactory.build()
-    stream_data = [
+    now = datetime.datetime(2017, 4, 3, 7, 30, 0)
+    activity.stream = PointStream.from_points([
         {
+            'time': timedelta(now, 2),
+            'latitude': 20,
+            'longitude': 25,
+        }, {
+            'time': timedelta(now, 0),
             'latitude': 40,
             'longitude': 45,
-            'something': 'Else',
         }, {
+            'time': timedelta(now, 1),
             'latitude': 30,
             'longitude': 35,
-            'something': 'Else',
-        }, {
-            'latitude': 20,
-            'longitude': 25,
-            'something': 'Else',
         }
-    ]
-    mocker.patch.object(activity, 'point_stream', return_value=stream_data)
+    ]).encode()
     assert activity.track() == [(40, 45), (30, 35), (20, 25)]
 
 
@@ -205,12 +219,88 @@ def test_adjusted_track(mocker):
     assert [round(a[1], 4) for a in adjusted] == [34.472, 26.8116, 19.1511]
 
 
-def test_svg_points(mocker):
+def test_svg_points():
     activity = ActivityFactory.build()
-    track = [(40, 45), (30, 35), (20, 25)]
-    mocker.patch.object(activity, 'adjusted_track', return_value=track)
-    assert activity.svg_points() == [(30.0, 0.0), (15.0, 15.0), (0.0, 30.0)]
-    assert activity.svg_points(height=10, width=40) == [(40.0, 0.0), (20.0, 5.0), (0.0, 10.0)]
+    now = datetime.datetime(2017, 4, 3, 7, 30, 0)
+    activity.stream = PointStream.from_points([
+        {'time': timedelta(now, i), 'latitude': a, 'longitude': b}
+        for i, (a, b) in enumerate([(0, 0), (0, 5), (0, 10), (None, None), (10, 10)])
+    ]).encode()
+    scale = math.cos(math.radians(10))
+    assert [(round(a, 6), b) for a, b in activity.svg_points()] == [
+        (round(15 - 15 * scale, 6), 30.0), (round(15 + 15 * scale, 6), 30.0), (round(15 + 15 * scale, 6), 0.0)
+    ]
+    assert [(round(a, 6), b) for a, b in activity.svg_points(width=40, height=10, max_points=2)] == [
+        (round(20 - 20 * scale, 6), 10.0), (round(20 + 20 * scale, 6), 0.0)
+    ]
+    activity.track_detail = None
+    activity.stream = PointStream.from_points([{'time': now, 'distance': 0}]).encode()
+    assert activity.svg_points() == []
+
+
+def test_build_thumbnail(mocker):
+    activity = ActivityFactory.build()
+    now = datetime.datetime(2017, 4, 3, 7, 30, 0)
+    activity.stream = PointStream.from_points([
+        {'time': timedelta(now, 0), 'latitude': 0, 'longitude': 0},
+        {'time': timedelta(now, 1), 'latitude': None, 'longitude': None},
+        {'time': timedelta(now, 2), 'latitude': 10, 'longitude': 5},
+        {'time': timedelta(now, 3), 'latitude': 0, 'longitude': 10},
+    ]).encode()
+    expected = ' '.join('{:.1f},{:.1f}'.format(*a) for a in activity.svg_points())
+    assert len(expected.split()) == 3
+    assert activity.build_thumbnail() == expected
+    mocker.patch.object(models, 'THUMBNAIL_POINTS', 1)
+    assert activity.build_thumbnail() == '{} {}'.format(expected.split()[0], expected.split()[-1])
+    activity.track_detail = None
+    activity.stream = PointStream.from_points([{'time': now, 'latitude': 1, 'longitude': 2}]).encode()
+    assert activity.build_thumbnail() == '15.0,15.0'
+    activity.track_detail = None
+    activity.stream = None
+    assert activity.build_thumbnail() == ''
+
+
+def test_simplified(mocker):
+    objects = mocker.patch.object(models.Activity, 'objects')
+    activity = ActivityFactory.build(id=3, track_detail=None)
+    detail = {'version': 1, 'ends': [0, 9], 'indices': [4, 7, 2], 'tolerances': [30.0, 10.0, 5.0]}
+    mocker.patch.object(activity, 'build_track_detail', return_value=detail)
+    assert activity.simplified() == [0, 2, 4, 7, 9]
+    objects.filter.return_value.update.assert_called_once_with(track_detail=detail)
+    assert activity.simplified(max_points=4) == [0, 4, 7, 9]
+    assert activity.simplified(tolerance=10.0) == [0, 4, 9]
+    assert activity.simplified(max_points=1, tolerance=1.0) == [0, 9]
+    assert activity.build_track_detail.call_count == 1
+
+
+def test_samples(mocker):
+    objects = mocker.patch.object(models.Activity, 'objects')
+    activity = ActivityFactory.build(id=3, stream_pyramid=None)
+    build = mocker.patch.object(models.pyramid, 'build', return_value=b'levels')
+    samples = mocker.patch.object(models.pyramid, 'samples', return_value={'size': 1})
+    assert activity.samples(10, 20, max_points=50) == {'size': 1}
+    objects.filter.return_value.update.assert_called_once_with(stream_pyramid=b'levels')
+    samples.assert_called_once_with(b'levels', activity.points, 10, 20, 50)
+    activity.samples()
+    assert build.call_count == 1
+
+
+def test_svg_thumbnail(mocker):
+    objects = mocker.patch.object(models.Activity, 'objects')
+    activity = ActivityFactory.build(id=4, thumbnail=None)
+    mocker.patch.object(activity, 'build_thumbnail', return_value='1.0,2.0')
+    assert activity.svg_thumbnail() == '1.0,2.0'
+    objects.filter.assert_called_once_with(pk=4)
+    objects.filter.return_value.update.assert_called_once_with(thumbnail='1.0,2.0')
+    assert activity.svg_thumbnail() == '1.0,2.0'
+    assert activity.build_thumbnail.call_count == 1
+    # Without a track the blank thumbnail is stored and not built again.
+    activity = ActivityFactory.build(id=5, thumbnail=None)
+    mocker.patch.object(activity, 'build_thumbnail', return_value='')
+    assert activity.svg_thumbnail() == ''
+    objects.filter.return_value.update.assert_called_with(thumbnail='')
+    assert activity.svg_thumbnail() == ''
+    assert activity.build_thumbnail.call_count == 1
 
 
 def test_display_distance():
@@ -248,106 +338,47 @@ def test_has_heart_rate(mocker):
     assert activity.has_heart_rate() is True
 
 
-def test_activity_average():
-    points = [
-        {
-            'time': datetime.datetime(2017, 4, 3, 2, 1, 5),
-            'distance': 1,
-            'speed': 3,
-        }, {
-            'time': datetime.datetime(2017, 4, 3, 2, 3, 5),
-            'distance': 3,
-        }, {
-            'time': datetime.datetime(2017, 4, 3, 2, 4, 5),
-            'distance': 5,
-            'speed': 3,
-        },
-    ]
-    assert models.Activity.average(points, 'time') == datetime.datetime(2017, 4, 3, 2, 1, 5)
-    assert models.Activity.average(points, 'distance') == 3
-    assert models.Activity.average(points, 'speed') == 2
-    assert models.Activity.average(points, 'grade') is None
-
-
-def test_condense_points():
-    points = [
-        {
-            'time': datetime.datetime(2017, 4, 3, 2, 1, 5),
-            'distance': 1,
-            'speed': 3,
-        }, {
-            'time': datetime.datetime(2017, 4, 3, 2, 3, 5),
-            'distance': 3,
-        }, {
-            'time': datetime.datetime(2017, 4, 3, 2, 4, 5),
-            'distance': 5,
-            'speed': 3,
-        },
-    ]
-    assert models.Activity.condense_points(points) == {
-        'time': datetime.datetime(2017, 4, 3, 2, 1, 5),
-        'distance': 3,
-        'speed': 2,
-    }
-
-
-def test_reduction_factor():
-    assert models.Activity.reduction_factor([''] * 199) == 1
-    assert models.Activity.reduction_factor([''] * 399) == 1
-    assert models.Activity.reduction_factor([''] * 401) == 2
-
-
 def test_reduced_points(mocker):
     activity = ActivityFactory.build()
-    mocker.patch.object(activity, 'point_stream', return_value=list(range(0, 20)))
-    mocker.patch.object(activity, 'reduction_factor', return_value=2)
-    mocker.patch.object(activity, 'condense_points', side_effect=lambda h: sum(h))
-    assert activity.reduced_points() == [0, 3, 7, 11, 15, 19, 23, 27, 31, 35]
+    now = datetime.datetime(2017, 4, 3, 7, 30, 0)
+    positions = [(0, i / 1e4) for i in range(0, 10)] + [(i / 1e4, 9 / 1e4) for i in range(1, 10)]
+    activity.stream = PointStream.from_points([
+        {'time': timedelta(now, i), 'latitude': a, 'longitude': b, 'distance': i, 'speed': None}
+        for i, (a, b) in enumerate(positions)
+    ]).encode()
+    reduced = activity.reduced_points()
+    assert list(zip(reduced['latitude'], reduced['longitude'])) == [positions[0], positions[9], positions[18]]
+    assert reduced['time'].tolist() == [0, 9, 18]
+    assert reduced['distance'].tolist() == [0, 5, 14]
+    assert reduced['speed'].tolist() == [0, 0, 0]
+    mocker.patch.object(models, 'GEO_JSON_POINTS', 2)
+    activity.track_detail = None
+    assert len(activity.reduced_points()['time']) == 2
+    activity.stream = activity.track_detail = None
+    assert activity.reduced_points() == {}
+
+
+def test_optional_readings():
+    assert models.optional_readings(numpy.array([1.5, 0, math.nan]), 3) == [1.5, None, None]
+    assert models.optional_readings(None, 2) == [None, None]
 
 
 def test_geo_line():
-    new_point = {
-        'altitude': 100,
-        'speed': 20,
-        'distance': 10,
-        'cadence': 120,
-        'longitude': 50,
-        'latitude': 40,
-    }
-    old_point = {
-        'longitude': 51,
-        'latitude': 39,
-    }
-    expected = {
+    assert models.Activity.geo_line({'id': 4, 'speed': 20}, [51, 39], [50, 40]) == {
         'geometry': {
             'coordinates': [[51, 39], [50, 40]],
             'type': 'LineString'
         },
         'properties': {
-            'cadence': 120,
-            'distance': 10,
-            'elevation': 100,
             'id': 4,
             'speed': 20
         },
         'type': 'Feature'
     }
-    assert models.Activity.geo_line(4, new_point, old_point) == expected
-    new_point['heart_rate'] = 150
-    expected['properties']['heart_rate'] = 150
-    assert models.Activity.geo_line(4, new_point, old_point) == expected
 
 
 def test_geo_point():
-    new_point = {
-        'altitude': 100,
-        'speed': 20,
-        'distance': 10,
-        'cadence': 120,
-        'longitude': 50,
-        'latitude': 40,
-    }
-    assert models.Activity.geo_point(4, new_point) == {
+    assert models.Activity.geo_point(4, [50, 40]) == {
         'geometry': {
             'coordinates': [50, 40],
             'type': 'Point'
@@ -363,44 +394,262 @@ def test_geo_json(mocker):
     def pass_through(*args):
         return args
     activity = ActivityFactory.build()
-    mocker.patch.object(activity, 'reduced_points', return_value=['P{}'.format(i) for i in range(0, 5)])
+    mocker.patch.object(activity, 'reduced_points', return_value={
+        'latitude': numpy.array([40, 41, 42]),
+        'longitude': numpy.array([50, 51, 52]),
+        'altitude': numpy.array([0, 100, 110]),
+        'heart_rate': numpy.array([0, 150, math.nan]),
+    })
     mocker.patch.object(activity, 'geo_line', side_effect=pass_through)
     mocker.patch.object(activity, 'geo_point', side_effect=pass_through)
+    properties = {'elevation': 100, 'speed': None, 'distance': None, 'cadence': None}
     assert activity.geo_json() == [
-        (0, 'P1', 'P0'),
-        (1, 'P2', 'P1'),
-        (2, 'P3', 'P2'),
-        (3, 'P4', 'P3'),
-        ('progress', 'P0'),
-        ('start', 'P0'),
-        ('stop', 'P4')
+        (dict(properties, id=0, heart_rate=150), [50, 40], [51, 41]),
+        (dict(properties, id=1, elevation=110), [51, 41], [52, 42]),
+        ('progress', [50, 40]),
+        ('start', [50, 40]),
+        ('stop', [52, 42])
     ]
+    activity.reduced_points.return_value = {}
+    assert activity.geo_json() == []
 
 
-def test_trimp_activities(mocker):
-    user_a = UserFactory.build()
-    user_b = UserFactory.build()
-    all_activities = MockSet()
-    mocker.patch.object(models.Activity, 'objects', all_activities)
-    all_activities.add(
-        MockModel(owner=user_b, trimp=100, time=datetime.datetime(2017, 5, 4, 3, 2, 1)),
-        MockModel(owner=user_a, trimp=100, time=datetime.datetime(2017, 5, 5, 4, 2, 1)),
-        MockModel(owner=user_a, trimp=None, time=datetime.datetime(2017, 5, 6, 5, 2, 1)),
-        MockModel(owner=user_a, trimp=100, time=datetime.datetime(2017, 5, 7, 6, 2, 1)),
-        MockModel(owner=user_a, trimp=100, time=datetime.datetime(2017, 5, 8, 6, 2, 1)),
-        MockModel(owner=user_a, trimp=100, time=datetime.datetime(2017, 5, 9, 7, 2, 1)),
-        MockModel(owner=user_b, trimp=100, time=datetime.datetime(2017, 5, 10, 8, 2, 1)),
+def test_geo_json_per_10k_points():
+    state = numpy.random.RandomState(5)
+    now = datetime.datetime(2017, 4, 3, 7, 30, 0)
+    latitude = 51 + numpy.cumsum(state.normal(0, 1e-4, 10000)).round(6)
+    longitude = numpy.cumsum(state.normal(0, 1e-4, 10000)).round(6)
+    activity = ActivityFactory.build(stream=PointStream.from_points([
+        {
+            'time': timedelta(now, i), 'latitude': a, 'longitude': b, 'heart_rate': 90 + i % 90,
+            'distance': i * 3.0, 'speed': 3.0, 'altitude': i % 40, 'cadence': None,
+        }
+        for i, (a, b) in enumerate(zip(latitude.tolist(), longitude.tolist()))
+    ]).encode(), track_detail=None)
+    activity.simplified()
+    tracemalloc.start()
+    try:
+        features = activity.build_geo_json()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert len(features) == models.GEO_JSON_POINTS + 2
+    # A list of dicts per point used a little over 480KB here.  The time is
+    # measured by benchmarks.geo_json.
+    assert peak < 400 * 1024
+
+
+def test_geo_json_cached(mocker):
+    mocker.patch.object(models, 'cache', LocMemCache('geo_json', {}))
+    activity = ActivityFactory.build(id=4)
+    build = mocker.patch.object(activity, 'build_geo_json', return_value=['first'])
+    assert activity.geo_json() == ['first']
+    build.return_value = ['second']
+    assert activity.geo_json() == ['first']
+    activity.stream_updated += datetime.timedelta(seconds=1)
+    assert activity.geo_json() == ['second']
+    assert build.call_count == 2
+
+
+def test_deferred_stream_loads_alone(mocker):
+    queries = []
+
+    def fetch(queryset):
+        queries.append(str(queryset.query))
+        queryset._result_cache = [models.Activity.from_db('default', ['id', 'stream'], [4, {'version': 1}])]
+
+    mocker.patch.object(models.models.QuerySet, '_fetch_all', autospec=True, side_effect=fetch)
+    activity = models.Activity.from_db('default', ['id', 'name'], [4, 'Run'])
+    assert activity.stream == {'version': 1}
+    assert len(queries) == 1
+    assert '"stream"' in queries[0]
+    assert all('"{}"'.format(a) not in queries[0] for a in ('stream_data', 'track_detail', 'stream_pyramid', 'name'))
+    assert activity.saved_stream == ({'version': 1}, None)
+    assert 'track_detail' in activity.get_deferred_fields()
+    activity.load_stream()
+    assert len(queries) == 2
+    assert '"stream_pyramid"' not in queries[1]
+    assert '"stream_data"' in queries[1] and '"track_detail"' in queries[1]
+
+
+def test_track_columns_cached(mocker):
+    mocker.patch.object(models, 'cache', LocMemCache('track_columns', {}))
+    activity = ActivityFactory.build(id=4)
+    reduced = mocker.patch.object(activity, 'reduced_points', return_value={'speed': numpy.array([0.0, 3.5])})
+    columns = activity.track_columns()
+    assert columns['speed'].dtype == models.COLUMNS['speed']
+    assert activity.track_columns()['speed'].tolist() == [0.0, 3.5]
+    assert reduced.call_count == 1
+    activity.stream_updated += datetime.timedelta(seconds=1)
+    activity.track_columns()
+    assert reduced.call_count == 2
+    assert activity.geo_json_key() != activity.stream_cache_key('track_columns')
+
+
+def test_activity_stream_updated(mocker):
+    mocker.patch.object(models.models.Model, 'save')
+    mocker.patch.object(models, 'timezone_now', return_value=datetime.datetime(2017, 4, 3, 2, 1))
+    activity = ActivityFactory.build(stream={'version': 1}, stream_updated=datetime.datetime(2017, 1, 1))
+    # As if read from the database.
+    activity._state.adding = False
+    activity.name = 'Renamed'
+    activity.save()
+    assert activity.stream_updated == datetime.datetime(2017, 1, 1)
+    mocker.patch.object(activity, 'build_thumbnail', return_value='1.0,2.0')
+    activity.save()
+    assert activity.thumbnail is None
+    activity.stream = PointStream.from_points([
+        {'time': datetime.datetime(2017, 4, 3, 2, 1), 'latitude': 35.7, 'longitude': 139.7}
+    ]).encode()
+    activity.save()
+    assert activity.stream_updated == datetime.datetime(2017, 4, 3, 2, 1)
+    assert activity.thumbnail == '1.0,2.0'
+    assert activity.timezone_name == 'Asia/Tokyo'
+    assert activity.fingerprint == models.stream_fingerprint(activity.stream)
+
+
+def test_activity_binary_stream(mocker, settings):
+    mocker.patch.object(models.models.Model, 'save')
+    settings.FITNESS_STREAM_FORMAT = 'binary'
+    stream = PointStream.from_points([
+        {'time': datetime.datetime(2017, 4, 3, 2, 1), 'latitude': 35.7, 'longitude': 139.7}
+    ])
+    activity = ActivityFactory.build()
+    activity.stream = stream.encode()
+    activity.save()
+    assert activity.stream is None
+    assert activity.stream_data == stream.to_bytes()
+    assert activity.fingerprint == models.stream_fingerprint(activity.stream_data)
+    assert activity.timezone_name == 'Asia/Tokyo'
+    assert activity.points().points() == stream.points()
+    assert models.stream_fields(stream) == {'stream': None, 'stream_data': stream.to_bytes()}
+    settings.FITNESS_STREAM_FORMAT = 'json'
+    assert models.stream_fields(stream) == {'stream': stream.encode(), 'stream_data': None}
+    activity.save()
+    assert activity.stream is None
+
+
+def test_converted_stream():
+    stream = PointStream.from_points([{'time': datetime.datetime(2017, 4, 3, 2, 1), 'heart_rate': 120}])
+    assert models.converted_stream(stream.encode(), None, True) == (None, stream.to_bytes())
+    assert models.converted_stream(None, memoryview(stream.to_bytes()), False) == (stream.encode(), None)
+
+
+def test_activity_upsert(mocker):
+    user = UserFactory.build()
+    mocker.patch.object(models.transaction, 'atomic')
+    mocker.patch.object(models, 'timezone_now', return_value=utc(2017, 5, 1))
+    existing = MockModel(pk=3, owner=user, time=utc(2017, 4, 3, 7), name='Old', fingerprint='')
+    unchanged = MockModel(
+        pk=2, owner=user, time=utc(2017, 4, 2, 7), name='Same', fingerprint=models.stream_fingerprint({'a': 1})
     )
-    activities, start, end = models.Activity.trimp_activities(user_a)
-    assert set(a.time.day for a in activities) == {5, 7, 8, 9}
-    assert start.day == 5
-    assert end.day == 9
-    activities, start, end = models.Activity.trimp_activities(
-        user_a, start=datetime.datetime(2017, 5, 5, 10, 5, 5), end=datetime.datetime(2017, 5, 8, 10, 5, 5)
+    objects = MockSet(existing, unchanged, model=models.Activity)
+    mocker.patch.object(models.ActivityManager, 'get_queryset', return_value=objects)
+    objects.bulk_create.side_effect = lambda created: objects.add(*[
+        MockModel(pk=4, owner=a.owner, time=a.time, name=a.name) for a in created
+    ])
+    ids = models.Activity.objects.upsert(user, [
+        {'time': utc(2017, 4, 2, 7), 'name': 'Renamed', 'stream': {'a': 1}},
+        {'time': utc(2017, 4, 3, 7), 'name': 'Replaced'},
+        {'time': utc(2017, 4, 4, 7), 'name': 'First'},
+        {'time': utc(2017, 4, 4, 7), 'name': 'New'},
+    ])
+    assert ids == {utc(2017, 4, 2, 7): 2, utc(2017, 4, 3, 7): 3, utc(2017, 4, 4, 7): 4}
+    assert existing.name == 'Replaced'
+    assert existing.stream_updated == utc(2017, 5, 1)
+    assert unchanged.name == 'Same'
+    added = objects.bulk_create.call_args[0][0]
+    assert [(a.owner, a.time, a.name) for a in added] == [(user, utc(2017, 4, 4, 7), 'New')]
+
+
+def test_stream_fingerprint():
+    stream = PointStream.from_points([{'time': utc(2017, 4, 3), 'heart_rate': 120}]).encode()
+    reordered = dict(reversed(list(stream.items())))
+    assert models.stream_fingerprint(stream) == models.stream_fingerprint(reordered)
+    assert len(models.stream_fingerprint(stream)) == 64
+    assert models.stream_fingerprint(dict(stream, length=2)) != models.stream_fingerprint(stream)
+    assert models.stream_fingerprint(None) == ''
+
+
+def set_trimp(activity):
+    activity.trimp = 40.0
+    activity.trimp_dirty = False
+
+
+def test_activity_store_unchanged(mocker):
+    user = UserFactory.build()
+    stream = {'a': 1}
+    unchanged = MockModel(pk=2, owner=user, time=utc(2017, 4, 2, 7), fingerprint=models.stream_fingerprint(stream))
+    objects = MockSet(unchanged, model=models.Activity)
+    mocker.patch.object(models.ActivityManager, 'get_queryset', return_value=objects)
+    update_or_create = mocker.patch.object(models.ActivityManager, 'update_or_create')
+    summaries = mocker.Mock(return_value={'distance': 5.0})
+    assert models.Activity.objects.store(user, utc(2017, 4, 2, 7), {'stream': stream}, summaries) == (
+        unchanged, None
     )
-    assert set(a.time.day for a in activities) == {7, 8}
-    assert start.day == 5
-    assert end.day == 8
+    update_or_create.assert_not_called()
+    summaries.assert_not_called()
+    mocker.patch.object(models.Activity, 'update_trimp', autospec=True, side_effect=set_trimp)
+    activity = update_or_create.return_value = (mocker.Mock(), True)
+    assert models.Activity.objects.store(user, utc(2017, 4, 2, 7), {'stream': {'a': 2}}, summaries) == activity
+    update_or_create.assert_called_once_with(owner=user, time=utc(2017, 4, 2, 7), defaults={
+        'stream': {'a': 2}, 'distance': 5.0, 'trimp': 40.0, 'trimp_dirty': False
+    })
+    activity[0].save.assert_not_called()
+
+
+def test_activity_store_created(mocker):
+    user = UserFactory.build()
+    mocker.patch.object(models.ActivityManager, 'get_queryset', return_value=MockSet(model=models.Activity))
+    save = mocker.patch.object(models.models.Model, 'save')
+    mocker.patch.object(models.Activity, 'update_trimp', autospec=True, side_effect=set_trimp)
+    mocker.patch.object(models, 'timezone_now', return_value=utc(2017, 5, 1))
+
+    def update_or_create(owner, time, defaults):
+        # As Django does, the new activity is built with its fields and then saved.
+        activity = models.Activity(owner=owner, time=time, **defaults)
+        activity.save(force_insert=True)
+        return activity, True
+
+    mocker.patch.object(models.ActivityManager, 'update_or_create', side_effect=update_or_create)
+    stream = PointStream.from_points([
+        {'time': utc(2017, 4, 2, 7, 0, i), 'latitude': 51.5, 'longitude': i / 1e4, 'distance': i}
+        for i in range(0, 20)
+    ]).encode()
+    activity, created = models.Activity.objects.store(user, utc(2017, 4, 2, 7), {'stream': stream})
+    assert created
+    assert activity.fingerprint == models.stream_fingerprint(stream)
+    assert activity.stream_updated == utc(2017, 5, 1)
+    assert activity.track_detail['ends'] == [0, 19]
+    assert activity.thumbnail
+    assert activity.timezone_name == 'Europe/London'
+    assert activity.trimp == 40.0
+    # One save, so one balance refresh.
+    assert save.call_count == 1
+
+
+def test_activity_insert_new(mocker):
+    user = UserFactory.build()
+    mocker.patch.object(models.transaction, 'atomic')
+    mocker.patch.object(models, 'timezone_now', return_value=utc(2017, 5, 1))
+    existing = MockModel(pk=3, owner=user, time=utc(2017, 4, 3, 7), name='Old')
+    objects = MockSet(existing, model=models.Activity)
+    mocker.patch.object(models.ActivityManager, 'get_queryset', return_value=objects)
+    objects.bulk_create.side_effect = lambda created: objects.add(*[
+        MockModel(pk=4, owner=a.owner, time=a.time, name=a.name) for a in created
+    ])
+    created, stored = models.Activity.objects.insert_new(user, [
+        {'time': utc(2017, 4, 3, 7), 'name': 'Replaced'},
+        {'time': utc(2017, 4, 4, 7), 'name': 'New'},
+    ])
+    assert created == {utc(2017, 4, 4, 7): 4}
+    assert stored == {utc(2017, 4, 3, 7): 3}
+    assert existing.name == 'Old'
+    added = objects.bulk_create.call_args[0][0]
+    assert [(a.time, a.name, a.stream_updated) for a in added] == [(utc(2017, 4, 4, 7), 'New', utc(2017, 5, 1))]
+    objects.bulk_create.reset_mock()
+    assert models.Activity.objects.insert_new(user, []) == ({}, {})
+    objects.bulk_create.assert_not_called()
 
 
 def test_balance_point():
@@ -411,16 +660,6 @@ def test_balance_point():
     assert point.fatigue == 0
     assert point.form == 0
 
-    old_point = models.TrainingStressBalancePoint(datetime.datetime(2017, 4, 3, 5, 4, 1))
-    old_point.fitness = 20
-    old_point.fatigue = 30
-
-    point.trimp = 120
-    point.increment_fitness(old_point)
-    assert round(point.fitness, 4) == 22.3528
-    assert round(point.fatigue, 4) == 41.981
-    assert round(point.form, 4) == -19.6282
-
 
 def test_balance():
     balance = models.TrainingStressBalance(datetime.date(2017, 4, 3), datetime.date(2017, 4, 7))
@@ -435,26 +674,255 @@ def test_balance():
     ]
 
 
+def test_balance_seeded_inflate():
+    balance = models.TrainingStressBalance(datetime.date(2017, 4, 3), datetime.date(2017, 4, 4))
+    seed = models.TrainingStressBalancePoint(datetime.date(2017, 4, 2))
+    seed.fitness = 20
+    seed.fatigue = 30
+    balance.data[datetime.date(2017, 4, 3)].trimp = 120
+    balance.inflate(seed)
+    assert [round(a.fitness, 4) for a in balance.points()] == [22.3528, 21.8269]
+    assert [round(a.form, 4) for a in balance.points()] == [-19.6282, -14.5655]
+
+
+def test_balance_time_constants():
+    balance = models.TrainingStressBalance(datetime.date(2017, 4, 3), datetime.date(2017, 4, 5), 21, 3)
+    balance.data[datetime.date(2017, 4, 4)].trimp = 100
+    balance.inflate()
+    assert [round(a.fitness, 3) for a in balance.points()] == [0, 4.65, 4.434]
+    assert [round(a.fatigue, 3) for a in balance.points()] == [0, 28.347, 20.311]
+
+
+def utc(*args):
+    return datetime.datetime(*args, tzinfo=datetime.timezone.utc)
+
+
+def balance_mocks(mocker, user, activities, days=()):
+    mocker.patch.object(models.settings, 'USE_TZ', True)
+    mocker.patch.object(models.transaction, 'atomic')
+    mocker.patch.object(models.User, 'objects')
+    mocker.patch.object(models.Activity, 'objects', MockSet(*[
+        MockModel(owner=user, time=time, trimp=trimp) for time, trimp in activities
+    ]))
+    stored = MockSet(*[MockModel(owner=user, date=a.date, fitness=a.fitness, fatigue=a.fatigue) for a in days])
+    mocker.patch.object(models.TrainingStressBalanceDay, 'objects', stored)
+    return stored
+
+
+def test_balance_refresh(mocker):
+    user = UserFactory.build()
+    stored = balance_mocks(mocker, user, [
+        (utc(2017, 4, 3, 10), 50),
+        (utc(2017, 4, 5, 10), 100),
+        (utc(2017, 4, 6, 10), None),
+        (utc(2017, 4, 7, 10), 20),
+    ])
+    models.TrainingStressBalance.refresh(user)
+    created = stored.bulk_create.call_args[0][0]
+    assert [a.date.day for a in created] == [3, 4, 5, 6, 7]
+    assert [a.trimp for a in created] == [50, 0, 100, 0, 20]
+    assert [round(a.fitness, 3) for a in created] == [0, 0.0, 2.353, 2.297, 2.714]
+    assert all(a.owner is user for a in created)
+
+
+def test_balance_refresh_from_date(mocker):
+    user = UserFactory.build()
+    full = models.TrainingStressBalance(datetime.date(2017, 4, 3), datetime.date(2017, 4, 7))
+    full.data[datetime.date(2017, 4, 5)].trimp = 100
+    full.data[datetime.date(2017, 4, 7)].trimp = 20
+    full.inflate()
+    stored = balance_mocks(mocker, user, [
+        (utc(2017, 4, 3, 10), 50),
+        (utc(2017, 4, 5, 10), 100),
+        (utc(2017, 4, 7, 10), 20),
+    ], days=full.points())
+    models.TrainingStressBalance.refresh(user, since=datetime.date(2017, 4, 6))
+    assert [a.date.day for a in stored] == [3, 4, 5]
+    created = stored.bulk_create.call_args[0][0]
+    assert [a.date.day for a in created] == [6, 7]
+    # Continuing from a stored day rounds differently from the full history.
+    assert [a.fitness for a in created] == pytest.approx([a.fitness for a in full.points()[3:]], rel=1e-12)
+
+
+def test_balance_refresh_after_gap(mocker):
+    user = UserFactory.build()
+    full = models.TrainingStressBalance(datetime.date(2017, 4, 3), datetime.date(2017, 4, 10))
+    full.data[datetime.date(2017, 4, 5)].trimp = 100
+    full.data[datetime.date(2017, 4, 7)].trimp = 20
+    full.data[datetime.date(2017, 4, 10)].trimp = 60
+    full.inflate()
+    stored = balance_mocks(mocker, user, [
+        (utc(2017, 4, 3, 10), 50),
+        (utc(2017, 4, 5, 10), 100),
+        (utc(2017, 4, 7, 10), 20),
+        (utc(2017, 4, 10, 10), 60),
+    ], days=full.points()[:5])
+    models.TrainingStressBalance.refresh(user, since=datetime.date(2017, 4, 10))
+    assert [a.date.day for a in stored] == [3, 4, 5, 6, 7]
+    created = stored.bulk_create.call_args[0][0]
+    assert [a.date.day for a in created] == [8, 9, 10]
+    assert [a.trimp for a in created] == [0, 0, 60]
+    assert [a.fitness for a in created] == pytest.approx([a.fitness for a in full.points()[5:]], rel=1e-12)
+
+
+def test_balance_refresh_without_seed(mocker):
+    user = UserFactory.build()
+    stored = balance_mocks(mocker, user, [(utc(2017, 4, 3, 10), 50), (utc(2017, 4, 5, 10), 100)])
+    models.TrainingStressBalance.refresh(user, since=datetime.date(2017, 4, 5))
+    assert [a.date.day for a in stored.bulk_create.call_args[0][0]] == [3, 4, 5]
+    stored = balance_mocks(mocker, user, [], days=[models.TrainingStressBalancePoint(datetime.date(2017, 4, 5))])
+    models.TrainingStressBalance.refresh(user)
+    assert len(stored) == 0
+    assert stored.bulk_create.call_count == 0
+
+
 def test_trimp_history(mocker):
-    trimp = mocker.patch.object(models.Activity, 'trimp_activities', return_value=(
-        range(0, 4), datetime.date(2017, 4, 3), datetime.date(2017, 4, 7)
+    user = UserFactory.build()
+    mocker.patch.object(models.Activity, 'objects', MockSet(MockModel(owner=user, trimp_dirty=False)))
+    queue = mocker.patch.object(models, 'queue_dirty_trimp')
+    stored = MockSet(*[
+        MockModel(owner=user, date=datetime.date(2017, 4, i), fitness=i) for i in range(3, 8)
+    ])
+    mocker.patch.object(models.TrainingStressBalanceDay, 'objects', stored)
+    refresh = mocker.patch.object(models.TrainingStressBalance, 'refresh')
+    assert [a.fitness for a in models.TrainingStressBalance.history_for_user(user)] == [3, 4, 5, 6, 7]
+    assert refresh.call_count == 0
+    assert [a.fitness for a in models.TrainingStressBalance.history_for_user(
+        user, start=datetime.date(2017, 4, 4), end=datetime.date(2017, 4, 6)
+    )] == [4, 5, 6]
+    stored.clear()
+    models.TrainingStressBalance.history_for_user(user)
+    refresh.assert_called_once_with(user)
+    assert queue.call_count == 0
+
+
+def test_trimp_history_requeues_dirty(mocker):
+    user = UserFactory.build(id=7)
+    mocker.patch.object(models.Activity, 'objects', MockSet(
+        MockModel(owner=user, trimp_dirty=False), MockModel(owner=user, trimp_dirty=True)
+    ))
+    mocker.patch.object(models.TrainingStressBalanceDay, 'objects', MockSet(
+        MockModel(owner=user, date=datetime.date(2017, 4, 3), fitness=1)
     ))
-    insertions = mocker.patch.object(models.TrainingStressBalance, 'insert')
-    inflations = mocker.patch.object(models.TrainingStressBalance, 'inflate')
-    mocker.patch.object(models.TrainingStressBalance, 'points', return_value='trimp_data')
-    assert models.TrainingStressBalance.history_for_user('user') == 'trimp_data'
-    trimp.assert_called_once_with('user', None, None)
-    for i in range(0, 4):
-        insertions.assert_any_call(i)
-    inflations.assert_called_once_with()
-    trimp.reset_mock()
-    models.TrainingStressBalance.history_for_user(
-        'user', start=datetime.date(2017, 4, 6), end=datetime.date(2017, 4, 8)
+    enqueue = mocker.patch.object(models.TASKS, 'enqueue')
+    mocker.patch.object(models.transaction, 'on_commit', side_effect=lambda h: h())
+    models.TrainingStressBalance.history_for_user(user)
+    enqueue.assert_called_once_with(('trimp', 7), 'fitness.jobs.recalculate_dirty_trimp', 7)
+
+
+def test_trimp_history_resolution(mocker):
+    user = UserFactory.build()
+    mocker.patch.object(models.Activity, 'objects', MockSet())
+    mocker.patch.object(models.TrainingStressBalanceDay, 'objects', MockSet(*[
+        MockModel(owner=user, date=datetime.date(2017, 3, 20) + datetime.timedelta(days=i), trimp=i,
+                  fitness=i + 0.5, fatigue=i + 0.25, form=0.25) for i in range(0, 20)
+    ]))
+    weeks = models.TrainingStressBalance.history_for_user(
+        user, start=datetime.date(2017, 3, 29), end=datetime.date(2017, 4, 4), resolution='week'
     )
-    trimp.assert_called_once_with('user', datetime.date(2017, 4, 6), datetime.date(2017, 4, 8))
-
-
+    assert [a.date for a in weeks] == [datetime.date(2017, 3, 27), datetime.date(2017, 4, 3)]
+    assert [a.trimp for a in weeks] == [sum(range(7, 14)), 14 + 15]
+    assert [a.fitness for a in weeks] == [13.5, 15.5]
+    assert [a.fatigue for a in weeks] == [13.25, 15.25]
+    assert [a.form for a in weeks] == [0.25, 0.25]
+    months = models.TrainingStressBalance.history_for_user(user, resolution='month')
+    assert [(a.date.month, a.trimp, a.fitness) for a in months] == [
+        (3, sum(range(0, 12)), 11.5), (4, sum(range(12, 20)), 19.5)
+    ]
 
 
+def test_balance_follows_activity_changes(mocker):
+    refresh = mocker.patch.object(models.TrainingStressBalance, 'refresh')
+    activity = ActivityFactory.build(time=utc(2017, 4, 5, 10), trimp=10)
+    models.update_balance_on_save(models.Activity, activity, created=True)
+    refresh.assert_called_once_with(activity.owner, since=datetime.date(2017, 4, 5))
+    models.update_balance_on_save(models.Activity, activity, created=False)
+    assert refresh.call_count == 1
+    activity.time = utc(2017, 4, 3, 10)
+    models.update_balance_on_save(models.Activity, activity, created=False)
+    refresh.assert_called_with(activity.owner, since=datetime.date(2017, 4, 3))
+    activity.trimp = 20
+    models.update_balance_on_save(models.Activity, activity, created=False)
+    assert refresh.call_count == 3
+    models.update_balance_on_delete(models.Activity, activity)
+    assert refresh.call_count == 4
+
+
+def test_points_memoized(mocker):
+    activity = ActivityFactory.build()
+    activity.stream = {
+        'point1': {'time': '2017-05-04T03:02:03', 'latitude': 1, 'longitude': 2},
+    }
+    decode = mocker.spy(PointStream, 'decode')
+    stream = activity.points()
+    assert activity.points() is stream
+    activity.track()
+    activity.point_stream()
+    assert decode.call_count == 1
+    activity.stream = PointStream.from_points([{'time': datetime.datetime(2017, 5, 4)}]).encode()
+    assert activity.points() is not stream
+    assert decode.call_count == 2
+
+
+def test_profile_invalidates_trimp(mocker):
+    mocker.patch.object(models.models.Model, 'save')
+    invalidate = mocker.patch.object(models.Profile, 'invalidate_trimp')
+    profile = ProfileFactory.build()
+    profile.gender = 'F'
+    profile.save()
+    assert invalidate.call_count == 0
+    profile._state.adding = False
+    profile.theme_id = 3
+    profile.save()
+    assert invalidate.call_count == 0
+    profile.maximum_heart_rate = 180
+    profile.save()
+    assert invalidate.call_count == 1
+    profile.save()
+    assert invalidate.call_count == 1
 
 
+def test_profile_invalidates_balance(mocker):
+    mocker.patch.object(models.models.Model, 'save')
+    invalidate_trimp = mocker.patch.object(models.Profile, 'invalidate_trimp')
+    invalidate = mocker.patch.object(models.Profile, 'invalidate_balance')
+    profile = ProfileFactory.build()
+    profile._state.adding = False
+    profile.fitness_days = 30
+    profile.save()
+    assert invalidate.call_count == 1
+    profile.save()
+    assert invalidate.call_count == 1
+    profile.fatigue_days = 0
+    profile.gender = 'F'
+    profile.save()
+    assert profile.fatigue_days == 1
+    assert invalidate.call_count == 1
+    assert invalidate_trimp.call_count == 1
+
+
+def test_invalidate_balance(mocker):
+    profile = ProfileFactory.build(user__id=7)
+    enqueue = mocker.patch.object(models.TASKS, 'enqueue')
+    mocker.patch.object(models.transaction, 'on_commit', side_effect=lambda h: h())
+    profile.invalidate_balance()
+    enqueue.assert_called_once_with(('balance', 7), 'fitness.jobs.refresh_balance', 7)
+
+
+def test_invalidate_trimp(mocker):
+    profile = ProfileFactory.build(user__id=7)
+    objects = mocker.patch.object(models.Activity, 'objects')
+    enqueue = mocker.patch.object(models.TASKS, 'enqueue')
+    mocker.patch.object(models.transaction, 'on_commit', side_effect=lambda h: h())
+    profile.invalidate_trimp()
+    objects.filter.assert_called_once_with(owner_id=7)
+    objects.filter.return_value.update.assert_called_once_with(trimp_dirty=True)
+    enqueue.assert_called_once_with(('trimp', 7), 'fitness.jobs.recalculate_dirty_trimp', 7)
+
+
+def test_update_trimp(mocker):
+    activity = ActivityFactory.build(trimp_dirty=True)
+    mocker.patch.object(activity, 'calculate_trimp', return_value=12.5)
+    activity.update_trimp()
+    assert activity.trimp == 12.5
+    assert activity.trimp_dirty is False
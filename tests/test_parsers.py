@@ -0,0 +1,225 @@
+import datetime
+import gzip
+import io
+import struct
+
+import pytest
+
+from fitness import parsers
+from fitness.parsers import fit, gpx, tcx
+
+TCX_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<TrainingCenterDatabase xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2"'
+    ' xmlns:ns3="http://www.garmin.com/xmlschemas/ActivityExtension/v2"><Activities>'
+)
+
+
+def tcx_point(second, latitude=51.5, heart_rate=140, cadence=85):
+    position = (
+        '<Position><LatitudeDegrees>{}</LatitudeDegrees>'
+        '<LongitudeDegrees>-0.12</LongitudeDegrees></Position>'.format(latitude)
+    ) if latitude is not None else ''
+    extra = '<HeartRateBpm><Value>{}</Value></HeartRateBpm>'.format(heart_rate) if heart_rate else ''
+    if cadence:
+        extra += (
+            '<Extensions><ns3:TPX><ns3:RunCadence>{}</ns3:RunCadence></ns3:TPX></Extensions>'.format(cadence)
+        )
+    return (
+        '<Trackpoint><Time>2017-04-03T07:30:{:02d}Z</Time>{}'
+        '<AltitudeMeters>10.5</AltitudeMeters><DistanceMeters>{}</DistanceMeters>{}</Trackpoint>'
+    ).format(second, position, second * 3.0, extra)
+
+
+def tcx_activity(points, notes='Morning run', start='2017-04-03T07:30:00Z'):
+    return (
+        '<Activity Sport="Running"><Id>{}</Id><Lap StartTime="{}"><TotalTimeSeconds>60</TotalTimeSeconds>'
+        '<Track>{}</Track></Lap>{}</Activity>'
+    ).format(start, start, ''.join(points), '<Notes>{}</Notes>'.format(notes) if notes else '')
+
+
+def tcx_file(*activities):
+    return io.BytesIO((TCX_HEADER + ''.join(activities) + '</Activities></TrainingCenterDatabase>').encode())
+
+
+def test_read_tcx():
+    activities = list(tcx.read_tcx(tcx_file(
+        tcx_activity([tcx_point(0), tcx_point(2, heart_rate=None, cadence=None), tcx_point(2), tcx_point(4)]),
+        tcx_activity([tcx_point(0, latitude=None)], start='2017-04-04T07:30:00Z'),
+        tcx_activity([tcx_point(10)], notes=None, start='2017-04-05T07:30:00Z'),
+    )))
+    assert len(activities) == 2
+    first, second = activities
+    assert first['name'] == 'Morning run'
+    assert first['time'] == datetime.datetime(2017, 4, 3, 7, 30, tzinfo=datetime.timezone.utc)
+    assert [a['time'].second for a in first['points']] == [0, 2, 4]
+    assert first['points'][0] == {
+        'time': datetime.datetime(2017, 4, 3, 7, 30, tzinfo=datetime.timezone.utc),
+        'latitude': 51.5,
+        'longitude': -0.12,
+        'altitude': 10.5,
+        'distance': 0.0,
+        'speed': 0.0,
+        'heart_rate': 140.0,
+        'cadence': 85.0,
+    }
+    assert [a['heart_rate'] for a in first['points']] == [140.0, None, 140.0]
+    assert [a['cadence'] for a in first['points']] == [85.0, None, 85.0]
+    assert [a['speed'] for a in first['points']] == [0.0, 3.0, 3.0]
+    assert second['name'] == 'Running'
+    assert second['time'] == datetime.datetime(2017, 4, 5, 7, 30, tzinfo=datetime.timezone.utc)
+
+
+def test_read_tcx_releases_elements(mocker):
+    iterparse = tcx.ET.iterparse
+    roots = []
+
+    def spy(*args, **kwargs):
+        for event, element in iterparse(*args, **kwargs):
+            if not roots:
+                roots.append(element)
+            yield event, element
+
+    mocker.patch.object(tcx.ET, 'iterparse', side_effect=spy)
+    activities = tcx.read_tcx(tcx_file(*[tcx_activity([tcx_point(i) for i in range(0, 50)])] * 3))
+    assert [len(a['points']) for a in activities] == [50, 50, 50]
+    # Only the root and the Activities element are left.
+    assert len(list(roots[0].iter())) == 2
+
+
+def test_read_tcx_empty_elements():
+    points = [
+        tcx_point(0),
+        tcx_point(1).replace('<Time>2017-04-03T07:30:01Z</Time>', '<Time/>'),
+        tcx_point(2).replace('<AltitudeMeters>10.5</AltitudeMeters>', '<AltitudeMeters></AltitudeMeters>'),
+        tcx_point(3, heart_rate=None).replace('<Time>', '<HeartRateBpm><Value/></HeartRateBpm><Time>'),
+    ]
+    activities = list(tcx.read_tcx(tcx_file(tcx_activity(points, start=''))))
+    assert [a['time'].second for a in activities[0]['points']] == [0, 3]
+    assert activities[0]['points'][1]['heart_rate'] is None
+    assert activities[0]['time'] == activities[0]['points'][0]['time']
+
+
+GPX_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1"'
+    ' xmlns:ns3="http://www.garmin.com/xmlschemas/TrackPointExtension/v1">'
+)
+
+
+def gpx_point(second, latitude=51.5, elevation=10.5, heart_rate=140):
+    extensions = (
+        '<extensions><ns3:TrackPointExtension><ns3:hr>{}</ns3:hr><ns3:cad>85</ns3:cad>'
+        '</ns3:TrackPointExtension></extensions>'.format(heart_rate)
+    ) if heart_rate else ''
+    return '<trkpt lat="{}" lon="-0.12">{}<time>2017-04-03T07:30:{:02d}Z</time>{}</trkpt>'.format(
+        latitude, '<ele>{}</ele>'.format(elevation) if elevation is not None else '', second, extensions
+    )
+
+
+def gpx_file(*tracks):
+    return io.BytesIO((GPX_HEADER + ''.join(
+        '<trk>{}<trkseg>{}</trkseg></trk>'.format(
+            '<name>{}</name>'.format(name) if name else '', ''.join(points)
+        )
+        for name, points in tracks
+    ) + '</gpx>').encode())
+
+
+def test_read_gpx():
+    activities = list(gpx.read_gpx(gpx_file(
+        ('Evening run', [
+            gpx_point(0), gpx_point(1, elevation=None), gpx_point(2, latitude=51.501), gpx_point(4)
+        ]),
+        ('Empty', []),
+        (None, [gpx_point(0, heart_rate=None)]),
+    )))
+    assert len(activities) == 2
+    first, second = activities
+    assert first['name'] == 'Evening run'
+    assert first['time'] == datetime.datetime(2017, 4, 3, 7, 30, tzinfo=datetime.timezone.utc)
+    assert [a['time'].second for a in first['points']] == [0, 2, 4]
+    assert [round(a['distance'], 1) for a in first['points']] == [0.0, 111.2, 222.4]
+    assert [round(a['speed'], 1) for a in first['points']] == [0.0, 55.6, 55.6]
+    assert first['points'][0]['heart_rate'] == 140.0
+    assert first['points'][0]['cadence'] == 85.0
+    assert second['name'] == '2017-04-03T07:30:00+00:00'
+    assert second['points'][0]['heart_rate'] is None
+
+
+def test_read_gpx_empty_elements():
+    points = [
+        gpx_point(0),
+        gpx_point(1).replace('<ele>10.5</ele>', '<ele/>'),
+        gpx_point(3).replace('<ns3:hr>140</ns3:hr>', '<ns3:hr></ns3:hr>'),
+    ]
+    activities = list(gpx.read_gpx(gpx_file(('Run', points))))
+    assert [a['time'].second for a in activities[0]['points']] == [0, 3]
+    assert activities[0]['points'][1]['heart_rate'] is None
+
+
+def fit_definition(local_type, number, fields):
+    return struct.pack('<BBBHB', 0x40 | local_type, 0, 0, number, len(fields)) + b''.join(
+        struct.pack('BBB', *a) for a in fields
+    )
+
+
+RECORD_FIELDS = [
+    (253, 4, 0x86), (0, 4, 0x85), (1, 4, 0x85), (2, 2, 0x84), (3, 1, 0x02), (5, 4, 0x86), (7, 3, 0x0D)
+]
+
+
+def fit_record(timestamp, distance, latitude=51.5, heart_rate=140):
+    return struct.pack(
+        '<BIiiHBI3s', 0, timestamp, int(latitude / 180.0 * 2 ** 31), int(-0.12 / 180.0 * 2 ** 31),
+        (10 + 500) * 5, heart_rate, distance * 100, b'abc'
+    )
+
+
+def fit_file(body):
+    return struct.pack('<BBHI4sH', 14, 16, 2093, len(body), b'.FIT', 0) + body + b'\0\0'
+
+
+def test_read_fit():
+    time = datetime.datetime(2017, 4, 3, 7, 30, 30, tzinfo=datetime.timezone.utc)
+    start = int((time - fit.FIT_EPOCH).total_seconds())
+    compressed = fit_definition(1, 20, [(0, 4, 0x85), (1, 4, 0x85), (2, 2, 0x84), (3, 1, 0x02), (5, 4, 0x86)])
+    compressed += struct.pack(
+        '<BiiHBI', 0x80 | (1 << 5) | ((start + 2) & 0x1F), int(51.5 / 180.0 * 2 ** 31), 0, 2550, 255, 600
+    )
+    session = fit_definition(2, 18, [(5, 1, 0x00)]) + struct.pack('<BB', 2, 1)
+    body = fit_definition(0, 20, RECORD_FIELDS) + fit_record(start, 0) + fit_record(start + 1, 3, latitude=91)
+    data = fit_file(body + compressed + session) + fit_file(fit_definition(0, 20, RECORD_FIELDS))
+    activities = list(fit.read_fit(io.BytesIO(data)))
+    assert len(activities) == 1
+    activity = activities[0]
+    assert activity['name'] == 'Running'
+    assert activity['time'] == time
+    points = activity['points']
+    assert [(a['time'] - activity['time']).total_seconds() for a in points] == [0, 1, 2]
+    assert [round(a['latitude'], 5) for a in points] == [51.5, 91.0, 51.5]
+    assert [round(a['longitude'], 5) for a in points] == [-0.12, -0.12, 0.0]
+    assert [a['altitude'] for a in points] == [10.0, 10.0, 10.0]
+    assert [a['heart_rate'] for a in points] == [140, 140, None]
+    assert [a['distance'] for a in points] == [0.0, 3.0, 6.0]
+
+
+def test_read_fit_errors():
+    for data in (b'not a fit file', fit_file(b'\x05\x00')[:-2], fit_file(b'\x05\x00')):
+        with pytest.raises(parsers.ParseError):
+            list(parsers.read(io.BytesIO(data), 'a.fit'))
+
+
+def test_read_registry(tmpdir):
+    path = tmpdir.join('a.gpx.gz')
+    with gzip.open(str(path), 'wb') as archive:
+        archive.write(gpx_file(('Run', [gpx_point(0)])).getvalue())
+    assert parsers.supported('A.GPX.GZ')
+    assert not parsers.supported('a.txt')
+    assert [a['name'] for a in parsers.read(str(path))] == ['Run']
+    activities = parsers.read(tcx_file(tcx_activity([tcx_point(0)])), 'x.tcx')
+    assert [a['name'] for a in activities] == ['Morning run']
+    broken = ((io.BytesIO(b'<gpx'), 'a.gpx'), (io.BytesIO(b'plain'), 'a.gpx.gz'), (str(path), 'a.txt'))
+    for source, name in broken:
+        with pytest.raises(parsers.ParseError):
+            list(parsers.read(source, name))
@@ -0,0 +1,107 @@
+import datetime
+import math
+
+import numpy
+import pytest
+
+from fitness import pyramid
+from fitness.streams import PointStream
+
+
+def make_stream(count):
+    start = datetime.datetime(2017, 4, 3, 7, 30)
+    return PointStream.from_points([
+        {
+            'time': start + datetime.timedelta(seconds=i), 'heart_rate': 100 + i % 50,
+            'speed': 3.0, 'altitude': None, 'cadence': None,
+        }
+        for i in range(count)
+    ])
+
+
+def unexpected_load():
+    raise AssertionError('The stream should not be loaded')
+
+
+def test_aggregate():
+    times = numpy.arange(5.0)
+    columns = {
+        'heart_rate': numpy.array([100, math.nan, 120, 130, math.nan]),
+        'speed': numpy.full(5, math.nan),
+        'altitude': numpy.arange(5.0),
+        'cadence': numpy.full(5, 80.0),
+    }
+    level = pyramid.aggregate(times, columns.get, 2)
+    assert level['time'].tolist() == [0, 2, 4]
+    assert level['end'].tolist() == [1, 3, 4]
+    assert level['heart_rate']['min'].tolist()[:2] == [100, 120]
+    assert level['heart_rate']['max'].tolist()[:2] == [100, 130]
+    assert level['heart_rate']['mean'].tolist()[:2] == [100, 125]
+    assert math.isnan(level['heart_rate']['mean'][2])
+    assert level['altitude']['mean'].tolist() == [0.5, 2.5, 4]
+    assert len(pyramid.aggregate(times, columns.get, 2, 3, 3)['time']) == 0
+
+
+def test_build_and_decode():
+    stream = make_stream(5000)
+    length, levels = pyramid.decode(pyramid.build(stream))
+    assert length == 5000
+    assert [a['size'] for a in levels] == [16, 64, 256]
+    assert len(levels[0]['time']) == 313
+    assert levels[1]['time'][:2].tolist() == [0, 64]
+    assert levels[1]['end'][:2].tolist() == [63, 127]
+    assert levels[0]['heart_rate']['max'][0] == 115
+    assert pyramid.build(make_stream(16)) == b''
+    assert pyramid.decode(b'') == (0, [])
+
+
+def test_samples_from_levels():
+    data = pyramid.build(make_stream(5000))
+    samples = pyramid.samples(data, unexpected_load, max_points=100)
+    assert samples['size'] == 64
+    assert len(samples['time']) == 79
+    assert set(samples) == {'size', 'time', 'end', 'heart_rate', 'speed'}
+    samples = pyramid.samples(data, unexpected_load, 1000, 2999, max_points=100)
+    assert samples['size'] == 64
+    assert samples['time'][0] <= 1000 and samples['end'][-1] >= 2999
+    assert len(samples['time']) <= 33
+
+
+def test_samples_from_stream():
+    stream = make_stream(5000)
+    data = pyramid.build(stream)
+    samples = pyramid.samples(data, lambda: stream, 1000, 1099, max_points=50)
+    assert samples['size'] == 2
+    assert samples['time'][:2] == [1000, 1002]
+    assert samples['heart_rate']['mean'][0] == 100.5
+    samples = pyramid.samples(data, lambda: stream, 1000, 1009)
+    assert samples['size'] == 1
+    assert samples['heart_rate']['min'] == samples['heart_rate']['max'] == list(range(100, 110))
+    samples = pyramid.samples(b'', lambda: make_stream(3), max_points=2)
+    assert samples['time'] == [0, 2]
+    assert samples['end'] == [1, 2]
+
+
+@pytest.mark.parametrize('start, end', [(None, None), (0, 0), (4000, 9000)])
+def test_samples_stay_within_max_points(start, end):
+    stream = make_stream(5000)
+    samples = pyramid.samples(pyramid.build(stream), lambda: stream, start, end, max_points=64)
+    assert 0 < len(samples['time']) <= 64
+
+
+def test_samples_regroup_coarsest_level():
+    stream = make_stream(5000)
+    data = pyramid.build(stream)
+    samples = pyramid.samples(data, unexpected_load, max_points=2)
+    # The coarsest level holds 20 buckets of 256 points.
+    assert samples['size'] == 256 * 10
+    assert samples['time'] == [0, 2560]
+    assert samples['end'] == [2559, 4999]
+    assert samples['heart_rate']['min'] == [100, 100]
+    assert samples['heart_rate']['max'] == [149, 149]
+    assert samples['heart_rate']['mean'] == pytest.approx([
+        numpy.mean(stream.column('heart_rate')[:2560]), numpy.mean(stream.column('heart_rate')[2560:])
+    ], abs=1e-3)
+    samples = pyramid.samples(data, unexpected_load, 1000, 2999, max_points=3)
+    assert 0 < len(samples['time']) <= 3
+    assert samples['time'][0] <= 1000 and samples['end'][-1] >= 2999
@@ -0,0 +1,69 @@
+import json
+import math
+
+import numpy
+
+from fitness.renderers import COLUMNS_HEADER, ColumnarRenderer
+
+
+def decode(data):
+    magic, version, size = COLUMNS_HEADER.unpack_from(data)
+    assert (magic, version) == (b'FC', 1)
+    base = COLUMNS_HEADER.size + size
+    assert base % 8 == 0
+
+    def column(value):
+        if 'column' not in value:
+            return value
+        assert (base + value['offset']) % 8 == 0
+        values = numpy.frombuffer(data, numpy.dtype(value['column']).newbyteorder('<'), value['length'],
+                                  base + value['offset'])
+        if 'first' in value:
+            return ((value['first'] + numpy.cumsum(values.astype(numpy.int64))) / value['scale']).tolist()
+        return values.tolist()
+
+    return json.loads(data[COLUMNS_HEADER.size:base].decode('utf-8'), object_hook=column)
+
+
+def test_columns():
+    data = ColumnarRenderer().render({
+        'name': 'Run',
+        'track': {
+            'time': numpy.arange(0, 300.0, 3),
+            'latitude': 51 + numpy.arange(100) * 1e-5,
+            'heart_rate': numpy.linspace(100, 150, 100, dtype=numpy.float32),
+            'ratio': numpy.array([1 / 3, 2 / 3]),
+            'cadence': numpy.array([80, math.nan, 90], dtype=numpy.float32),
+            'count': numpy.array([1, 200000, 3]),
+            'empty': numpy.array([]),
+        },
+    })
+    header = json.loads(data[8:8 + COLUMNS_HEADER.unpack_from(data)[2]].decode())
+    columns = header['track']
+    assert header['name'] == 'Run'
+    assert columns['time'] == {'column': 'int8', 'scale': 1, 'first': 0, 'offset': 0, 'length': 100}
+    assert columns['latitude']['column'] == 'int8'
+    assert columns['latitude']['scale'] == 10 ** 5
+    assert columns['heart_rate']['column'] == 'int32'
+    assert columns['ratio']['column'] == 'float64'
+    assert columns['cadence']['column'] == 'float32'
+    assert columns['count']['column'] == 'int32'
+    assert columns['count']['first'] == 1
+    assert all(a['offset'] % 8 == 0 for a in columns.values())
+    decoded = decode(data)['track']
+    assert decoded['time'] == numpy.arange(0, 300.0, 3).tolist()
+    assert numpy.allclose(decoded['latitude'], 51 + numpy.arange(100) * 1e-5, rtol=0, atol=1e-12)
+    assert numpy.array_equal(
+        numpy.array(decoded['heart_rate'], dtype=numpy.float32), numpy.linspace(100, 150, 100, dtype=numpy.float32)
+    )
+    assert decoded['ratio'] == [1 / 3, 2 / 3]
+    assert decoded['cadence'][0] == 80 and math.isnan(decoded['cadence'][1])
+    assert decoded['count'] == [1, 200000, 3]
+    assert decoded['empty'] == []
+
+
+def test_without_columns():
+    renderer = ColumnarRenderer()
+    assert decode(renderer.render({'detail': 'Not found.'})) == {'detail': 'Not found.'}
+    assert decode(renderer.render([1, 'two'])) == [1, 'two']
+    assert renderer.render(None) == b''
@@ -0,0 +1,96 @@
+import datetime
+
+import numpy
+import pytest
+from rest_framework.exceptions import ValidationError
+
+from fitness.models import Activity
+from fitness.serializers import PointListField, PointSerializer, RunSerializer
+from fitness.streams import PointStream
+
+
+def make_points(count):
+    state = numpy.random.RandomState(count)
+    start = datetime.datetime(2017, 4, 3, 10, 0, tzinfo=datetime.timezone.utc)
+    return [
+        {
+            'time': (start + datetime.timedelta(seconds=a)).isoformat(),
+            'altitude': float(b),
+            'cadence': None if a % 3 else 80,
+            'distance': a * 2.5,
+            'heart_rate': 140 + a % 20,
+            'latitude': 51.0 + a / 1000,
+            'longitude': -1.0,
+            'speed': 2.5,
+        }
+        for a, b in zip(range(count), state.uniform(10, 30, count).round(1))
+    ]
+
+
+def loop_elevation_gain(points):
+    gain = 0
+    last_elevation = None
+    points_up = 0
+    for point in points:
+        if last_elevation is not None and point['altitude'] > last_elevation:
+            if points_up < 2:
+                points_up += 1
+            else:
+                gain += (int(point['altitude']) - int(last_elevation))
+        else:
+            points_up = 0
+        last_elevation = point['altitude']
+    return gain
+
+
+def test_point_list_matches_point_serializer():
+    points = make_points(50)
+    points.reverse()
+    stream = PointListField().run_validation(points)
+    expected = PointStream.from_points(PointSerializer(many=True).run_validation(points))
+    assert stream.encode() == expected.encode()
+
+
+@pytest.mark.parametrize('points', [
+    [{'time': '2017-04-03T10:00:00Z'}],
+    [{'time': 'yesterday', 'altitude': 1, 'cadence': None, 'distance': 0, 'heart_rate': None,
+      'latitude': 1, 'longitude': 1, 'speed': 0}],
+    'points',
+])
+def test_point_list_errors_match_point_serializer(points):
+    with pytest.raises(ValidationError) as expected:
+        PointSerializer(many=True).run_validation(points)
+    with pytest.raises(ValidationError) as error:
+        PointListField().run_validation(points)
+    assert error.value.detail == expected.value.detail
+
+
+def test_point_list_falls_back_for_strings():
+    points = make_points(5)
+    points[2]['altitude'] = '12.5'
+    stream = PointListField().run_validation(points)
+    assert stream.column('altitude')[2] == 12.5
+
+
+def test_run_defaults():
+    points = make_points(500)
+    defaults = RunSerializer.defaults({'name': 'Run', 'points': PointListField().run_validation(points)})
+    assert defaults['name'] == 'Run'
+    assert defaults['distance'] == 499 * 2.5
+    assert defaults['duration'] == 499
+    assert defaults['elevation'] == loop_elevation_gain(points)
+    assert defaults['elevation'] > 0
+    assert defaults['data_points'] == 500
+    validated = PointSerializer(many=True).run_validation(points)
+    assert defaults == RunSerializer.defaults({'name': 'Run', 'points': validated})
+
+
+def test_run_store_summarises_later(mocker):
+    store = mocker.patch.object(Activity.objects, 'store')
+    points = make_points(5)
+    data = {'name': 'Run', 'time': points[0]['time'], 'points': PointListField().run_validation(points)}
+    assert RunSerializer.store('owner', data) is store.return_value
+    owner, time, defaults, summaries = store.call_args[0]
+    assert (owner, time) == ('owner', points[0]['time'])
+    assert set(defaults) == {'stream', 'stream_data', 'name'}
+    assert dict(defaults, **summaries()) == RunSerializer.defaults(data)
@@ -0,0 +1,57 @@
+import datetime
+
+import numpy
+
+from fitness import simplify
+from fitness.streams import PointStream
+
+
+def douglas_peucker(x, y, first, last, tolerance):
+    if last - first < 2:
+        return set()
+    distances = simplify.segment_distances(x, y, first, last)
+    index = first + 1 + int(distances.argmax())
+    if distances.max() <= tolerance:
+        return set()
+    return (
+        {index} | douglas_peucker(x, y, first, index, tolerance) | douglas_peucker(x, y, index, last, tolerance)
+    )
+
+
+def test_segment_distances():
+    x = numpy.array([0.0, 1.0, 5.0, 12.0, 10.0])
+    y = numpy.array([0.0, 2.0, -3.0, 1.0, 0.0])
+    assert simplify.segment_distances(x, y, 0, 4).tolist() == [2.0, 3.0, numpy.hypot(2, 1)]
+    x[4] = 0
+    assert simplify.segment_distances(x, y, 0, 4).tolist() == [numpy.hypot(1, 2), numpy.hypot(5, 3), numpy.hypot(12, 1)]
+
+
+def test_rank_matches_douglas_peucker():
+    state = numpy.random.RandomState(3)
+    x = numpy.cumsum(state.normal(1, 3, 500))
+    y = numpy.cumsum(state.normal(0, 3, 500))
+    indices, tolerances = simplify.rank(x, y, 498)
+    assert sorted(indices) == list(range(1, 499))
+    assert all(a >= b for a, b in zip(tolerances, tolerances[1:]))
+    for tolerance in (tolerances[10], tolerances[100], 1.0):
+        expected = douglas_peucker(x, y, 0, 499, tolerance)
+        assert {a for a, b in zip(indices, tolerances) if b > tolerance} == expected
+    assert simplify.rank(x, y, 5)[0] == indices[:5]
+
+
+def test_track_detail():
+    start = datetime.datetime(2017, 4, 3, 7, 30)
+    stream = PointStream.from_points([
+        {'time': start + datetime.timedelta(seconds=i), 'latitude': a, 'longitude': b}
+        for i, (a, b) in enumerate([(None, None), (51, 0), (51, 0.001), (51, 0.002), (51.001, 0.002), (None, None)])
+    ])
+    detail = simplify.track_detail(stream, 10)
+    assert detail['ends'] == [1, 4]
+    assert detail['indices'][0] == 3
+    assert detail['tolerances'][0] > 50
+    assert detail['tolerances'][1] == 0
+    assert simplify.kept(detail) == [1, 2, 3, 4]
+    assert simplify.kept(detail, tolerance=1.0) == [1, 3, 4]
+    assert simplify.kept(detail, max_points=2) == [1, 4]
+    empty = simplify.track_detail(PointStream.from_points([{'time': start, 'distance': 0}]), 10)
+    assert simplify.kept(empty) == []
@@ -0,0 +1,46 @@
+import datetime
+import json
+
+from fitness import streaming
+
+
+def test_json_array(mocker):
+    mocker.patch.object(streaming, 'BATCH_SIZE', 2)
+    chunks = list(streaming.json_array(iter(range(5))))
+    assert len(chunks) == 4
+    assert json.loads(''.join(chunks)) == [0, 1, 2, 3, 4]
+    assert ''.join(streaming.json_array([])) == '[]'
+
+
+def test_json_object():
+    items = [
+        ('name', 'Run'),
+        ('time', datetime.datetime(2017, 4, 3, 7, 30)),
+        ('points', iter([{'speed': 3.0, 'heart_rate': None}])),
+        ('empty', iter([])),
+        ('list', [1, 2]),
+    ]
+    text = ''.join(streaming.json_object(items))
+    assert json.loads(text) == {
+        'name': 'Run', 'time': '2017-04-03T07:30:00', 'points': [{'speed': 3.0, 'heart_rate': None}],
+        'empty': [], 'list': [1, 2],
+    }
+    assert ' ' not in text
+    assert ''.join(streaming.json_object([])) == '{}'
+
+
+def test_deferred(mocker):
+    function = mocker.Mock(return_value=[1, 2])
+    chunks = streaming.json_object([('name', 'Run'), ('items', streaming.deferred(function))])
+    assert next(chunks) == '{"name":'
+    assert next(chunks) == '"Run"'
+    assert function.call_count == 0
+    assert ''.join(chunks) == ',"items":[1,2]}'
+    assert function.call_count == 1
+
+
+def test_json_response():
+    response = streaming.json_response([('name', 'Run')], status=201)
+    assert response.status_code == 201
+    assert response['Content-Type'] == 'application/json'
+    assert b''.join(response.streaming_content) == b'{"name":"Run"}'
@@ -0,0 +1,182 @@
+import datetime
+import json
+
+import numpy
+import pytest
+
+from fitness import streams
+
+
+def sample_points(count=3):
+    start = datetime.datetime(2017, 5, 4, 3, 2, 1, tzinfo=datetime.timezone.utc)
+    return [
+        {
+            'time': start + datetime.timedelta(seconds=i),
+            'latitude': 51.5 + i / 1000.0,
+            'longitude': -0.12 - i / 1000.0,
+            'altitude': 10.0 + i,
+            'distance': 3.0 * i,
+            'speed': 3.0,
+            'heart_rate': None if i % 2 else 130.0 + i,
+            'cadence': 85.0,
+        } for i in range(0, count)
+    ]
+
+
+def test_decompress():
+    good = {
+        'time': datetime.datetime(2017, 5, 4, 3, 2, 1)
+    }
+    bad = {
+        'time': '2017-05-04T03:02:01'
+    }
+    assert streams.decompress(good) == good
+    assert streams.decompress(bad) == good
+
+
+def test_from_points_sorts_and_offsets():
+    points = sample_points()
+    stream = streams.PointStream.from_points(reversed(points))
+    assert len(stream) == 3
+    assert stream.start == points[0]['time']
+    assert stream.column('time').tolist() == [0.0, 1.0, 2.0]
+    assert stream.times() == [a['time'] for a in points]
+    assert stream.valid('heart_rate').tolist() == [True, False, True]
+    assert stream.nonzero('heart_rate').tolist() == [True, False, True]
+
+
+def test_missing_columns():
+    stream = streams.PointStream.from_points([
+        {'time': '2017-05-04T03:02:01', 'distance': 0},
+        {'time': '2017-05-04T03:02:02', 'distance': 2},
+    ])
+    assert 'distance' in stream
+    assert 'heart_rate' not in stream
+    assert numpy.isnan(stream.column('heart_rate')).all()
+    assert stream.nonzero('distance').tolist() == [False, True]
+
+
+def test_round_trip():
+    points = sample_points(50)
+    encoded = streams.PointStream.from_points(points).encode()
+    decoded = streams.PointStream.decode(json.loads(json.dumps(encoded)))
+    assert len(decoded) == 50
+    assert decoded.start == points[0]['time']
+    for expected, actual in zip(points, decoded.points()):
+        assert actual['time'] == expected['time']
+        assert actual['heart_rate'] == expected['heart_rate']
+        for key in ('latitude', 'longitude', 'altitude', 'distance', 'speed', 'cadence'):
+            assert abs(actual[key] - expected[key]) < 1e-5
+
+
+def test_encoding_is_compact():
+    points = sample_points(1000)
+    legacy = json.dumps({a['time'].isoformat(): dict(a, time=a['time'].isoformat()) for a in points})
+    columnar = json.dumps(streams.PointStream.from_points(points).encode())
+    assert len(columnar) * 3 < len(legacy)
+
+
+def test_binary_round_trip():
+    points = sample_points(200)
+    points[5]['latitude'] = 51.123456789123
+    for point in points[:20]:
+        point['cadence'] = None
+    stream = streams.PointStream.from_points(points)
+    stream.columns['speed'][:] = numpy.nan
+    expected = streams.PointStream.decode(json.loads(json.dumps(stream.encode())))
+    data = stream.to_bytes()
+    assert data[:3] == b'PS\x02'
+    for decoded in (streams.PointStream.decode(data), streams.PointStream.decode(memoryview(data))):
+        assert decoded.start == expected.start
+        assert list(decoded.columns) == list(expected.columns)
+        for name, values in expected.columns.items():
+            assert numpy.array_equal(decoded.columns[name], values, equal_nan=True)
+
+
+def test_binary_is_compact():
+    points = sample_points(1000)
+    stream = streams.PointStream.from_points(points)
+    assert len(stream.to_bytes()) * 5 < len(json.dumps(stream.encode()))
+
+
+def test_binary_errors():
+    assert streams.PointStream.empty().to_bytes() is None
+    with pytest.raises(ValueError):
+        streams.PointStream.decode(b'{"version": 1}')
+
+
+def test_zigzag_deltas():
+    values = numpy.array([0, 5, 3, -2 ** 40, 2 ** 40], dtype=numpy.int64)
+    encoded = streams.zigzag_deltas(values)
+    assert encoded.dtype == numpy.uint64
+    assert streams.undo_zigzag_deltas(encoded).tolist() == values.tolist()
+    assert streams.zigzag_deltas(numpy.array([0, 1, -1, 100], dtype=numpy.int64)).dtype == numpy.uint8
+
+
+def test_decode_legacy():
+    points = sample_points()
+    stream = streams.PointStream.from_points(points)
+    legacy = {a['time'].isoformat(): dict(a, time=a['time'].isoformat()) for a in points}
+    decoded = streams.PointStream.decode(legacy)
+    assert decoded.points() == stream.points()
+    assert streams.PointStream.decode(stream.legacy()).points() == stream.points()
+
+
+def test_empty():
+    for data in (None, {}):
+        stream = streams.PointStream.decode(data)
+        assert len(stream) == 0
+        assert stream.points() == []
+        assert stream.encode() is None
+
+
+def test_bucket_means():
+    stream = streams.PointStream.from_points([
+        {
+            'time': datetime.datetime(2017, 4, 3, 2, 1, 5),
+            'distance': 1,
+            'speed': 3,
+            'cadence': None,
+        }, {
+            'time': datetime.datetime(2017, 4, 3, 2, 3, 5),
+            'distance': 3,
+            'cadence': None,
+        }, {
+            'time': datetime.datetime(2017, 4, 3, 2, 4, 5),
+            'distance': 5,
+            'speed': 3,
+            'cadence': None,
+        }, {
+            'time': datetime.datetime(2017, 4, 3, 2, 5, 5),
+            'distance': 9,
+            'speed': 6,
+            'cadence': None,
+        },
+    ])
+    means = stream.bucket_means(numpy.array([0, 2]))
+    assert sorted(means) == ['cadence', 'distance', 'speed']
+    assert means['distance'].tolist() == [1, 4]
+    assert means['speed'].tolist() == [3, 1.5]
+    assert means['cadence'].tolist() == [0, 0]
+    assert stream.bucket_means(numpy.array([3]))['distance'].tolist() == [4.5]
+
+
+def test_parse_time_fast_path(mocker):
+    texts = (
+        '2017-05-04T03:02:01',
+        '2017-05-04T03:02:01Z',
+        '2017-05-04T03:02:01.5Z',
+        '2017-05-04T03:02:01.123456789+01:00',
+        '2017-05-04 03:02:01-0530',
+    )
+    expected = [streams.dateutil.parser.parse(a) for a in texts]
+    parse = mocker.spy(streams.dateutil.parser, 'parse')
+    assert [streams.parse_time(a) for a in texts] == expected
+    assert parse.call_count == 0
+    assert streams.parse_time('2017-05-04T03:02:01Z').tzinfo == datetime.timezone.utc
+
+
+def test_parse_time_fallback(mocker):
+    parse = mocker.spy(streams.dateutil.parser, 'parse')
+    assert streams.parse_time('4 May 2017 03:02:01') == datetime.datetime(2017, 5, 4, 3, 2, 1)
+    assert parse.call_count == 1
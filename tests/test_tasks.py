@@ -0,0 +1,48 @@
+from fitness.tasks import TaskQueue
+
+
+def test_enqueue_collapses_waiting_tasks(mocker):
+    tasks = TaskQueue()
+    mocker.patch.object(tasks, 'start')
+    function = mocker.Mock()
+    assert tasks.enqueue('a', function, 1)
+    assert not tasks.enqueue('a', function, 2)
+    assert tasks.enqueue('b', function, 3)
+    tasks.run_next()
+    function.assert_called_once_with(1)
+    assert tasks.enqueue('a', function, 4)
+    tasks.run_next()
+    tasks.run_next()
+    assert [a[0] for a in function.call_args_list] == [(1,), (3,), (4,)]
+
+
+def test_failures_do_not_stop_the_worker(mocker):
+    tasks = TaskQueue()
+    failing = mocker.Mock(side_effect=ValueError)
+    working = mocker.Mock()
+    tasks.enqueue('failing', failing)
+    tasks.enqueue('working', working)
+    tasks.queue.join()
+    failing.assert_called_once_with()
+    working.assert_called_once_with()
+
+
+def test_dotted_path(mocker):
+    tasks = TaskQueue()
+    mocker.patch.object(tasks, 'start')
+    join = mocker.patch('os.path.join')
+    tasks.enqueue('path', 'os.path.join', 'a', 'b')
+    tasks.run_next()
+    join.assert_called_once_with('a', 'b')
+
+
+def test_queued(mocker):
+    tasks = TaskQueue()
+    mocker.patch.object(tasks, 'start')
+    running = []
+    assert tasks.enqueue('a', lambda: running.append(tasks.queued('a')))
+    assert tasks.queued('a')
+    assert not tasks.queued('b')
+    tasks.run_next()
+    assert running == [True]
+    assert not tasks.queued('a')
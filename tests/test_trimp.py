@@ -0,0 +1,50 @@
+import math
+
+import numpy
+
+from fitness import trimp
+
+
+def reference_trimp(times, heart_rates, minimum, maximum, gender):
+    exponent = 1.92 if gender == 'M' else 1.67
+    total = 0
+    last = None
+    for time, heart_rate in zip(times, heart_rates):
+        if not heart_rate or heart_rate != heart_rate:
+            continue
+        if last is not None:
+            minutes = (time - last[0]) / 60.0
+            reserve = max(((heart_rate + last[1]) / 2 - minimum) / (maximum - minimum), 0)
+            total += minutes * reserve * 0.64 * math.exp(exponent * reserve)
+        last = (time, heart_rate)
+    return total
+
+
+def random_stream(count, seed=3):
+    state = numpy.random.RandomState(seed)
+    times = numpy.cumsum(state.uniform(0.5, 5, count))
+    heart_rates = state.uniform(40, 200, count)
+    heart_rates[state.rand(count) < 0.1] = numpy.nan
+    heart_rates[state.rand(count) < 0.05] = 0
+    return times, heart_rates
+
+
+def test_intervals_line_up_with_stream():
+    intervals = trimp.trimp_intervals([0, 60, 120, 180], [100, None, 0, 160], 60, 190, 'F')
+    assert len(intervals) == 4
+    assert intervals[:3].tolist() == [0, 0, 0]
+    reserve = (130 - 60) / 130.0
+    assert abs(intervals[3] - 3 * reserve * 0.64 * math.exp(1.67 * reserve)) < 1e-12
+
+
+def test_too_few_readings():
+    assert trimp.trimp_intervals([], [], 60, 190, 'M').tolist() == []
+    assert trimp.trimp_intervals([0, 1], [None, 150], 60, 190, 'M').tolist() == [0, 0]
+    assert trimp.calculate_trimp([0, 1], [0, 150], 60, 190, 'M') == 0
+
+
+def test_matches_reference():
+    times, heart_rates = random_stream(5000)
+    for gender in ('M', 'F'):
+        expected = reference_trimp(times.tolist(), heart_rates.tolist(), 55, 185, gender)
+        assert abs(trimp.calculate_trimp(times, heart_rates, 55, 185, gender) - expected) < 1e-9 * expected
@@ -0,0 +1,42 @@
+import datetime
+
+from django.test import RequestFactory
+
+import fitness.views as views
+
+from factories import ActivityFactory, UserFactory
+
+
+def get_svg(mocker, **headers):
+    activity = ActivityFactory.build(
+        id=3, thumbnail='1.0,2.0 3.0,4.0',
+        stream_updated=datetime.datetime(2017, 4, 3, 2, 1, tzinfo=datetime.timezone.utc)
+    )
+    mocker.patch.object(views.ActivitySVG, 'get_object', return_value=activity)
+    request = RequestFactory().get('/fitness/activity_svg/3.svg', **headers)
+    request.user = activity.owner
+    response = views.ActivitySVG.as_view()(request, pk=3)
+    if hasattr(response, 'render'):
+        response.render()
+    return response
+
+
+def test_activity_svg(mocker):
+    response = get_svg(mocker)
+    assert response.status_code == 200
+    assert response['Content-Type'] == 'image/svg+xml'
+    assert 'max-age=604800' in response['Cache-Control']
+    assert response['Last-Modified'] == 'Mon, 03 Apr 2017 02:01:00 GMT'
+    content = response.content.decode()
+    assert content.startswith('<svg xmlns="http://www.w3.org/2000/svg"')
+    assert 'points="1.0,2.0 3.0,4.0"' in content
+    assert 'jquery' not in content
+    response = get_svg(mocker, HTTP_IF_NONE_MATCH=response['ETag'])
+    assert response.status_code == 304
+
+
+def test_activity_list_defers_stream():
+    view = views.ActivityList()
+    view.request = RequestFactory().get('/fitness/list/')
+    view.request.user = UserFactory.build(id=2)
+    assert '"stream"' not in str(view.get_queryset().query)
@@ -0,0 +1,263 @@
+import datetime
+import json
+import math
+
+import numpy
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django_mock_queries.query import MockSet
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+import fitness.models as models
+import fitness.serializers as serializers
+import fitness.viewsets as viewsets
+from fitness.streams import PointStream
+
+from factories import ActivityFactory, UserFactory
+from test_renderers import decode
+
+
+def mock_request(user):
+    request = APIRequestFactory().get('/')
+    request.user = user
+    return request
+
+
+def get_trimp(mocker, query):
+    user = UserFactory.build()
+    history = mocker.patch.object(models.TrainingStressBalance, 'history_for_user', return_value=[
+        models.TrainingStressBalancePoint(datetime.date(2017, 4, 3))
+    ])
+    request = APIRequestFactory().get('/api/trimp/', query)
+    force_authenticate(request, user=user)
+    response = viewsets.TrimpViewSet.as_view({'get': 'list'})(request)
+    return user, history, response
+
+
+def test_trimp_list(mocker):
+    user, history, response = get_trimp(mocker, {})
+    assert response.status_code == 200
+    assert response.data[0]['date'] == '2017-04-03'
+    history.assert_called_once_with(user, resolution='day')
+
+
+def test_trimp_list_range(mocker):
+    user, history, response = get_trimp(mocker, {
+        'start': '2017-01-01', 'end': '2017-03-31', 'resolution': 'week'
+    })
+    assert response.status_code == 200
+    history.assert_called_once_with(
+        user, start=datetime.date(2017, 1, 1), end=datetime.date(2017, 3, 31), resolution='week'
+    )
+
+
+def test_trimp_list_invalid(mocker):
+    for query in ({'start': 'yesterday'}, {'resolution': 'year'}):
+        user, history, response = get_trimp(mocker, query)
+        assert response.status_code == 400
+        assert history.call_count == 0
+
+
+def get_activity(mocker, query=None, **headers):
+    updated = datetime.datetime(2017, 4, 3, 2, 1, tzinfo=datetime.timezone.utc)
+    activity = ActivityFactory.build(id=3, updated=updated, stream_updated=updated)
+    mocker.patch.object(viewsets.ActivityViewSet, 'get_object', return_value=activity)
+    serializer = mocker.patch.object(viewsets.ActivityViewSet, 'get_serializer')
+    serializer.return_value.data = {'name': activity.name}
+    serializer.return_value.Meta = serializers.ActivityDetailSerializer.Meta
+    serializer.return_value.fields = {'name': None, 'geo_json': None, 'svg_points': None}
+    request = APIRequestFactory().get('/api/activities/3/', dict({'format': 'json'}, **query or {}), **headers)
+    force_authenticate(request, user=activity.owner)
+    return serializer, viewsets.ActivityViewSet.as_view({'get': 'retrieve'})(request, pk=3)
+
+
+def test_activity_retrieve_conditional(mocker):
+    load_stream = mocker.patch.object(models.Activity, 'load_stream')
+    serializer, response = get_activity(mocker)
+    assert response.status_code == 200
+    assert response['Last-Modified'] == 'Mon, 03 Apr 2017 02:01:00 GMT'
+    assert load_stream.call_count == 1
+    etag = response['ETag']
+    assert '-{}-'.format(models.GEO_JSON_VERSION) in etag
+    serializer, response = get_activity(mocker, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+    assert serializer.call_count == 0
+    assert load_stream.call_count == 1
+    mocker.patch.object(models, 'GEO_JSON_VERSION', models.GEO_JSON_VERSION + 1)
+    serializer, response = get_activity(mocker, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    serializer, response = get_activity(mocker, HTTP_IF_MODIFIED_SINCE='Mon, 03 Apr 2017 02:01:00 GMT')
+    assert response.status_code == 304
+    serializer, response = get_activity(mocker, HTTP_IF_MODIFIED_SINCE='Mon, 03 Apr 2017 02:00:59 GMT')
+    assert response.status_code == 200
+
+
+def test_activity_retrieve_streamed(mocker):
+    mocker.patch.object(models.Activity, 'geo_json', return_value=[{'type': 'Feature'}])
+    mocker.patch.object(models.Activity, 'svg_points', return_value=[[1.0, 2.0], [3.0, 4.0]])
+    serializer, response = get_activity(mocker)
+    etag = response['ETag']
+    serializer, response = get_activity(mocker, {'stream': '1'})
+    assert response.status_code == 200
+    assert response['ETag'] != etag
+    assert json.loads(b''.join(response.streaming_content).decode()) == {
+        'name': '', 'geo_json': [{'type': 'Feature'}], 'svg_points': [[1, 2], [3, 4]]
+    }
+    assert serializer.return_value.fields == {'name': None}
+    serializer, response = get_activity(mocker, {'stream': 'true'}, HTTP_IF_NONE_MATCH=response['ETag'])
+    assert response.status_code == 304
+
+
+def test_activity_retrieve_columns(mocker):
+    mocker.patch.object(models.Activity, 'reduced_points', return_value={
+        'time': numpy.array([0.0, 5.0]), 'latitude': numpy.array([51.0, 51.001]), 'speed': numpy.array([0, 3.5]),
+    })
+    mocker.patch.object(models, 'cache', LocMemCache('track_columns', {}))
+    load_stream = mocker.patch.object(models.Activity, 'load_stream')
+    serializer, response = get_activity(mocker)
+    etag = response['ETag']
+    serializer, response = get_activity(mocker, {'format': 'columns', 'stream': '1'})
+    response.render()
+    assert response.status_code == 200
+    assert response['Content-Type'] == 'application/vnd.fitness.columns'
+    assert response['ETag'] != etag
+    data = decode(response.content)
+    assert data['name'] == ''
+    assert data['track'] == {'time': [0, 5], 'latitude': [51.0, 51.001], 'speed': [0, 3.5]}
+    assert serializer.return_value.fields == {'name': None}
+    # Loaded once for the JSON detail and once to build the columns.
+    assert load_stream.call_count == 2
+    serializer, response = get_activity(mocker, {'format': 'columns'})
+    assert response.status_code == 200
+    assert load_stream.call_count == 2
+
+
+def test_activity_export(mocker):
+    start = datetime.datetime(2017, 4, 3, 7, 30)
+    activity = ActivityFactory.build(id=3, name='Hill Run', time=start, stream=PointStream.from_points([
+        {
+            'time': start + datetime.timedelta(seconds=i), 'distance': i * 3.0, 'speed': 3.0, 'altitude': 10.0,
+            'heart_rate': None, 'cadence': None, 'latitude': 51.0, 'longitude': -i / 1e4,
+        }
+        for i in range(1200)
+    ]).encode())
+    mocker.patch.object(viewsets.ActivityViewSet, 'get_object', return_value=activity)
+    request = APIRequestFactory().get('/api/activities/3/export/')
+    force_authenticate(request, user=activity.owner)
+    response = viewsets.ActivityViewSet.as_view({'get': 'export'})(request, pk=3)
+    assert response.status_code == 200
+    data = json.loads(b''.join(response.streaming_content).decode())
+    assert data['name'] == 'Hill Run'
+    assert data['time'] == '2017-04-03T07:30:00'
+    assert data['points'] == serializers.PointListField().to_representation(activity.points())
+    assert data['points'][1000] == {
+        'altitude': 10, 'cadence': None, 'distance': 3000, 'heart_rate': None,
+        'latitude': 51, 'longitude': -0.1, 'speed': 3, 'time': '2017-04-03T07:46:40',
+    }
+    request = APIRequestFactory().get('/api/activities/3/export/', HTTP_ACCEPT='application/vnd.fitness.columns')
+    force_authenticate(request, user=activity.owner)
+    response = viewsets.ActivityViewSet.as_view({'get': 'export'})(request, pk=3).render()
+    data = decode(response.content)
+    assert data['time'] == '2017-04-03T07:30:00'
+    assert data['columns']['distance'] == [i * 3.0 for i in range(1200)]
+    assert data['columns']['longitude'][1000] == -0.1
+    assert all(math.isnan(a) for a in data['columns']['heart_rate'])
+
+
+def test_activity_list_defers_stream():
+    user = UserFactory.build(id=2)
+    viewset = viewsets.ActivityViewSet(request=mock_request(user), action='list')
+    assert '"stream"' not in str(viewset.get_queryset().query)
+    viewset.action = 'retrieve'
+    assert '"stream"' not in str(viewset.get_queryset().query)
+    viewset.action = 'export'
+    assert '"stream"' in str(viewset.get_queryset().query)
+    viewset.action = 'samples'
+    query = str(viewset.get_queryset().query)
+    assert '"stream_pyramid"' in query
+    assert '"stream"' not in query
+
+
+def test_activity_samples(mocker):
+    activity = ActivityFactory.build(id=3)
+    mocker.patch.object(viewsets.ActivityViewSet, 'get_object', return_value=activity)
+    samples = mocker.patch.object(activity, 'samples', return_value={'size': 1, 'time': [0]})
+    view = viewsets.ActivityViewSet.as_view({'get': 'samples'})
+    request = APIRequestFactory().get('/api/activities/3/samples/', {'from': '60', 'to': '120.5'})
+    force_authenticate(request, user=activity.owner)
+    response = view(request, pk=3)
+    assert response.status_code == 200
+    assert response.data == {'size': 1, 'time': [0]}
+    samples.assert_called_once_with(60.0, 120.5, 500)
+    for query in ({'from': '120', 'to': '60'}, {'max_points': '1'}, {'to': 'end'}):
+        request = APIRequestFactory().get('/api/activities/3/samples/', query)
+        force_authenticate(request, user=activity.owner)
+        assert view(request, pk=3).status_code == 400
+    assert samples.call_count == 1
+
+
+def test_trimp_list_defers_stream(mocker):
+    user = UserFactory.build(id=2)
+    queries = []
+
+    def fetch(queryset):
+        queries.append(str(queryset.query))
+        queryset._result_cache = [ActivityFactory.build(time=datetime.datetime(2017, 4, 3), trimp=10)]
+
+    mocker.patch.object(models.ActivityQuerySet, '_fetch_all', autospec=True, side_effect=fetch)
+    mocker.patch.object(models.ActivityQuerySet, 'exists', return_value=False)
+    mocker.patch.object(models.ActivityQuerySet, 'aggregate', return_value={
+        'first': datetime.datetime(2017, 4, 3), 'last': datetime.datetime(2017, 4, 3)
+    })
+    mocker.patch.object(models.transaction, 'atomic')
+    mocker.patch.object(models.User, 'objects')
+    mocker.patch.object(models.TrainingStressBalanceDay, 'objects', MockSet())
+    request = APIRequestFactory().get('/api/trimp/')
+    force_authenticate(request, user=user)
+    response = viewsets.TrimpViewSet.as_view({'get': 'list'})(request)
+    assert response.status_code == 200
+    assert queries
+    assert all('"stream"' not in a for a in queries)
+
+
+def test_activity_upload(mocker):
+    user = UserFactory.build()
+    import_uploads = mocker.patch.object(viewsets.jobs, 'import_uploads', return_value=[
+        {'name': 'a.tcx', 'activities': [4], 'error': None}
+    ])
+    upload = viewsets.ActivityViewSet.as_view({'post': 'upload'})
+    files = [SimpleUploadedFile('a.tcx', b'<xml'), SimpleUploadedFile('b.gpx.gz', b'\x1f\x8b')]
+    request = APIRequestFactory().post('/api/activities/upload/', {'files': files}, format='multipart')
+    force_authenticate(request, user=user)
+    response = upload(request)
+    assert response.status_code == 201
+    assert response.data == {'files': [{'name': 'a.tcx', 'activities': [4], 'error': None}]}
+    assert [a.name for a in import_uploads.call_args[0][1]] == ['a.tcx', 'b.gpx.gz']
+    import_uploads.return_value = [{'name': 'a.tcx', 'activities': [], 'error': 'broken'}]
+    request = APIRequestFactory().post('/api/activities/upload/', {'files': files[:1]}, format='multipart')
+    force_authenticate(request, user=user)
+    assert upload(request).status_code == 400
+    request = APIRequestFactory().post('/api/activities/upload/', {}, format='multipart')
+    force_authenticate(request, user=user)
+    assert upload(request).status_code == 400
+
+
+def test_activity_batch(mocker):
+    user = UserFactory.build()
+    create_activities = mocker.patch.object(viewsets.jobs, 'create_activities', return_value=[
+        {'status': 'created', 'id': 4, 'errors': None}
+    ])
+    batch = viewsets.ActivityViewSet.as_view({'post': 'batch'})
+    request = APIRequestFactory().post('/api/activities/batch/', [{'name': 'Run'}], format='json')
+    force_authenticate(request, user=user)
+    response = batch(request)
+    assert response.status_code == 201
+    assert response.data == {'activities': [{'status': 'created', 'id': 4, 'errors': None}]}
+    create_activities.assert_called_once_with(user, [{'name': 'Run'}])
+    create_activities.return_value = [{'status': 'exists', 'id': 4, 'errors': None}]
+    request = APIRequestFactory().post('/api/activities/batch/', [{'name': 'Run'}], format='json')
+    force_authenticate(request, user=user)
+    assert batch(request).status_code == 200
+    request = APIRequestFactory().post('/api/activities/batch/', {'name': 'Run'}, format='json')
+    force_authenticate(request, user=user)
+    assert batch(request).status_code == 400